@@ -0,0 +1,211 @@
+"""
+Semantic answer cache for /ask.
+
+Readers of the same paper ask nearly the same questions ("what dataset was
+used?" / "which dataset do they use?"). Each paper (by index key, so every
+upload of the same PDF shares it) keeps a small matrix of normalized question
+embeddings with their answers. A new question reuses a stored answer when
+
+1. cosine similarity to a stored question >= ANSWER_CACHE_THRESHOLD, and
+2. retrieval returned the same chunks that answer was written from
+   (Jaccard >= ANSWER_CACHE_CHUNK_MATCH, 1.0 = identical sets),
+
+so the LLM call is skipped, not the retrieval (the query embedding is needed
+for retrieval anyway). Entries expire ANSWER_CACHE_TTL seconds after they
+were written and are evicted LRU past ANSWER_CACHE_PER_PAPER per paper /
+ANSWER_CACHE_MAX_ENTRIES overall.
+
+The entries live in each worker's memory. With a shared `state` backend
+(state.py), `invalidate()` also bumps a per-paper generation under the
+"answers" namespace; every worker compares it on lookup and store and drops
+its entries for that paper when it has moved on.
+
+Follow-ups that depend on the conversation ("why?", "what about the second
+one?") are never looked up or stored: the same words mean something else in
+another session.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from telemetry import CACHE_EVENTS, record_cache
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_CHUNK_MATCH = float(os.getenv("ANSWER_CACHE_CHUNK_MATCH", "1.0"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+ANSWER_CACHE_PER_PAPER = int(os.getenv("ANSWER_CACHE_PER_PAPER", "256"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "20000"))
+
+# Words that point back into the conversation ("this paper" / "they" usually mean the paper and its authors)
+_FOLLOW_UP = re.compile(
+    r"\b(?:(?:it|its|this|these|those)\b(?!\s+(?:paper|work|study|article|model|method)s?\b)"
+    r"|above|previous(?:ly)?|earlier|former|latter|the same|else|again|elaborate|expand|why"
+    r"|(?:first|second|third|last) one)\b",
+    re.IGNORECASE,
+)
+
+
+def is_follow_up(question: str, has_history: bool) -> bool:
+    """True if the answer could depend on earlier turns of this session."""
+    if not has_history:
+        return False
+    words = question.split()
+    return len(words) <= 3 or bool(_FOLLOW_UP.search(question))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class _PaperAnswers:
+    """Question vectors of one paper as a single matrix, so a lookup is one mat-vec."""
+
+    def __init__(self, dim: int, generation: int = 0):
+        self.generation = generation  # shared generation the entries were written under
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.entries = []  # parallel to vectors: dict(question, answer, chunks, created, used)
+
+    def drop(self, keep: np.ndarray):
+        self.vectors = self.vectors[keep]
+        self.entries = [e for e, k in zip(self.entries, keep) if k]
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, chunk_match: float = ANSWER_CACHE_CHUNK_MATCH,
+                 ttl: float = ANSWER_CACHE_TTL, per_paper: int = ANSWER_CACHE_PER_PAPER,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, state=None):
+        self.state = state  # shared backend (state.py) for cross-worker invalidation, or None
+        self.threshold = threshold
+        self.chunk_match = chunk_match
+        self.ttl = ttl
+        self.per_paper = per_paper
+        self.max_entries = max_entries
+        self._papers = OrderedDict()  # paper key -> _PaperAnswers, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evicted = 0
+
+    def lookup(self, paper_key: str, question_vector, chunks) -> str:
+        """Stored answer for a near-identical question over the same chunks, or None."""
+        q = self._normalize(question_vector)
+        chunks = frozenset(chunks)
+        now = time.time()
+        generation = self._generation(paper_key)
+        with self._lock:
+            answers = self._current(paper_key, generation)
+            answer = None
+            if answers is not None and answers.entries:
+                self._papers.move_to_end(paper_key)
+                self._expire(answers, now)
+                if answers.entries:
+                    sims = answers.vectors @ q
+                    for i in np.argsort(-sims):
+                        if sims[i] < self.threshold:
+                            break
+                        entry = answers.entries[i]
+                        if _jaccard(entry["chunks"], chunks) >= self.chunk_match:
+                            entry["used"] = now
+                            answer = entry["answer"]
+                            break
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache("answer", hit=answer is not None)
+        return answer
+
+    def store(self, paper_key: str, question: str, question_vector, chunks, answer: str):
+        q = self._normalize(question_vector)
+        now = time.time()
+        generation = self._generation(paper_key)
+        with self._lock:
+            answers = self._current(paper_key, generation)
+            if answers is None:
+                answers = self._papers[paper_key] = _PaperAnswers(q.shape[0], generation)
+            self._papers.move_to_end(paper_key)
+            answers.vectors = np.vstack([answers.vectors, q[None, :]])
+            answers.entries.append({"question": question, "answer": answer, "chunks": frozenset(chunks),
+                                    "created": now, "used": now})
+            self._size += 1
+
+            if len(answers.entries) > self.per_paper:
+                lru = int(np.argmin([e["used"] for e in answers.entries]))
+                keep = np.ones(len(answers.entries), dtype=bool)
+                keep[lru] = False
+                answers.drop(keep)
+                self._size -= 1
+                self.evicted += 1
+            # Over the global cap: drop whole least recently used papers
+            while self._size > self.max_entries and len(self._papers) > 1:
+                _, oldest = self._papers.popitem(last=False)
+                self._size -= len(oldest.entries)
+                self.evicted += len(oldest.entries)
+
+    def bypass(self):
+        """Count a question that skipped the cache because it was a follow-up."""
+        with self._lock:
+            self.bypassed += 1
+        CACHE_EVENTS.labels("answer", "bypass").inc()
+
+    def invalidate(self, paper_key: str) -> int:
+        """Forget every answer for one paper, in every worker. Returns how many this worker dropped."""
+        if self.state is not None:
+            self.state.set("answers", paper_key, str(self._generation(paper_key) + 1))
+        with self._lock:
+            answers = self._papers.pop(paper_key, None)
+            dropped = len(answers.entries) if answers else 0
+            self._size -= dropped
+            return dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "papers": len(self._papers),
+                "entries": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "bypassed_follow_ups": self.bypassed,
+                "evicted": self.evicted,
+                "threshold": self.threshold,
+                "chunk_match": self.chunk_match,
+                "ttl_seconds": self.ttl,
+            }
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm else v
+
+    def _generation(self, paper_key: str) -> int:
+        if self.state is None:
+            return 0
+        value = self.state.get("answers", paper_key)
+        return int(value) if value is not None else 0
+
+    def _current(self, paper_key: str, generation: int):
+        """This worker's answers for a paper, dropped first if another worker invalidated them. Call with the lock held."""
+        answers = self._papers.get(paper_key)
+        if answers is not None and answers.generation != generation:
+            del self._papers[paper_key]
+            self._size -= len(answers.entries)
+            answers = None
+        return answers
+
+    def _expire(self, answers: _PaperAnswers, now: float):
+        keep = np.array([now - e["created"] < self.ttl for e in answers.entries], dtype=bool)
+        if not keep.all():
+            self._size -= int((~keep).sum())
+            answers.drop(keep)
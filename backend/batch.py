@@ -0,0 +1,410 @@
+"""
+Offline batch summarization for whole directories of papers (backfills).
+
+    python batch.py ../papers --out summaries.jsonl
+    python batch.py manifest.txt --mode multi-agent --format parquet
+    python batch.py ../papers --batch-api      # OpenAI Batch API: half price, results within 24h
+
+Inputs are directories (every *.pdf below them), PDFs, or manifests: a .txt
+with one path per line, or a .jsonl with {"path": ..., "id": ...} per line.
+
+Papers flow through stages with their own limits, joined by bounded queues
+so a slow stage holds the others back instead of piling papers up in memory:
+
+    read + hash (io_pool)
+      -> extract pages (PDF process pool, one paper per process, CPU)
+      -> GROBID sections (multi-agent only, GROBID_CONCURRENCY, I/O)
+      -> LLM (--llm-papers papers at a time; every call still goes through
+         llm_scheduler's in-flight cap and tokens-per-minute budget)
+
+Everything the HTTP endpoints cache (pages, GROBID sections, section and
+final summaries) is shared, so papers already summarized online cost nothing.
+
+The output JSONL, appended and flushed one paper at a time, is also the
+checkpoint: re-running the same command skips papers whose content hash is
+already in it with status "ok" and retries the failed ones. `--format parquet`
+converts it to Parquet at the end (needs pyarrow).
+
+With --batch-api (summary mode), the final summary calls are sent as one
+Batch API job. Long papers are still map-reduced with live calls first. The
+job id is saved next to the output, so a re-run resumes polling instead of
+resubmitting.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from cache import paper_cache, hash_bytes
+from concurrency import io_pool, run_in_pool
+from pdf_extract import PDF_PROCESSES, submit_extract, shutdown_pool
+from ma_summarizer.grobid_client import GROBID_CONCURRENCY
+from pipelines import (run_summary_pipeline, run_multi_agent_pipeline, get_cached_summary,
+                       get_cached_multi_agent_result, summary_params, aget_sections, grobid_agent)
+from summarizer import aload_summary_text, acondense_paper_text, build_summary_messages, SUMMARY_MODEL
+from telemetry import request_trace, record_tokens
+from schemas import PaperSummary, response_format
+from structured import validate_json, is_partial
+
+BATCH_LLM_PAPERS = int(os.getenv("BATCH_LLM_PAPERS", "8"))
+BATCH_QUEUE_DEPTH = int(os.getenv("BATCH_QUEUE_DEPTH", "16"))
+PROGRESS_EVERY = 10  # papers between progress lines
+
+
+# -------------------------------
+# Inputs, output and checkpoint
+# -------------------------------
+def discover(inputs: list[str]) -> list[dict]:
+    """[{"id", "path"}] for every PDF in the given directories, files and manifests."""
+    items = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in sorted(os.walk(entry)):
+                items += [{"path": os.path.join(root, f)} for f in sorted(files) if f.lower().endswith(".pdf")]
+        elif entry.endswith(".jsonl"):
+            with open(entry, encoding="utf-8") as f:
+                items += [json.loads(line) for line in f if line.strip()]
+        elif entry.endswith(".txt"):
+            with open(entry, encoding="utf-8") as f:
+                items += [{"path": line.strip()} for line in f if line.strip()]
+        else:
+            items.append({"path": entry})
+    for item in items:
+        item.setdefault("id", os.path.splitext(os.path.basename(item["path"]))[0])
+    return items
+
+
+def run_params(args) -> dict:
+    """What makes two runs' results interchangeable."""
+    return {"mode": args.mode, "summary_type": args.summary_type if args.mode == "summary" else None}
+
+
+class ResultWriter:
+    """Append-only JSONL of finished papers; also the checkpoint a re-run resumes from."""
+
+    def __init__(self, path: str, params: dict):
+        self.path = path
+        self.params = params
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from a killed run
+                    if record.get("status") == "ok" and not record.get("partial") and all(record.get(k) == v for k, v in params.items()):
+                        self.done.add(record["content_hash"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, item: dict, status: str, **fields):
+        record = {"id": item["id"], "path": item["path"], "content_hash": item.get("content_hash"),
+                  **self.params, "status": status, **fields, "finished_at": time.time()}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if status == "ok" and not fields.get("partial"):
+            self.done.add(record["content_hash"])
+
+    def close(self):
+        self._file.close()
+
+
+def write_parquet(jsonl_path: str, parquet_path: str):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("[batch] pyarrow is not installed; results are in the JSONL only")
+        return
+    records = []
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # blank or torn line from a killed run
+    columns = {}  # every key of every record, in first-seen order: ok and failed rows have different fields
+    for record in records:
+        # Nested results (multi-agent sections, highlights) go in as JSON text
+        if not isinstance(record.get("result"), (str, type(None))):
+            record["result"] = json.dumps(record["result"], ensure_ascii=False)
+        columns.update(dict.fromkeys(record))
+    table = pa.Table.from_pydict({name: [record.get(name) for record in records] for name in columns})
+    pq.write_table(table, parquet_path)
+    print(f"[batch] Wrote {len(records)} rows to {parquet_path}")
+
+
+class Throughput:
+    def __init__(self, total: int):
+        self.total = total
+        self.start = time.monotonic()
+        self.ok = self.failed = self.skipped = 0
+        self.tokens = 0
+
+    def add(self, status: str, tokens: int = 0):
+        setattr(self, status, getattr(self, status) + 1)
+        self.tokens += tokens
+        if status != "skipped" and (self.ok + self.failed) % PROGRESS_EVERY == 0:
+            print(self.line())
+
+    def line(self) -> str:
+        minutes = max(time.monotonic() - self.start, 1e-9) / 60
+        return (f"[batch] {self.ok + self.failed + self.skipped}/{self.total} papers "
+                f"({self.ok} ok, {self.failed} failed, {self.skipped} already done) | "
+                f"{self.ok / minutes:.1f} papers/min, {self.tokens / minutes:,.0f} tokens/min")
+
+
+# -------------------------------
+# Pipeline stages
+# -------------------------------
+def _read_and_hash(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, hash_bytes(data)
+
+
+async def _extract_pages(item: dict):
+    """Parse the paper's pages into the paper cache (in its own process) unless they are there already."""
+    if paper_cache.get_json("pages", item["content_hash"]) is None:
+        pages = await asyncio.wrap_future(submit_extract(item["path"]))
+        paper_cache.put_json("pages", item["content_hash"], pages)
+
+
+def _cached_result(args, content_hash: str):
+    if args.mode == "summary":
+        return get_cached_summary(content_hash, args.summary_type)
+    return get_cached_multi_agent_result(content_hash)
+
+
+async def _stage(inq: asyncio.Queue, outq, workers: int, handle):
+    """Run `handle(item)` on `workers` tasks; its non-None results go to `outq`. Ends on a None item."""
+    async def worker():
+        while (item := await inq.get()) is not None:
+            result = await handle(item)
+            if result is not None and outq is not None:
+                await outq.put(result)
+        await inq.put(None)  # let the sibling workers see the end too
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if outq is not None:
+        await outq.put(None)
+
+
+async def run_pipeline(items: list[dict], args, writer: ResultWriter, stats: Throughput, llm_stage=None):
+    """
+    read/hash -> extract -> [GROBID] -> LLM for every item. `llm_stage(item)`
+    replaces the default LLM stage (the Batch API path uses it to collect requests).
+    """
+    to_extract = asyncio.Queue(BATCH_QUEUE_DEPTH)
+    to_grobid = asyncio.Queue(BATCH_QUEUE_DEPTH) if args.mode == "multi-agent" else None
+    to_llm = asyncio.Queue(BATCH_QUEUE_DEPTH)
+
+    def finish(item, status, tokens=0, **fields):
+        writer.write(item, status, **fields)
+        stats.add(status, tokens)
+        # Done with this paper: only id/path/hash stay in memory for the rest of the run
+        item.pop("data", None)
+        item.pop("sections", None)
+
+    def fail(item, stage, error):
+        print(f"[batch] ❌ {item['path']}: {stage} failed: {error}")
+        finish(item, "failed", stage=stage, error=str(error))
+
+    async def extract(item):
+        try:
+            item["data"], item["content_hash"] = await run_in_pool(io_pool, _read_and_hash, item["path"])
+            if item["content_hash"] in writer.done:
+                item.pop("data")
+                stats.add("skipped")
+                return None
+            cached = _cached_result(args, item["content_hash"])
+            if cached is not None:
+                return finish(item, "ok", result=cached, cached=True)
+            await _extract_pages(item)
+        except Exception as e:
+            return fail(item, "extract", e)
+        return item
+
+    async def grobid(item):
+        try:
+            item["sections"] = await aget_sections(item["data"], item["content_hash"])
+        except Exception as e:
+            return fail(item, "grobid", e)
+        return item
+
+    async def llm(item):
+        t0 = time.monotonic()
+        try:
+            with request_trace(f"batch:{args.mode}", paper=item["id"]) as trace:
+                if args.mode == "summary":
+                    result = await run_summary_pipeline(item["data"], item["content_hash"], args.summary_type)
+                else:
+                    result = await run_multi_agent_pipeline(item["data"], item["content_hash"], sections=item["sections"])
+        except Exception as e:
+            return fail(item, "llm", e)
+        # A partial result (fields that couldn't be repaired) is written but not checkpointed, so a re-run retries it
+        partial = result.get("partial", False) if isinstance(result, dict) else is_partial(result)
+        finish(item, "ok", trace.tokens_in + trace.tokens_out, result=result, partial=partial,
+               tokens_in=trace.tokens_in, tokens_out=trace.tokens_out, seconds=round(time.monotonic() - t0, 2))
+
+    async def feed():
+        for item in items:
+            await to_extract.put(item)
+        await to_extract.put(None)
+
+    stages = [feed(), _stage(to_llm, None, args.llm_papers, llm_stage or llm)]
+    if to_grobid is not None:
+        stages += [_stage(to_extract, to_grobid, PDF_PROCESSES, extract),
+                   _stage(to_grobid, to_llm, GROBID_CONCURRENCY, grobid)]
+    else:
+        stages.append(_stage(to_extract, to_llm, PDF_PROCESSES, extract))
+    await asyncio.gather(*stages)
+
+
+# -------------------------------
+# Batch API (summary mode)
+# -------------------------------
+def _to_openai_messages(messages) -> list[dict]:
+    roles = {"system": "system", "human": "user", "ai": "assistant"}
+    return [{"role": roles[m.type], "content": m.content} for m in messages]
+
+
+async def run_batch_api(items: list[dict], args, writer: ResultWriter, stats: Throughput):
+    """Extract and condense live, then send every final summary call as one Batch API job."""
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI()
+    state_path = args.out + ".batch.json"
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        print(f"[batch] Resuming Batch API job {state['batch_id']} ({len(state['papers'])} papers)")
+
+    if state is None:
+        requests, papers = [], {}
+
+        async def prepare(item):
+            try:
+                text = await aload_summary_text(item.pop("data"), item["content_hash"])
+                text, mode = await acondense_paper_text(text)  # long papers: live map-reduce first
+            except Exception as e:
+                print(f"[batch] ❌ {item['path']}: prepare failed: {e}")
+                writer.write(item, "failed", stage="prepare", error=str(e))
+                stats.add("failed")
+                return
+            custom_id = f"paper-{len(papers)}"
+            papers[custom_id] = {"id": item["id"], "path": item["path"], "content_hash": item["content_hash"], "mode": mode}
+            requests.append({
+                "custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                "body": {"model": SUMMARY_MODEL, "temperature": 0.05,
+                         "messages": _to_openai_messages(build_summary_messages(text, args.summary_type)),
+                         **({} if args.summary_type == "short" else {"response_format": response_format(PaperSummary)})},
+            })
+
+        await run_pipeline(items, args, writer, stats, llm_stage=prepare)
+        if not requests:
+            return
+
+        requests_path = args.out + ".batch-requests.jsonl"
+        with open(requests_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in requests)
+        with open(requests_path, "rb") as f:
+            uploaded = await client.files.create(file=f, purpose="batch")
+        job = await client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions",
+                                          completion_window="24h")
+        state = {"batch_id": job.id, "papers": papers}
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        print(f"[batch] Submitted Batch API job {job.id} with {len(requests)} requests")
+
+    while True:
+        job = await client.batches.retrieve(state["batch_id"])
+        counts = job.request_counts
+        print(f"[batch] Batch API job {job.id}: {job.status}"
+              + (f" ({counts.completed}/{counts.total} done)" if counts else ""))
+        if job.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        await asyncio.sleep(args.poll_seconds)
+
+    answered = set()
+    for file_id in (job.output_file_id, job.error_file_id):
+        if not file_id:
+            continue
+        content = await client.files.content(file_id)
+        for line in content.text.splitlines():
+            row = json.loads(line)
+            paper = state["papers"].get(row["custom_id"])
+            if paper is None:
+                continue
+            answered.add(row["custom_id"])
+            response = row.get("response") or {}
+            if response.get("status_code") != 200:
+                writer.write(paper, "failed", stage="batch_api", error=json.dumps(row.get("error") or response.get("body")))
+                stats.add("failed")
+                continue
+            body = response["body"]
+            summary = body["choices"][0]["message"]["content"]
+            usage = body.get("usage") or {}
+            record_tokens("summary_llm_batch", usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                          (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+            if args.summary_type != "short":
+                # No live model to repair with here: a broken answer is left uncached for a live re-run
+                summary, problems = validate_json(summary, PaperSummary)
+                if problems:
+                    writer.write(paper, "failed", stage="validate", error=json.dumps(problems))
+                    stats.add("failed")
+                    continue
+            paper_cache.put_json("summary", paper["content_hash"], summary, **summary_params(args.summary_type))
+            writer.write(paper, "ok", result=summary, batch_api=True, tokens_in=usage.get("prompt_tokens", 0),
+                         tokens_out=usage.get("completion_tokens", 0))
+            stats.add("ok", usage.get("total_tokens", 0))
+
+    for custom_id, paper in state["papers"].items():
+        if custom_id not in answered:
+            writer.write(paper, "failed", stage="batch_api", error=f"no result (job {job.status})")
+            stats.add("failed")
+    os.remove(state_path)
+
+
+# -------------------------------
+# CLI
+# -------------------------------
+async def main_async(args):
+    items = discover(args.inputs)[:args.limit]
+    writer = ResultWriter(args.out, run_params(args))
+    stats = Throughput(len(items))
+    print(f"[batch] {len(items)} papers, mode={args.mode}, {len(writer.done)} already done in {args.out}")
+    try:
+        if args.batch_api:
+            await run_batch_api(items, args, writer, stats)
+        else:
+            await run_pipeline(items, args, writer, stats)
+    finally:
+        writer.close()
+        await grobid_agent.client.aclose()
+        shutdown_pool()
+    print(stats.line())
+    if args.format == "parquet":
+        write_parquet(args.out, os.path.splitext(args.out)[0] + ".parquet")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="directories, PDFs, or .txt/.jsonl manifests")
+    parser.add_argument("--mode", choices=["summary", "multi-agent"], default="summary")
+    parser.add_argument("--summary-type", choices=["detailed", "short"], default="detailed")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL results, also the resume checkpoint")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--llm-papers", type=int, default=BATCH_LLM_PAPERS, help="papers in the LLM stage at once")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-api", action="store_true", help="summary mode: final calls via the OpenAI Batch API")
+    parser.add_argument("--poll-seconds", type=float, default=60)
+    args = parser.parse_args()
+    if args.batch_api and args.mode != "summary":
+        parser.error("--batch-api only supports --mode summary (multi-agent calls depend on each other)")
+    stats = asyncio.run(main_async(args))
+    sys.exit(1 if stats.failed else 0)
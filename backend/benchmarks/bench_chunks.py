@@ -0,0 +1,83 @@
+"""
+Benchmark: chunk metadata memory and hit -> PDF rectangle lookups.
+
+Every PDF in papers/ is repeated to `--min-pages` pages, split the way
+/upload_pdf_for_qa splits it, and stored twice:
+
+- "documents": one LangChain Document per chunk in an InMemoryDocstore plus
+  the row -> id dict (the old layout, with no page or box at all),
+- "table": chunk_store.ChunkTable (text once + 28-byte records with page,
+  offsets and box).
+
+Reports the retained memory of each (tracemalloc), bytes per chunk, the time
+to build the table (including page layout) and to `locate` random hits.
+
+    python -m benchmarks.bench_chunks --min-pages 200
+"""
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import pdf_extract
+from benchmarks.bench_extract import inflate
+from benchmarks.stubs import sample_pdfs
+from chunk_store import ChunkTable
+
+
+def retained(build):
+    """(result of build(), bytes it keeps alive)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def documents(chunks: list[str]):
+    ids = [str(i) for i in range(len(chunks))]
+    docstore = InMemoryDocstore({i: Document(page_content=c, metadata={}) for i, c in zip(ids, chunks)})
+    return docstore, dict(enumerate(ids))
+
+
+def main(args):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    print(f"{'paper':<32} {'chunks':>7} {'docs B/chunk':>13} {'table B/chunk':>14} {'boxes':>6} "
+          f"{'build':>8} {'locate':>9}")
+    for path in sample_pdfs():
+        pdf = inflate(path, args.min_pages)
+        pages = list(pdf_extract.iter_pages(pdf, workers=1))
+        chunks = splitter.split_text(pdf_extract.PAGE_SEPARATOR.join(pages))
+
+        # Fresh string copies, so the Documents are charged for their text like the table is
+        _, doc_bytes = retained(lambda: documents([(c + " ")[:-1] for c in chunks]))
+
+        t0 = time.perf_counter()
+        layout = pdf_extract.page_blocks(pdf)
+        table, table_bytes = retained(lambda: ChunkTable.from_chunks(pages, chunks, layout))
+        build = time.perf_counter() - t0
+
+        rows = [random.randrange(len(table)) for _ in range(args.lookups)]
+        t0 = time.perf_counter()
+        located = [table.locate(i) for i in rows]
+        per_lookup = (time.perf_counter() - t0) / len(rows)
+        boxed = sum(box is not None for _, box in located) / len(located)
+
+        n = len(chunks)
+        print(f"{os.path.basename(path)[:32]:<32} {n:>7} {doc_bytes / n:>13.0f} {table_bytes / n:>14.0f} "
+              f"{boxed:>6.0%} {build:>7.2f}s {per_lookup * 1e6:>7.2f}µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-pages", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=10000)
+    main(parser.parse_args())
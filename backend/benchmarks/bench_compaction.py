@@ -0,0 +1,66 @@
+"""
+Benchmark: summary input tokens before and after compaction.
+
+For every PDF in papers/ it reports the raw extracted tokens, the tokens
+after compaction with and without the reference list, and how long the
+compaction pass takes. It also prints the static prompt prefix of each
+summary prompt: OpenAI only caches prefixes of at least 1024 identical
+tokens, so those are the numbers to keep above the line.
+
+    python -m benchmarks.bench_compaction --repeat 20
+"""
+import argparse
+import time
+
+from benchmarks.stubs import sample_pdfs  # sets a stub OPENAI_API_KEY; nothing calls the API
+
+import pdf_extract
+from compaction import compact_pages
+from pdf_extract import PAGE_SEPARATOR
+from summarizer import count_tokens, summary_static_prompt
+from ma_summarizer.agents import SECTION_SYSTEM_PROMPT, AGGREGATOR_SYSTEM_PROMPT
+
+PREFIX_CACHE_MIN_TOKENS = 1024
+
+
+def time_ms(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000 * (time.perf_counter() - t0) / repeat
+
+
+def main(args):
+    print(f"{'paper':<45} {'raw':>7} {'compact':>8} {'no refs':>8} {'saved':>6} {'ms':>6}")
+    total_raw = total_keep = total_strip = 0
+    for path in sample_pdfs():
+        pages = pdf_extract.extract_range(path, 0, pdf_extract.page_count(path))
+        raw = count_tokens(PAGE_SEPARATOR.join(pages))
+        keep = count_tokens(compact_pages(pages, strip_refs=False))
+        strip = count_tokens(compact_pages(pages, strip_refs=True))
+        ms = time_ms(lambda: compact_pages(pages, strip_refs=True), args.repeat)
+        total_raw, total_keep, total_strip = total_raw + raw, total_keep + keep, total_strip + strip
+        name = path.rsplit("/", 1)[-1][:45]
+        print(f"{name:<45} {raw:>7} {keep:>8} {strip:>8} {1 - strip / raw:>6.0%} {ms:>6.1f}")
+    if total_raw:
+        print(f"{'total':<45} {total_raw:>7} {total_keep:>8} {total_strip:>8} {1 - total_strip / total_raw:>6.0%}")
+
+    print("\nStatic prompt prefixes (tokens; prefix caching needs >= "
+          f"{PREFIX_CACHE_MIN_TOKENS}):")
+    prefixes = {
+        "summary (detailed)": summary_static_prompt("detailed"),
+        "summary (short)": summary_static_prompt("short"),
+        "section": SECTION_SYSTEM_PROMPT,
+        # The template escapes JSON braces as {{ }}; count what the model actually sees
+        "aggregator": AGGREGATOR_SYSTEM_PROMPT.replace("{{", "{").replace("}}", "}"),
+    }
+    for name, text in prefixes.items():
+        tokens = count_tokens(text)
+        note = "cacheable" if tokens >= PREFIX_CACHE_MIN_TOKENS else "below cache minimum"
+        print(f"  {name:<20} {tokens:>6}  {note}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="compaction runs per paper for the timing column")
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+"""
+Load benchmark: N concurrent /summarize and /ask requests against a stubbed LLM.
+
+With the handlers on async paths the N-request wall time should be close to the
+single-request time rather than N times it.
+
+    python -m benchmarks.bench_concurrency --requests 16 --llm-delay 1.0
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.stubs import SlowFakeChatModel, fake_embeddings, sample_pdfs, unique_pdf_bytes
+
+os.environ.setdefault("PAPER_CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+os.environ.setdefault("INDEX_DIR", tempfile.mkdtemp(prefix="bench-index-"))
+os.environ.setdefault("CORPUS_DIR", tempfile.mkdtemp(prefix="bench-corpus-"))
+os.environ.setdefault("ANSWER_CACHE_THRESHOLD", "2")  # every request asks the same question; measure the LLM path
+
+import httpx
+
+import main
+import qa
+import summarizer
+
+
+def install_stubs(delay: float):
+    summarizer.llm = SlowFakeChatModel(delay=delay)
+    qa.llm = SlowFakeChatModel(delay=delay, response="stub answer")
+    qa.chain = qa.prompt | qa.llm
+    qa.conversation = qa.RunnableWithMessageHistory(
+        qa.chain, qa.get_session_history, input_messages_key="question", history_messages_key="history"
+    )
+    qa.embeddings = fake_embeddings()
+    qa.index_store.embeddings = qa.embeddings
+
+
+async def run_summaries(client, pdf_path, n, offset):
+    async def one(i):
+        files = {"pdf": ("paper.pdf", unique_pdf_bytes(pdf_path, offset + i), "application/pdf")}
+        r = await client.post("/summarize", files=files, data={"summary_type": "short"})
+        r.raise_for_status()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - t0
+
+
+async def run_asks(client, pdf_path, n):
+    files = {"file": ("paper.pdf", unique_pdf_bytes(pdf_path, -1), "application/pdf")}
+    r = await client.post("/upload_pdf_for_qa", files=files, data={"paper_id": "bench"})
+    r.raise_for_status()
+
+    async def one(i):
+        data = {"session_id": f"bench-{i}", "paper_id": "bench", "question": "What is the objective?"}
+        r = await client.post("/ask", data=data)
+        r.raise_for_status()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - t0
+
+
+async def main_async(args):
+    install_stubs(args.llm_delay)
+    pdf_path = sample_pdfs()[0]
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        single = await run_summaries(client, pdf_path, 1, offset=0)
+        many = await run_summaries(client, pdf_path, args.requests, offset=1)
+        ask_single = await run_asks(client, pdf_path, 1)
+        ask_many = await run_asks(client, pdf_path, args.requests)
+
+    print(f"/summarize  1 request : {single:.2f}s")
+    print(f"/summarize {args.requests} requests: {many:.2f}s  ({many / single:.2f}x single, serial would be ~{args.requests}x)")
+    print(f"/ask        1 request : {ask_single:.2f}s")
+    print(f"/ask       {args.requests} requests: {ask_many:.2f}s  ({ask_many / ask_single:.2f}x single)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--llm-delay", type=float, default=1.0, help="seconds each stubbed LLM call takes")
+    asyncio.run(main_async(parser.parse_args()))
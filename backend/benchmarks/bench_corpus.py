@@ -0,0 +1,139 @@
+"""
+Benchmark: corpus index ingest, query latency and recall as the corpus grows.
+
+Synthetic papers: each belongs to one of --topics clusters, and its chunk
+vectors are the topic centre plus a paper offset plus noise, so IVF lists
+behave roughly as they would on real embeddings. Every paper gets a year and
+one or two of 20 tags. At each checkpoint the benchmark reports:
+
+- ingest rate (papers/s, including SQLite writes and any shard re-training),
+- /corpus/ask retrieval latency p50/p99 against an exact NumPy scan of every
+  vector, and recall@k of the corpus index against that scan,
+- the same for a tag filter (~5% of papers) and a 10-paper id filter.
+
+At the end it deletes 10% of the papers and times a cold restart (snapshot
+load + replay of what changed since).
+
+    python -m benchmarks.bench_corpus --papers 10000 --chunks-per-paper 20 --dim 384
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import CorpusIndex
+
+TAGS = [f"tag-{i}" for i in range(20)]
+
+
+def synthetic_papers(args, rng: np.random.Generator):
+    topics = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    for p in range(args.papers):
+        centre = topics[rng.integers(args.topics)] + 0.5 * rng.standard_normal(args.dim).astype(np.float32)
+        vectors = centre + 0.8 * rng.standard_normal((args.chunks_per_paper, args.dim)).astype(np.float32)
+        texts = [f"paper {p} chunk {j}" for j in range(args.chunks_per_paper)]
+        yield p, texts, vectors
+
+
+def normalized(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def measure(corpus, vectors, labels, meta, args, rng, **filters):
+    """(p50 ms, p99 ms, exact p50 ms, recall@k) over --queries queries."""
+    allowed = np.ones(len(labels), dtype=bool)
+    if filters.get("tags"):
+        allowed = np.array([filters["tags"][0] in meta[p]["tags"] for p, _ in labels])
+    if filters.get("paper_ids"):
+        wanted = set(filters["paper_ids"])
+        allowed = np.array([f"paper-{p}" in wanted for p, _ in labels])
+    candidates = np.flatnonzero(allowed)
+
+    times, exact_times, recall = [], [], []
+    for _ in range(args.queries):
+        q = vectors[rng.choice(candidates)] + 0.3 * rng.standard_normal(args.dim).astype(np.float32)
+
+        t0 = time.perf_counter()
+        hits = corpus.search(q, k=args.k, **filters)
+        times.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        scores = vectors @ normalized(q)
+        scores[~allowed] = -np.inf
+        exact = np.argpartition(-scores, args.k)[:args.k]
+        exact_times.append(time.perf_counter() - t0)
+
+        truth = {(f"paper-{labels[i][0]}", labels[i][1]) for i in exact}
+        recall.append(len(truth & {(h["paper_id"], h["chunk"]) for h in hits}) / args.k)
+    ms = 1000 * np.array(times)
+    return np.median(ms), np.percentile(ms, 99), 1000 * np.median(exact_times), np.mean(recall)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    root = tempfile.mkdtemp(prefix="bench-corpus-")
+    corpus = CorpusIndex(root=root, n_shards=args.shards)
+    total = args.papers * args.chunks_per_paper
+    vectors = np.empty((total, args.dim), dtype=np.float32)  # normalized copy for the exact scan
+    labels, meta = [], {}
+    checkpoints = sorted(c for c in args.checkpoints if c <= args.papers)
+
+    print(f"{'papers':>7} {'vectors':>9} {'ingest/s':>9} | {'p50 ms':>7} {'p99 ms':>7} {'exact ms':>8} {'recall':>7} | "
+          f"{'tag p50':>7} {'recall':>7} | {'ids p50':>7} {'recall':>7}")
+    ingest_time, last = 0.0, 0
+    try:
+        for p, texts, paper_vectors in synthetic_papers(args, rng):
+            meta[p] = {"year": 2000 + p % 25, "tags": random.Random(p).sample(TAGS, 1 + p % 2)}
+            t0 = time.perf_counter()
+            corpus.add(f"paper-{p}", f"key-{p}", texts, paper_vectors, title=f"Paper {p}", **meta[p])
+            ingest_time += time.perf_counter() - t0
+
+            start = len(labels)
+            vectors[start:start + len(texts)] = normalized(paper_vectors)
+            labels.extend((p, j) for j in range(len(texts)))
+
+            if p + 1 in checkpoints:
+                n = p + 1
+                view = vectors[:len(labels)]
+                p50, p99, exact, recall = measure(corpus, view, labels, meta, args, rng)
+                tag_p50, _, _, tag_recall = measure(corpus, view, labels, meta, args, rng, tags=[TAGS[0]])
+                ids = [f"paper-{i}" for i in rng.choice(n, 10, replace=False)]
+                ids_p50, _, _, ids_recall = measure(corpus, view, labels, meta, args, rng, paper_ids=ids)
+                rate = (n - last) / ingest_time
+                print(f"{n:>7} {len(labels):>9,} {rate:>9.0f} | {p50:>7.2f} {p99:>7.2f} {exact:>8.2f} {recall:>7.0%} | "
+                      f"{tag_p50:>7.2f} {tag_recall:>7.0%} | {ids_p50:>7.2f} {ids_recall:>7.0%}")
+                ingest_time, last = 0.0, n
+
+        doomed = rng.choice(args.papers, args.papers // 10, replace=False)
+        t0 = time.perf_counter()
+        for p in doomed:
+            corpus.remove(f"paper-{p}")
+        per_delete = 1000 * (time.perf_counter() - t0) / max(len(doomed), 1)
+        gone = {f"paper-{p}" for p in doomed}
+        leaked = sum(h["paper_id"] in gone for _ in range(50)
+                     for h in corpus.search(vectors[rng.integers(len(labels))], k=args.k))
+        print(f"\ndeleted {len(doomed)} papers: {per_delete:.2f} ms each, {leaked} deleted chunks returned afterwards")
+
+        corpus.flush()
+        corpus.add("late-paper", "late-key", ["late chunk"], rng.standard_normal((1, args.dim)))
+        t0 = time.perf_counter()
+        CorpusIndex(root=root, n_shards=args.shards).search(vectors[0], k=args.k)
+        print(f"cold restart (snapshot load + replay of 1 new paper) to first answer: {time.perf_counter() - t0:.2f}s")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", type=int, default=10000)
+    parser.add_argument("--chunks-per-paper", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=384, help="1536 for text-embedding-ada-002 sized vectors")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--checkpoints", type=int, nargs="+", default=[1000, 2500, 5000, 10000])
+    main(parser.parse_args())
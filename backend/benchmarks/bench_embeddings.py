@@ -0,0 +1,49 @@
+"""
+Request count and wall time for embedding a paper's chunks through the shared
+EmbeddingService vs one request per chunk (the old HighlightAgent loop),
+against a fake embeddings API with a fixed per-request latency.
+
+    python -m benchmarks.bench_embeddings --chunks 500 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.stubs import FakeEmbeddingsAPI, fake_embeddings
+
+
+def per_chunk_baseline(texts, latency):
+    api = FakeEmbeddingsAPI(dim=1536, delay=latency, is_async=False)
+    t0 = time.perf_counter()
+    for text in texts:
+        api.create(model="fake", input=text)
+    return api.calls, time.perf_counter() - t0
+
+
+async def main_async(args):
+    # ~10% duplicates, like repeated captions / boilerplate
+    texts = [f"chunk {i % int(args.chunks * 0.9)} " + "lorem ipsum " * 80 for i in range(args.chunks)]
+
+    calls, elapsed = per_chunk_baseline(texts, args.latency)
+    print(f"one request per chunk : {calls:>5} requests, {elapsed:.2f}s")
+
+    service = fake_embeddings(delay=args.latency)
+    service.batch_size = args.batch_size
+    t0 = time.perf_counter()
+    matrix = await service.aembed_matrix(texts)
+    cold = time.perf_counter() - t0
+    print(f"EmbeddingService cold : {service._aclient.embeddings.calls:>5} requests, {cold:.2f}s "
+          f"-> {matrix.shape} {matrix.dtype}, {matrix.nbytes / 1e6:.1f} MB")
+
+    t0 = time.perf_counter()
+    await service.aembed_matrix(texts)
+    warm = time.perf_counter() - t0
+    print(f"EmbeddingService warm : {service._aclient.embeddings.calls:>5} requests total, {warm:.3f}s (disk cache)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake API request")
+    parser.add_argument("--batch-size", type=int, default=128, help="inputs per request")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,73 @@
+"""
+Benchmark: PDF text extraction, serial vs N worker processes.
+
+Every PDF in papers/ is extracted once serially (the old single-thread path)
+and once per worker count through pdf_extract.iter_pages. The sample papers
+are short, so each one is first repeated to `--min-pages` pages to look like
+a long paper or a scanned supplement.
+
+    python -m benchmarks.bench_extract --workers 2 4 8 --min-pages 200
+"""
+import argparse
+import os
+import time
+
+import fitz  # PyMuPDF
+
+import pdf_extract
+from benchmarks.stubs import sample_pdfs
+
+
+def inflate(path: str, min_pages: int) -> bytes:
+    """The PDF at `path`, repeated until it has at least `min_pages` pages."""
+    src = fitz.open(path)
+    out = fitz.open()
+    while out.page_count < min_pages:
+        out.insert_pdf(src)
+    data = out.tobytes()
+    out.close()
+    src.close()
+    return data
+
+
+def timed_pages(pdf: bytes, workers: int):
+    t0 = time.perf_counter()
+    pages = list(pdf_extract.iter_pages(pdf, workers=workers))
+    return pages, time.perf_counter() - t0
+
+
+def main(args):
+    pdf_extract.PARALLEL_MIN_PAGES = 0  # always take the parallel path when workers > 1
+    header = f"{'paper':<40} {'pages':>6} {'serial':>8}" + "".join(f" {f'{w}w':>8}" for w in args.workers)
+    print(header)
+
+    totals = {w: 0.0 for w in [1, *args.workers]}
+    total_pages = 0
+    for path in sample_pdfs():
+        pdf = inflate(path, args.min_pages)
+        serial, serial_t = timed_pages(pdf, 1)
+        totals[1] += serial_t
+        total_pages += len(serial)
+        row = f"{os.path.basename(path)[:40]:<40} {len(serial):>6} {serial_t:>7.2f}s"
+        for w in args.workers:
+            # Warm-up pass so process start-up isn't billed to the measured run
+            pdf_extract.PDF_PROCESSES = w
+            pdf_extract.shutdown_pool()
+            list(pdf_extract.iter_pages(pdf, workers=w))
+            pages, t = timed_pages(pdf, w)
+            assert pages == serial, "parallel extraction changed the text or page order"
+            totals[w] += t
+            row += f" {t:>7.2f}s"
+        print(row)
+
+    print()
+    print(f"{'throughput (pages/s)':<40} {total_pages:>6}" +
+          "".join(f" {total_pages / totals[w]:>8.0f}" for w in [1, *args.workers]))
+    pdf_extract.shutdown_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--min-pages", type=int, default=120)
+    main(parser.parse_args())
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark: summary-sentence -> chunk matching, old vs vectorized.
+
+"old" is the previous SummaryHighlighterAgent math: float64 similarity
+matrix, chunk norms recomputed per call, full argsort per row. "new" is
+ma_summarizer.highlighting (pre-normalized float32, blocked argmax /
+argpartition, FAISS above FAISS_MIN_CHUNKS). Embeddings are random, so this
+measures only the matching step.
+
+    python -m benchmarks.bench_highlight --sentences 200 --dim 1536
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ma_summarizer.highlighting import normalize_rows, top_k_similar
+
+
+def old_top_k(summary_matrix, chunk_matrix, top_k):
+    similarity_matrix = np.dot(summary_matrix, chunk_matrix.T) / (
+        np.linalg.norm(summary_matrix, axis=1, keepdims=True)
+        * np.linalg.norm(chunk_matrix, axis=1)
+    )
+    return [np.argsort(similarity_matrix[i])[::-1][:top_k] for i in range(len(summary_matrix))]
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    summary = rng.standard_normal((args.sentences, args.dim)).astype(np.float32)
+    print(f"{'chunks':>8} {'old (s)':>9} {'new (s)':>9} {'prep (s)':>9} {'speedup':>8}  agree")
+    for n_chunks in args.chunks:
+        chunks = rng.standard_normal((n_chunks, args.dim)).astype(np.float32)
+        # The old code received Python lists from embed_documents -> float64 arrays
+        old_idx, old_t = timed(old_top_k, summary.astype(np.float64), chunks.astype(np.float64), args.top_k)
+
+        chunk_matrix, prep_t = timed(normalize_rows, chunks)  # once per paper
+        (new_idx, _), new_t = timed(top_k_similar, normalize_rows(summary), chunk_matrix, args.top_k)
+
+        agree = np.mean([set(o) == set(n) for o, n in zip(old_idx, new_idx)])
+        print(f"{n_chunks:>8} {old_t:>9.3f} {new_t:>9.3f} {prep_t:>9.3f} {old_t / new_t:>7.1f}x  {agree:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=1)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    main(parser.parse_args())
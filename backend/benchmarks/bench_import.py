@@ -0,0 +1,111 @@
+"""
+Import-time budget for the API module.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and
+reports the median cumulative time of `main`, the slowest direct imports,
+and any heavy dependency that slipped back into the startup path (those must
+only load through warmup.py, after the server is up). Exits non-zero when
+the median is over `--budget-ms` or a heavy module is imported, so it can
+run in CI as a regression check.
+
+It also imports the lazily loaded services (`--offline-modules`, default
+pipelines) with the network blocked and counts tokens once, so nothing on
+the load path, e.g. tiktoken fetching its BPE file, may need a connection.
+
+    python -m benchmarks.bench_import --runs 5 --budget-ms 800
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Loaded by qa / pipelines only; `import main` must not pull them in
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_openai", "langchain_community", "langchain_text_splitters",
+                 "openai", "faiss", "lxml", "nltk", "numpy", "fitz", "tiktoken")
+
+# Prepended to the offline check: any connection attempt raises instead of going out
+_BLOCK_NETWORK = """
+import socket
+def _blocked(*args, **kwargs):
+    raise OSError("network access blocked by bench_import --offline-modules")
+socket.socket.connect = socket.socket.connect_ex = _blocked
+socket.create_connection = socket.getaddrinfo = _blocked
+"""
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module: str) -> list[tuple[str, int, int]]:
+    """(module, depth, cumulative µs) for every import made by `import <module>` in a fresh interpreter."""
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark-stub")}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            rows.append((name, (len(indent) - 1) // 2, int(cumulative)))
+    return rows
+
+
+def offline_import(module: str) -> str:
+    """None if `import <module>` and summarizer.count_tokens work with the network blocked, else the error output."""
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark-stub")}
+    code = f"{_BLOCK_NETWORK}\nimport {module}\nimport summarizer\nsummarizer.count_tokens('offline check')\n"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    return None if proc.returncode == 0 else proc.stderr[-2000:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "800")))
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--offline-modules", nargs="*", default=["pipelines"],
+                        help="modules that must import with the network blocked")
+    args = parser.parse_args()
+
+    totals, profile = [], None
+    for _ in range(args.runs):
+        profile = import_profile(args.module)
+        totals.append(next(us for name, depth, us in profile if name == args.module and depth == 0) / 1000)
+    median = statistics.median(totals)
+
+    print(f"import {args.module}: median {median:.0f} ms over {args.runs} runs "
+          f"(min {min(totals):.0f}, max {max(totals):.0f}), budget {args.budget_ms:.0f} ms")
+    print("\nslowest direct imports (last run):")
+    # importtime lists children before their parent: main's own imports are the depth-1 rows just above it
+    end = next(i for i, (name, depth, _) in enumerate(profile) if name == args.module and depth == 0)
+    start = max((i for i in range(end) if profile[i][1] == 0), default=-1) + 1
+    direct = sorted(((us, name) for name, depth, us in profile[start:end] if depth == 1), reverse=True)
+    for us, name in direct[:args.top]:
+        print(f"  {us / 1000:>8.1f} ms  {name}")
+
+    loaded = {name.split(".")[0] for name, _, _ in profile}
+    heavy = sorted(loaded.intersection(HEAVY_MODULES))
+    if heavy:
+        print(f"\nheavy modules imported at startup: {', '.join(heavy)}")
+
+    offline_failures = {}
+    for module in args.offline_modules:
+        error = offline_import(module)
+        print(f"\noffline import {module}: {'ok' if error is None else 'FAILED'}")
+        if error is not None:
+            offline_failures[module] = error
+            print(error)
+
+    ok = median <= args.budget_ms and not heavy and not offline_failures
+    print("\nOK" if ok else "\nFAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
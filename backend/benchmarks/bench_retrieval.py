@@ -0,0 +1,110 @@
+"""
+Benchmark: QA retrieval recall@k and latency, vectors only vs BM25 vs hybrid.
+
+Questions are generated from the PDFs in papers/: for a sampled chunk, take
+its rarest content terms (table values, acronyms, hyperparameter names) and
+ask "What does the paper say about <terms>?". A question is a hit when its
+source chunk (or a neighbour sharing the overlap) is in the top k.
+
+With `--embeddings fake` (default, offline) the vectors are deterministic
+noise, so the "vectors" row is a floor and the lexical side carries the
+hybrid; use `--embeddings openai` (needs OPENAI_API_KEY) for real numbers.
+Latency is search + context building only; the query embedding is cached
+by the embedding service and excluded.
+
+    python -m benchmarks.bench_retrieval --questions 40 --k 5 --chunks 1000
+"""
+import argparse
+import random
+import time
+
+from benchmarks.stubs import fake_embeddings, sample_pdfs
+
+import faiss
+import numpy as np
+
+import qa
+from embedding_service import EmbeddingService
+from ingest import load_pages
+from retrieval import BM25Index, HybridRetriever, OverlapReranker, tokenize
+
+
+def paper_chunks():
+    for path in sample_pdfs():
+        yield path, qa._split_text("\n".join(load_pages(path)), 1000, 100)
+
+
+def make_questions(chunks: list[str], n: int, rng: random.Random):
+    bm25 = BM25Index(chunks)
+    idf = {term: float(weights.max()) for term, (_, weights) in bm25.postings.items()}
+    questions = []
+    for i in rng.sample(range(len(chunks)), min(n, len(chunks))):
+        terms = sorted(set(tokenize(chunks[i])), key=lambda t: -idf.get(t, 0))[:3]
+        if terms:
+            questions.append((f"What does the paper say about {' '.join(terms)}?", i, set(terms)))
+    return questions
+
+
+def build_index(vectors: np.ndarray):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index
+
+
+def evaluate(retriever, questions, query_vectors, k):
+    hits, times = 0, []
+    for (question, gold, terms), qv in zip(questions, query_vectors):
+        t0 = time.perf_counter()
+        found = retriever.search(question, qv, k=k)
+        retriever.build_context(found)
+        times.append(time.perf_counter() - t0)
+        # The source chunk, or a neighbour that holds the same terms thanks to the overlap
+        hits += any(i == gold or (abs(i - gold) == 1 and terms <= set(tokenize(retriever.texts[i])))
+                    for i, _ in found)
+    return hits / max(len(questions), 1), 1000 * float(np.median(times)), 1000 * float(np.percentile(times, 99))
+
+
+def variants(texts, index):
+    return {
+        "vectors": HybridRetriever(texts, index, alpha=1.0),
+        "bm25": HybridRetriever(texts, index, alpha=0.0),
+        "hybrid": HybridRetriever(texts, index, alpha=0.5),
+        "hybrid+rerank": HybridRetriever(texts, index, alpha=0.5, reranker=OverlapReranker()),
+    }
+
+
+def main(args):
+    rng = random.Random(0)
+    embedder = fake_embeddings(delay=0) if args.embeddings == "fake" else EmbeddingService(qa.EMBEDDING_MODEL)
+
+    print(f"{'paper':<40} {'chunks':>6} " + " ".join(f"{name:>14}" for name in variants([], None)))
+    all_chunks = []
+    for path, chunks in paper_chunks():
+        all_chunks.extend(chunks)
+        questions = make_questions(chunks, args.questions, rng)
+        index = build_index(embedder.embed_matrix(chunks))
+        query_vectors = embedder.embed_matrix([q for q, _, _ in questions])
+        row = f"{path.rsplit('/', 1)[-1][:40]:<40} {len(chunks):>6} "
+        for retriever in variants(chunks, index).values():
+            recall, _, _ = evaluate(retriever, questions, query_vectors, args.k)
+            row += f" {recall:>13.0%}"
+        print(row)
+
+    # Latency on a paper-sized index of --chunks chunks
+    texts = (all_chunks * (args.chunks // max(len(all_chunks), 1) + 1))[:args.chunks]
+    index = build_index(embedder.embed_matrix(texts))
+    questions = make_questions(texts, 200, rng)
+    query_vectors = embedder.embed_matrix([q for q, _, _ in questions])
+    print(f"\nlatency over {len(texts)} chunks (search + context), ms")
+    for name, retriever in variants(texts, index).items():
+        _, p50, p99 = evaluate(retriever, questions, query_vectors, args.k)
+        print(f"  {name:<14} p50 {p50:6.2f}   p99 {p99:6.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40, help="per paper")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--embeddings", choices=["fake", "openai"], default="fake")
+    main(parser.parse_args())
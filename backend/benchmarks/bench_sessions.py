@@ -0,0 +1,102 @@
+"""
+Benchmark: /ask prompt size and latency vs conversation length.
+
+"old" replays an unbounded InMemoryChatMessageHistory in which every human
+turn carries its 5 retrieved chunks. "new" is the qa.py setup: per-turn
+context only, history windowed to HISTORY_TOKEN_BUDGET by sessions.py.
+The fake model charges `--ms-per-1k` of latency per 1k prompt tokens, so
+latency tracks prompt size the way prefill does.
+
+    python -m benchmarks.bench_sessions --turns 50 --ms-per-1k 30
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.stubs import SlowFakeChatModel, sample_pdfs
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+import qa
+from ingest import load_pages
+from sessions import SessionStore
+from summarizer import count_tokens
+
+ANSWER = " ".join(["The paper reports a clear improvement over the baseline."] * 6)
+
+
+class PrefillChatModel(SlowFakeChatModel):
+    """Fake model whose latency grows with prompt tokens; records each prompt size."""
+
+    ms_per_1k: float = 30.0
+    prompt_tokens: list = []
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        n = sum(count_tokens(m.content) for m in messages)
+        self.prompt_tokens.append(n)
+        await asyncio.sleep(self.delay + n / 1000 * self.ms_per_1k / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+
+def old_conversation(model):
+    store = {}
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful research assistant."),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{question}"),
+    ])
+    return RunnableWithMessageHistory(
+        prompt | model, lambda sid: store.setdefault(sid, InMemoryChatMessageHistory()),
+        input_messages_key="question", history_messages_key="history",
+    )
+
+
+def new_conversation(model):
+    store = SessionStore(count_tokens=count_tokens)
+    return RunnableWithMessageHistory(
+        qa.prompt | model, store.get, input_messages_key="question", history_messages_key="history",
+    )
+
+
+async def run(kind: str, turns: int, chunks: list[str], args):
+    model = PrefillChatModel(delay=args.llm_delay, ms_per_1k=args.ms_per_1k, response=ANSWER)
+    conversation = old_conversation(model) if kind == "old" else new_conversation(model)
+    rng = random.Random(0)
+    latencies = []
+    for turn in range(turns):
+        question = f"Question {turn}: what does the paper say about point {turn}?"
+        context = "\n\n".join(rng.sample(chunks, 5))
+        if kind == "old":
+            payload = {"question": f"Here are the relevant parts of the research paper:\n\n{context}\n\nQuestion: {question}"}
+        else:
+            payload = {"question": question, "context": context}
+        t0 = time.perf_counter()
+        await conversation.ainvoke(payload, config={"configurable": {"session_id": "bench"}})
+        latencies.append(time.perf_counter() - t0)
+    return model.prompt_tokens, latencies
+
+
+async def main_async(args):
+    chunks = qa._split_text("\n".join(load_pages(sample_pdfs()[0])), 1000, 100)
+    old_tokens, old_lat = await run("old", args.turns, chunks, args)
+    new_tokens, new_lat = await run("new", args.turns, chunks, args)
+
+    print(f"{'turn':>5} {'old tokens':>11} {'new tokens':>11} {'old s':>7} {'new s':>7}")
+    for turn in sorted({1, 2, 5, 10, 20, 50, 100, args.turns}):
+        if turn <= args.turns:
+            i = turn - 1
+            print(f"{turn:>5} {old_tokens[i]:>11,} {new_tokens[i]:>11,} {old_lat[i]:>7.3f} {new_lat[i]:>7.3f}")
+    print(f"{'total':>5} {sum(old_tokens):>11,} {sum(new_tokens):>11,} {sum(old_lat):>7.2f} {sum(new_lat):>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--llm-delay", type=float, default=0.05)
+    parser.add_argument("--ms-per-1k", type=float, default=30.0)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""
+Benchmark: GROBID TEI parsing, old tree parser vs streaming iterparse.
+
+"old" is the previous GrobidSectionAgent parsing: a full lxml tree, every
+div's text taken with itertext() over its whole subtree, then flattened,
+so parent sections repeat their subsections' text. "new" is
+ma_summarizer.tei.iter_tei_sections. backend/output.tei.xml is scaled up by
+repeating its <body> divs, and each run happens in a fresh process so peak RSS
+is comparable.
+
+    python -m benchmarks.bench_tei --scales 1 10 100
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import resource
+import time
+
+from lxml import etree
+
+from ma_summarizer.tei import parse_tei_sections
+
+TEI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output.tei.xml")
+
+
+def old_parse(xml_text: str) -> list[dict]:
+    def parse_div(div):
+        heading = div.findtext("{*}head")
+        return {
+            "heading": heading.strip() if heading else "Untitled",
+            "content": " ".join(list(div.itertext())).strip(),
+            "subsections": [parse_div(d) for d in div.findall("{*}div")],
+        }
+
+    root = etree.fromstring(xml_text.encode("utf-8"))
+    body = root.find(".//{*}body")
+    sections = [parse_div(div) for div in body.findall("{*}div")] if body is not None else []
+
+    flat = []
+
+    def walk(sec):
+        if sec["content"].strip():
+            flat.append({"heading": sec["heading"], "content": sec["content"]})
+        for s in sec["subsections"]:
+            walk(s)
+
+    for s in sections:
+        walk(s)
+    return flat
+
+
+def scaled_tei(scale: int) -> str:
+    with open(TEI_PATH, encoding="utf-8") as f:
+        xml_text = f.read()
+    match = re.search(r"(<body>)(.*?)(</body>)", xml_text, re.S)
+    return xml_text[:match.start(2)] + match.group(2) * scale + xml_text[match.end(2):]
+
+
+def _run(parser: str, scale: int, queue):
+    xml_text = scaled_tei(scale)
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    sections = old_parse(xml_text) if parser == "old" else parse_tei_sections(xml_text)
+    elapsed = time.perf_counter() - t0
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_kb
+    queue.put((elapsed, peak_kb, len(sections), sum(len(s["content"]) for s in sections)))
+
+
+def measure(parser: str, scale: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run, args=(parser, scale, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main(args):
+    print(f"{'scale':>6} {'MB':>6} | {'old s':>7} {'old +MB':>8} {'old chars':>11} | "
+          f"{'new s':>7} {'new +MB':>8} {'new chars':>11} | {'tokens saved':>12}")
+    for scale in args.scales:
+        size_mb = len(scaled_tei(scale).encode("utf-8")) / 1e6
+        old_t, old_kb, _, old_chars = measure("old", scale)
+        new_t, new_kb, _, new_chars = measure("new", scale)
+        saved = 1 - new_chars / old_chars if old_chars else 0
+        print(f"{scale:>6} {size_mb:>6.1f} | {old_t:>7.3f} {old_kb / 1024:>8.1f} {old_chars:>11,} | "
+              f"{new_t:>7.3f} {new_kb / 1024:>8.1f} {new_chars:>11,} | {saved:>11.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Time-to-first-byte benchmark for the streaming endpoints against a fake
+streaming LLM. Compares the blocking endpoint (first byte == full response)
+with its /stream twin (first byte == first SSE token).
+
+    python -m benchmarks.bench_ttfb --llm-delay 5 --first-token-delay 0.3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.stubs import SlowFakeChatModel, fake_embeddings, sample_pdfs, unique_pdf_bytes
+
+os.environ.setdefault("PAPER_CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+os.environ.setdefault("INDEX_DIR", tempfile.mkdtemp(prefix="bench-index-"))
+os.environ.setdefault("CORPUS_DIR", tempfile.mkdtemp(prefix="bench-corpus-"))
+os.environ.setdefault("ANSWER_CACHE_THRESHOLD", "2")  # every request asks the same question; measure the LLM path
+
+import httpx
+
+import main
+import qa
+import summarizer
+
+RESPONSE = " ".join(f"token{i}" for i in range(200))
+
+
+def install_stubs(delay: float, first_token_delay: float):
+    fake = SlowFakeChatModel(delay=delay, first_token_delay=first_token_delay, response=RESPONSE)
+    summarizer.llm = fake
+    qa.llm = fake
+    qa.chain = qa.prompt | qa.llm
+    qa.conversation = qa.RunnableWithMessageHistory(
+        qa.chain, qa.get_session_history, input_messages_key="question", history_messages_key="history"
+    )
+    qa.embeddings = fake_embeddings()
+    qa.index_store.embeddings = qa.embeddings
+
+
+async def time_request(client, url, files=None, data=None):
+    """Return (ttfb, total) where ttfb is the time to the first token event (or the whole body)."""
+    t0 = time.perf_counter()
+    ttfb = None
+    async with client.stream("POST", url, files=files, data=data) as r:
+        r.raise_for_status()
+        streaming = r.headers.get("content-type", "").startswith("text/event-stream")
+        async for line in r.aiter_lines():
+            if ttfb is None and (not streaming or line.startswith("event: token")):
+                ttfb = time.perf_counter() - t0
+    total = time.perf_counter() - t0
+    return ttfb if ttfb is not None else total, total
+
+
+async def main_async(args):
+    install_stubs(args.llm_delay, args.first_token_delay)
+    pdf_path = sample_pdfs()[0]
+    transport = httpx.ASGITransport(app=main.app)
+    rows = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for i, url in enumerate(["/summarize", "/summarize/stream"]):
+            files = {"pdf": ("paper.pdf", unique_pdf_bytes(pdf_path, i), "application/pdf")}
+            rows.append((url, *await time_request(client, url, files=files, data={"summary_type": "short"})))
+
+        files = {"file": ("paper.pdf", unique_pdf_bytes(pdf_path, 99), "application/pdf")}
+        (await client.post("/upload_pdf_for_qa", files=files, data={"paper_id": "bench"})).raise_for_status()
+        for url in ["/ask", "/ask/stream"]:
+            data = {"session_id": "bench", "paper_id": "bench", "question": "What is the objective?"}
+            rows.append((url, *await time_request(client, url, data=data)))
+
+    print(f"{'endpoint':<22}{'TTFB (s)':>10}{'total (s)':>11}")
+    for url, ttfb, total in rows:
+        print(f"{url:<22}{ttfb:>10.2f}{total:>11.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-delay", type=float, default=5.0, help="seconds for the full fake completion")
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,149 @@
+"""
+Throughput of /ask vs number of API workers sharing one state backend.
+
+Starts `uvicorn --workers N` for each N with the app from `create_app` below
+(fake LLM and embeddings). Every request burns `--cpu-ms` of CPU inside the
+fake model, standing in for the prompt building, retrieval and parsing that
+holds the GIL in a real request, so one process tops out and more workers
+should scale until the cores run out. The paper is uploaded once, through
+whichever worker takes the request, and every /ask after that may land on any
+worker: a non-zero "404s" column means state isn't shared.
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --requests 400 --concurrency 32 --cpu-ms 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def create_app():
+    """uvicorn factory run in each worker process: the real app with offline models."""
+    from benchmarks.stubs import SlowFakeChatModel, fake_embeddings
+
+    import main
+    import qa
+
+    cpu_seconds = float(os.environ["BENCH_CPU_MS"]) / 1000
+
+    class CPUBoundChatModel(SlowFakeChatModel):
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            end = time.process_time() + cpu_seconds
+            while time.process_time() < end:
+                pass
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    qa.llm = CPUBoundChatModel(delay=float(os.environ["BENCH_LLM_DELAY"]), response="The objective is stated in the abstract.")
+    qa.chain = qa.prompt | qa.llm
+    qa.conversation = qa.RunnableWithMessageHistory(
+        qa.chain, qa.get_session_history, input_messages_key="question", history_messages_key="history"
+    )
+    qa.embeddings = fake_embeddings()
+    qa.index_store.embeddings = qa.embeddings
+    return main.app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(client, proc, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("server did not start")
+
+
+async def run_load(client, n_requests: int, concurrency: int, run: int):
+    sem = asyncio.Semaphore(concurrency)
+    statuses = []
+
+    async def one(i):
+        async with sem:
+            # A new session per request, so no answer is replayed from history
+            data = {"session_id": f"w{run}-{i}", "paper_id": "bench", "question": f"What is objective number {i}?"}
+            statuses.append((await client.post("/ask", data=data)).status_code)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    return time.perf_counter() - t0, statuses
+
+
+async def bench(workers: int, args, pdf_bytes: bytes, uploaded: bool):
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.bench_workers:create_app", "--factory",
+         "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None,
+                                     limits=httpx.Limits(max_connections=args.concurrency)) as client:
+            await wait_ready(client, proc)
+            if not uploaded:
+                files = {"file": ("paper.pdf", pdf_bytes, "application/pdf")}
+                (await client.post("/upload_pdf_for_qa", files=files, data={"paper_id": "bench"})).raise_for_status()
+            await run_load(client, args.concurrency, args.concurrency, run=-workers)  # warm-up
+            elapsed, statuses = await run_load(client, args.requests, args.concurrency, run=workers)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return args.requests / elapsed, statuses.count(404), sum(s >= 500 for s in statuses)
+
+
+async def main_async(args):
+    from benchmarks.stubs import sample_pdfs
+
+    data_dir = tempfile.mkdtemp(prefix="bench-workers-")
+    os.environ.update({
+        "STATE_BACKEND": args.state_backend,
+        "STATE_PATH": os.path.join(data_dir, "state.db"),
+        "STATE_PREFIX": f"bench-{os.getpid()}:",
+        "PAPER_CACHE_DIR": os.path.join(data_dir, "cache"),
+        "INDEX_DIR": os.path.join(data_dir, "indexes"),
+        "CORPUS_DIR": os.path.join(data_dir, "corpus"),
+        "JOBS_DIR": os.path.join(data_dir, "jobs"),
+        "ANSWER_CACHE_THRESHOLD": "2",  # measure the LLM path, not cache hits
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark-stub"),
+        "BENCH_CPU_MS": str(args.cpu_ms),
+        "BENCH_LLM_DELAY": str(args.llm_delay),
+    })
+    with open(sample_pdfs()[0], "rb") as f:
+        pdf_bytes = f.read()
+
+    print(f"state backend: {args.state_backend}, {args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.cpu_ms:.0f} ms CPU + {args.llm_delay:.2f}s wait per answer")
+    print(f"{'workers':>8}{'req/s':>10}{'speed-up':>10}{'404s':>7}{'5xx':>6}")
+    base = None
+    for i, workers in enumerate(args.workers):
+        rps, not_found, errors = await bench(workers, args, pdf_bytes, uploaded=i > 0)
+        base = base or rps
+        print(f"{workers:>8}{rps:>10.1f}{rps / base:>9.2f}x{not_found:>7}{errors:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cpu-ms", type=float, default=20.0, help="CPU time per answer, holding the GIL")
+    parser.add_argument("--llm-delay", type=float, default=0.1, help="seconds of (non-blocking) model latency")
+    parser.add_argument("--state-backend", default="sqlite", choices=["sqlite", "redis"])
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""
+Offline stand-ins for the OpenAI models so benchmarks measure our pipeline,
+not the provider. Import this module *before* main/summarizer/qa: it sets a
+dummy API key so the real clients can still be constructed at import time.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-stub")
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+PAPERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "papers")
+
+
+class SlowFakeChatModel(BaseChatModel):
+    """
+    Chat model that sleeps `delay` seconds and returns a canned response.
+    When streamed, the first token arrives after `first_token_delay` and the
+    rest are spread evenly over the remaining time.
+    """
+
+    delay: float = 0.5
+    first_token_delay: float = 0.1
+    response: str = '{"name_of_research_paper": "stub", "key_findings": "stub"}'
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self.response.split(" ")
+        gap = max(self.delay - self.first_token_delay, 0) / max(len(tokens) - 1, 1)
+        await asyncio.sleep(self.first_token_delay)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(gap)
+                token = " " + token
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def fake_vector(text: str, dim: int) -> np.ndarray:
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class FakeEmbeddingsAPI:
+    """Mimics `client.embeddings` (sync or async) with deterministic vectors and a per-request delay."""
+
+    def __init__(self, dim: int, delay: float, is_async: bool):
+        self.dim, self.delay, self.is_async = dim, delay, is_async
+        self.calls = 0
+
+    def _response(self, input):
+        self.calls += 1
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_vector(t, self.dim).tolist()) for i, t in enumerate(input)
+        ])
+
+    def create(self, model, input):
+        if self.is_async:
+            return self._acreate(input)
+        time.sleep(self.delay)
+        return self._response(input)
+
+    async def _acreate(self, input):
+        await asyncio.sleep(self.delay)
+        return self._response(input)
+
+
+def fake_embeddings(dim: int = 1536, delay: float = 0.05):
+    """An EmbeddingService whose OpenAI clients are replaced by FakeEmbeddingsAPI (fresh, empty cache)."""
+    from embedding_service import EmbeddingService
+
+    service = EmbeddingService(model="fake-embedding", cache_dir=tempfile.mkdtemp(prefix="bench-embed-"))
+    service._client = SimpleNamespace(embeddings=FakeEmbeddingsAPI(dim, delay, is_async=False))
+    service._aclient = SimpleNamespace(embeddings=FakeEmbeddingsAPI(dim, delay, is_async=True))
+    return service
+
+
+def sample_pdfs():
+    return sorted(
+        os.path.join(PAPERS_DIR, name) for name in os.listdir(PAPERS_DIR) if name.endswith(".pdf")
+    )
+
+
+def unique_pdf_bytes(path: str, i: int) -> bytes:
+    """Same PDF with a trailing comment so every request gets its own content hash."""
+    with open(path, "rb") as f:
+        return f.read() + f"\n%bench-{i}\n".encode()
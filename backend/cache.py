@@ -0,0 +1,193 @@
+"""
+Content-addressed disk cache for everything we derive from an uploaded PDF.
+
+Entries are keyed by the SHA-256 of the PDF bytes plus the parameters that
+change the result (summary type, model, chunk size, prompt version, ...), so
+re-uploading the same paper skips extraction, GROBID, embeddings and LLM calls.
+
+Layout on disk:
+    <root>/<kind>/<key[:2]>/<key>.json   (text, sections, summaries, chunks)
+    <root>/<kind>/<key[:2]>/<key>.npy    (embeddings)
+
+Eviction is LRU by file mtime (bumped on every hit) with a total size cap.
+API workers share the directory, and each one only counts its own writes,
+so the size is re-read from disk every PAPER_CACHE_RESCAN_SECONDS and
+before evicting.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from telemetry import record_cache
+
+CACHE_DIR = os.getenv("PAPER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "papers"))
+CACHE_MAX_BYTES = int(os.getenv("PAPER_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # 2 GB
+CACHE_RESCAN_SECONDS = float(os.getenv("PAPER_CACHE_RESCAN_SECONDS", "60"))  # pick up other workers' writes
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(content_hash: str, kind: str, **params) -> str:
+    """Combine the content hash with the parameters that matter for `kind`."""
+    payload = json.dumps({"hash": content_hash, "kind": kind, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PaperCache:
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        # Measured on the first write (or stats call), not here: `paper_cache` is built while
+        # main.py is imported, and walking a large cache would stall startup
+        self._size = None
+        self._scanned_at = None
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def get_json(self, kind: str, content_hash: str, **params):
+        path = self._path(kind, make_key(content_hash, kind, **params), ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._record(kind, hit=False)
+            return None
+        self._touch(path)
+        self._record(kind, hit=True)
+        return value
+
+    def put_json(self, kind: str, content_hash: str, value, **params):
+        path = self._path(kind, make_key(content_hash, kind, **params), ".json")
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._write(path, data)
+
+    def get_array(self, kind: str, content_hash: str, **params):
+        path = self._path(kind, make_key(content_hash, kind, **params), ".npy")
+        import numpy as np  # only embeddings need it; keeps `import main` light
+        try:
+            value = np.load(path, allow_pickle=False)
+        except (FileNotFoundError, ValueError):
+            self._record(kind, hit=False)
+            return None
+        self._touch(path)
+        self._record(kind, hit=True)
+        return value
+
+    def put_array(self, kind: str, content_hash: str, value, **params):
+        import numpy as np
+        path = self._path(kind, make_key(content_hash, kind, **params), ".npy")
+        tmp = self._tmp_path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(value, dtype=np.float32), allow_pickle=False)
+        self._commit(tmp, path)
+
+    def stats(self) -> dict:
+        if self._size is None:
+            self._rescan()
+        with self._lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            return {
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "by_kind": {k: {"hits": self.hits[k], "misses": self.misses[k]} for k in kinds},
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _path(self, kind: str, key: str, ext: str) -> str:
+        return os.path.join(self.root, kind, key[:2], key + ext)
+
+    def _record(self, kind: str, hit: bool):
+        record_cache(kind, hit)
+        with self._lock:
+            if hit:
+                self.hits[kind] += 1
+            else:
+                self.misses[kind] += 1
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = self._tmp_path(path)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        self._commit(tmp, path)
+
+    @staticmethod
+    def _tmp_path(path: str) -> str:
+        # Unique per write: two workers or threads storing the same key must not share a temp file
+        return f"{path}.{uuid.uuid4().hex}.tmp"
+
+    def _commit(self, tmp: str, path: str):
+        """Atomically move `tmp` into place and evict if we went over the cap."""
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path) - old_size
+            rescan = self._size is None or time.monotonic() - self._scanned_at >= CACHE_RESCAN_SECONDS
+        if rescan:
+            self._rescan()
+        with self._lock:
+            over = self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _rescan(self):
+        size = sum(size for _, _, size in self._entries())
+        with self._lock:
+            self._size = size
+            self._scanned_at = time.monotonic()
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def _evict(self):
+        """Drop least-recently-used entries until we are back under 90% of the cap."""
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        with self._lock:
+            # The scan is the real total, including what other workers wrote
+            self._size = sum(size for _, _, size in entries)
+            self._scanned_at = time.monotonic()
+            for path, _, size in entries:
+                if self._size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._size -= size
+        print(f"[cache] Evicted down to {self._size} bytes")
+
+
+paper_cache = PaperCache()
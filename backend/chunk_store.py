@@ -0,0 +1,236 @@
+"""
+Columnar chunk store for the QA indexes.
+
+A paper's chunks are slices of its joined page text (PAGE_SEPARATOR.join(pages)),
+so instead of one Document (a copy of the text plus a metadata dict) per
+chunk, a ChunkTable keeps the text once and one fixed-size record per chunk:
+
+    start, end   character offsets of the chunk in the joined text    int32
+    page         1-based page the chunk starts on                     int32
+    bbox         x0, y0, x1, y1 on that page, in PDF points           float32 x 4 (NaN if unknown)
+
+A chunk that runs over a page break is boxed on its first page only (the
+blocks it overlaps there); the rest of it, on the next page, is not part
+of the box. One fixed-size record per chunk keeps `locate` a single read.
+
+That is 28 bytes per chunk plus the text, where overlapping chunks share
+their characters. A chunk that can't be found in order in the joined text
+(the splitter rewrote it) keeps its text after the paper's, with page 0:
+its location is unknown rather than guessed. `locate(i)` turns a FAISS / BM25 hit into (page, rect)
+with one record read.
+
+On disk, next to index.faiss (index_store.py):
+
+    chunks.npy   the record array, memory-mapped on load
+    text.txt     the joined text
+
+LangChain's FAISS wrapper still wants a docstore and an id map: ChunkDocstore
+builds a hit's Document only when it is asked for (with the location in its
+metadata), and RowIds maps FAISS row i to docstore id str(i) without storing
+either.
+"""
+import os
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from pdf_extract import PAGE_SEPARATOR, page_offsets
+
+CHUNK_DTYPE = np.dtype([("start", "<i4"), ("end", "<i4"), ("page", "<i4"), ("bbox", "<f4", (4,))])
+
+
+class ChunkTable:
+    def __init__(self, text: str, records: np.ndarray):
+        self.text = text
+        self.records = records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def text_at(self, i: int) -> str:
+        record = self.records[i]
+        return self.text[int(record["start"]):int(record["end"])]
+
+    @property
+    def texts(self) -> "ChunkTexts":
+        """Chunk texts as a read-only sequence, sliced on access."""
+        return ChunkTexts(self)
+
+    def locate(self, i: int):
+        """(page, (x0, y0, x1, y1) or None) for chunk i; (None, None) if its location is unknown."""
+        record = self.records[i]
+        if record["page"] == 0:
+            return None, None
+        bbox = record["bbox"]
+        return int(record["page"]), (None if np.isnan(bbox[0]) else tuple(float(v) for v in bbox))
+
+    def metadata(self, i: int) -> dict:
+        page, bbox = self.locate(i)
+        record = self.records[i]
+        start, end = (int(record["start"]), int(record["end"])) if page is not None else (None, None)
+        return {"chunk": int(i), "page": page, "start": start, "end": end, "bbox": bbox}
+
+    @property
+    def nbytes(self) -> int:
+        return self.records.nbytes + len(self.text.encode("utf-8"))
+
+    # -------------------------------
+    # Building
+    # -------------------------------
+    @classmethod
+    def from_chunks(cls, pages: list[str], chunks: list[str], layout: list[list[tuple]] = None,
+                    sep: str = PAGE_SEPARATOR) -> "ChunkTable":
+        """
+        Table for `chunks`, which were split from sep.join(pages) in order.
+        `layout` (pdf_extract.page_blocks) fills in the boxes.
+        """
+        text = sep.join(pages)
+        records = np.zeros(len(chunks), dtype=CHUNK_DTYPE)
+        records["bbox"] = np.nan
+        starts = _find_offsets(text, chunks)
+        lengths = np.fromiter((len(c) for c in chunks), dtype=np.int32, count=len(chunks))
+
+        offsets = np.asarray(page_offsets(pages, sep), dtype=np.int64)
+        records["page"] = np.maximum(np.searchsorted(offsets, starts, side="right"), 1)
+        missing = np.flatnonzero(starts < 0)
+        if len(missing):
+            # Unplaced chunks: text stored after the paper's, page 0 = location unknown
+            tail, cursor = [], len(text) + len(sep)
+            for i in missing:
+                tail.append(chunks[i])
+                starts[i] = cursor
+                cursor += lengths[i] + len(sep)
+            text = sep.join([text, *tail])
+            records["page"][missing] = 0
+        records["start"] = starts
+        records["end"] = starts + lengths
+        if layout is not None:
+            _fill_boxes(records, pages, offsets, layout)
+        return cls(text, records)
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self, folder: str):
+        np.save(os.path.join(folder, "chunks.npy"), self.records, allow_pickle=False)
+        with open(os.path.join(folder, "text.txt"), "w", encoding="utf-8", newline="") as f:
+            f.write(self.text)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> "ChunkTable":
+        records = np.load(os.path.join(folder, "chunks.npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+        with open(os.path.join(folder, "text.txt"), encoding="utf-8", newline="") as f:
+            return cls(f.read(), records)
+
+    @staticmethod
+    def exists(folder: str) -> bool:
+        return os.path.exists(os.path.join(folder, "chunks.npy"))
+
+
+class ChunkTexts(Sequence):
+    def __init__(self, table: ChunkTable):
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.table.text_at(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.table.text_at(i)
+
+
+def _find_offsets(text: str, chunks: list[str]) -> np.ndarray:
+    """
+    Start offset of each chunk, or -1 if it isn't in the text after the previous
+    one. Chunks come in text order and may overlap; searching from the start
+    again would land repeated text (running headers, boilerplate) on an earlier copy.
+    """
+    starts = np.empty(len(chunks), dtype=np.int32)
+    cursor = 0
+    for i, chunk in enumerate(chunks):
+        pos = text.find(chunk, cursor)
+        starts[i] = pos
+        if pos >= 0:
+            cursor = pos + 1
+    return starts
+
+
+def _fill_boxes(records: np.ndarray, pages: list[str], offsets: np.ndarray, layout: list[list[tuple]]):
+    """bbox of each chunk: union of the text blocks its span overlaps on its first page (only that page)."""
+    for p, (page_text, blocks) in enumerate(zip(pages, layout)):
+        rows = np.flatnonzero(records["page"] == p + 1)
+        if not len(rows) or not blocks:
+            continue
+        spans, rects, cursor = [], [], 0
+        for x0, y0, x1, y1, block_text in blocks:
+            needle = block_text.strip()
+            pos = page_text.find(needle[:64], cursor) if needle else -1
+            if pos < 0:
+                continue
+            spans.append((pos, pos + len(needle)))
+            rects.append((x0, y0, x1, y1))
+            cursor = pos + 1
+        if not spans:
+            continue
+        spans = np.asarray(spans, dtype=np.int64)
+        rects = np.asarray(rects, dtype=np.float32)
+        for row in rows:
+            start = int(records["start"][row]) - int(offsets[p])
+            end = min(int(records["end"][row]) - int(offsets[p]), len(page_text))
+            hit = (spans[:, 0] < end) & (spans[:, 1] > start)
+            if hit.any():
+                box = rects[hit]
+                records["bbox"][row] = (box[:, 0].min(), box[:, 1].min(), box[:, 2].max(), box[:, 3].max())
+
+
+# -------------------------------
+# LangChain adapters
+# -------------------------------
+class ChunkDocstore(Docstore):
+    """Read-only docstore over a ChunkTable; ids are str(row)."""
+
+    def __init__(self, table: ChunkTable):
+        self.table = table
+
+    def search(self, search: str):
+        try:
+            i = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= i < len(self.table):
+            return f"ID {search} not found."
+        return Document(page_content=self.table.text_at(i), metadata=self.table.metadata(i))
+
+
+class RowIds(Mapping):
+    """FAISS row -> docstore id, for a docstore whose ids are the row numbers."""
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, i):
+        i = int(i)
+        if not 0 <= i < self.n:
+            raise KeyError(i)
+        return str(i)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+
+def chunk_texts(vectorstore) -> Sequence:
+    """Texts of every chunk in FAISS row order, for either docstore layout."""
+    if isinstance(vectorstore.docstore, ChunkDocstore):
+        return vectorstore.docstore.table.texts
+    ids = vectorstore.index_to_docstore_id
+    return [vectorstore.docstore.search(ids[i]).page_content for i in range(len(ids))]
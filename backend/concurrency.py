@@ -0,0 +1,27 @@
+"""
+Bounded executors for the blocking work request handlers can't avoid.
+
+LLM, embedding and GROBID calls go through their native async clients; what is
+left (PyMuPDF parsing, TEI parsing, reading uploads) runs here so that one
+slow paper never stalls the event loop for everyone else.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+
+# CPU-heavy parsing (PyMuPDF, lxml, FAISS index builds)
+pdf_pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+# Short blocking file I/O (reading and hashing uploads)
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+async def run_in_pool(pool, fn, *args, **kwargs):
+    """Run a blocking callable on `pool` and await its result (context vars, e.g. the request trace, carry over)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args, **kwargs))
@@ -0,0 +1,446 @@
+"""
+Cross-paper corpus index for `/corpus/ask`.
+
+Every paper uploaded for QA is also added to one corpus-wide vector index, so
+a question can be answered across all of them ("which of these used GNNs
+for outbreak prediction?"). Per-paper indexes (index_store.py) stay as they
+are for `/ask`.
+
+- Papers are deduplicated by index key (same bytes + chunking + model), and
+  any number of paper_ids can point at one entry. Chunk ids are
+  `seq << CHUNK_BITS | chunk`, so a paper's chunks form one id range.
+- Papers are spread over CORPUS_SHARDS shards (seq % shards). A shard is an
+  exact flat index until it holds IVF_MIN_VECTORS vectors, then an IVF index
+  (nlist ~ 4 * sqrt(n), CORPUS_NPROBE lists probed), so a query scans a
+  small fraction of the corpus. It is re-trained when it doubles or halves.
+  IVF rather than HNSW because FAISS can delete from IVF lists in place.
+- Metadata (title, year, tags, aliases), chunk texts and vectors live in
+  SQLite, which is the source of truth. Shards are rebuilt from it, and
+  snapshotted to disk by `flush()` so a restart only replays what changed.
+  A generation counter in SQLite tells other workers to resync.
+- Filters (paper_ids, tags, year range) select papers in SQLite first, then
+  restrict the FAISS search with an id selector. Very selective filters
+  probe every list, since the few matching vectors may sit anywhere.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import faiss
+import numpy as np
+
+CORPUS_DIR = os.getenv("CORPUS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "corpus"))
+CORPUS_SHARDS = int(os.getenv("CORPUS_SHARDS", "4"))
+CORPUS_NPROBE = int(os.getenv("CORPUS_NPROBE", "32"))
+IVF_MIN_VECTORS = int(os.getenv("CORPUS_IVF_MIN_VECTORS", "8192"))  # below this a shard stays exact
+CORPUS_FLUSH_EVERY = int(os.getenv("CORPUS_FLUSH_EVERY", "50"))  # snapshot a shard after this many changes
+
+CHUNK_BITS = 16  # up to 65536 chunks per paper
+RETRAIN_GROWTH = 2.0
+TRAIN_POINTS_PER_LIST = 64
+SELECTIVE_FRACTION = 0.05  # filters matching less than this share of a shard probe every list
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    faiss.normalize_L2(vectors)  # inner product == cosine
+    return vectors
+
+
+def _nlist(n: int) -> int:
+    return max(16, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _dump(index):
+    """(ids, vectors) of everything in a flat IDMap2 or IVF-flat index."""
+    if isinstance(index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else np.empty((0, index.d), np.float32)
+        return ids, vectors
+    invlists = index.invlists
+    ids, vectors = [np.empty(0, np.int64)], [np.empty((0, index.d), np.float32)]
+    for list_no in range(index.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+            vectors.append(codes.view(np.float32).reshape(size, index.d))
+    return np.concatenate(ids), np.concatenate(vectors)
+
+
+def _paper_ids(seq: int, n_chunks: int) -> np.ndarray:
+    return (seq << CHUNK_BITS) + np.arange(n_chunks, dtype=np.int64)
+
+
+class Shard:
+    """One FAISS index over the chunks of the papers with seq % shards == number."""
+
+    def __init__(self, number: int, dim: int, root: str):
+        self.number = number
+        self.dim = dim
+        self.path = os.path.join(root, f"shard-{number}")
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.seqs = set()
+        self.trained_size = 0
+        self.changes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def is_ivf(self) -> bool:
+        return self.trained_size > 0
+
+    def add(self, seq: int, ids: np.ndarray, vectors: np.ndarray):
+        with self.lock:
+            if seq in self.seqs:
+                return
+            self.index.add_with_ids(vectors, ids)
+            self.seqs.add(seq)
+            self.changes += 1
+            self._maybe_retrain()
+
+    def remove(self, seq: int):
+        with self.lock:
+            if seq not in self.seqs:
+                return
+            lo = seq << CHUNK_BITS
+            self.index.remove_ids(faiss.IDSelectorRange(lo, lo + (1 << CHUNK_BITS)))
+            self.seqs.discard(seq)
+            self.changes += 1
+            self._maybe_retrain()
+
+    def search(self, query: np.ndarray, k: int, selector=None, selected: int = None):
+        """(scores, ids) for the top k; `selected` is how many vectors the selector lets through."""
+        with self.lock:
+            if not self.ntotal:
+                return np.empty(0, np.float32), np.empty(0, np.int64)
+            if self.is_ivf:
+                selective = selected is not None and selected < SELECTIVE_FRACTION * self.ntotal
+                params = faiss.SearchParametersIVF(nprobe=self.index.nlist if selective else min(CORPUS_NPROBE, self.index.nlist))
+            else:
+                params = faiss.SearchParameters() if selector is not None else None
+            if selector is not None:
+                params.sel = selector
+            scores, ids = self.index.search(query, min(k, self.ntotal), params=params)
+        keep = ids[0] >= 0
+        return scores[0][keep], ids[0][keep]
+
+    # -------------------------------
+    # Snapshots
+    # -------------------------------
+    def save(self):
+        with self.lock:
+            if not self.changes:
+                return
+            tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            faiss.write_index(self.index, tmp + ".faiss")
+            with open(tmp + ".json", "w") as f:
+                json.dump({"seqs": sorted(self.seqs), "trained_size": self.trained_size}, f)
+            os.replace(tmp + ".faiss", self.path + ".faiss")
+            os.replace(tmp + ".json", self.path + ".json")
+            self.changes = 0
+
+    def load(self) -> bool:
+        try:
+            with open(self.path + ".json") as f:
+                meta = json.load(f)
+            index = faiss.read_index(self.path + ".faiss")
+        except (FileNotFoundError, RuntimeError, json.JSONDecodeError):
+            return False
+        with self.lock:
+            self.index, self.seqs, self.trained_size = index, set(meta["seqs"]), meta["trained_size"]
+        return True
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _maybe_retrain(self):
+        n = self.ntotal
+        if not self.is_ivf and n < IVF_MIN_VECTORS:
+            return
+        if self.is_ivf and self.trained_size / RETRAIN_GROWTH <= n <= self.trained_size * RETRAIN_GROWTH:
+            return
+
+        t0 = time.perf_counter()
+        ids, vectors = _dump(self.index)
+        if n < IVF_MIN_VECTORS:
+            # Shrunk back below the threshold: exact search is cheap again
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+            self.index.add_with_ids(vectors, ids)
+            self.trained_size = 0
+            return
+
+        nlist = _nlist(n)
+        rng = np.random.default_rng(self.number)
+        sample = vectors[rng.choice(n, min(n, nlist * TRAIN_POINTS_PER_LIST), replace=False)]
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(self.dim), self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(sample)
+        index.add_with_ids(vectors, ids)
+        self.index, self.trained_size = index, n
+        print(f"[corpus] Shard {self.number}: IVF{nlist} over {n} vectors in {time.perf_counter() - t0:.1f}s")
+
+
+class CorpusIndex:
+    def __init__(self, root: str = CORPUS_DIR, n_shards: int = CORPUS_SHARDS):
+        self.root = root
+        self.n_shards = n_shards
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "corpus.db"), check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._shards = None  # built on first use (needs the embedding dim)
+        self._generation = None
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS papers (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    index_key TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    year INTEGER,
+                    n_chunks INTEGER NOT NULL,
+                    added_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS aliases (paper_id TEXT PRIMARY KEY, seq INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS aliases_seq ON aliases (seq);
+                CREATE TABLE IF NOT EXISTS tags (seq INTEGER NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (seq, tag));
+                CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, text TEXT NOT NULL, vector BLOB NOT NULL);
+                INSERT OR IGNORE INTO meta VALUES ('generation', '0');
+            """)
+
+    # -------------------------------
+    # Write side (upload / delete)
+    # -------------------------------
+    def has(self, index_key: str) -> bool:
+        with self._db_lock:
+            return self._conn.execute("SELECT 1 FROM papers WHERE index_key = ?", (index_key,)).fetchone() is not None
+
+    def link(self, paper_id: str, index_key: str, title: str = None, year: int = None, tags=()) -> bool:
+        """
+        Point another paper_id at an already indexed paper. False if `index_key` is not in the corpus.
+        The upload's tags are added to the paper's, and its title / year fill in any the paper lacks.
+        """
+        with self._db_lock, self._conn:
+            row = self._conn.execute("SELECT seq FROM papers WHERE index_key = ?", (index_key,)).fetchone()
+            if row is None:
+                return False
+            seq = row[0]
+            self._conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)", (paper_id, seq))
+            if title is not None or year is not None:
+                self._conn.execute("UPDATE papers SET title = COALESCE(title, ?), year = COALESCE(year, ?) WHERE seq = ?",
+                                   (title, year, seq))
+            self._conn.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", ((seq, t) for t in tags))
+        return True
+
+    def add(self, paper_id: str, index_key: str, texts: list[str], vectors, title: str = None,
+            year: int = None, tags=()):
+        """Add a paper's chunks (or just the alias and its metadata, if the same index key is already in)."""
+        if self.link(paper_id, index_key, title, year, tags):
+            return
+        if not texts:
+            raise ValueError("A paper needs at least one chunk")
+        if len(texts) >= 1 << CHUNK_BITS:
+            raise ValueError(f"A paper can have at most {1 << CHUNK_BITS} chunks, got {len(texts)}")
+        vectors = _normalize(vectors)
+
+        with self._db_lock, self._conn:
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO papers (index_key, title, year, n_chunks, added_at) VALUES (?, ?, ?, ?, ?)",
+                    (index_key, title, year, len(texts), time.time()),
+                )
+            except sqlite3.IntegrityError:
+                seq = None  # another thread/worker added it in the meantime
+            else:
+                seq = cursor.lastrowid
+                ids = _paper_ids(seq, len(texts))
+                self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?)",
+                                       zip(ids.tolist(), texts, (v.tobytes() for v in vectors)))
+                self._conn.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", ((seq, t) for t in tags))
+                self._bump_generation()
+        self.link(paper_id, index_key, title, year, tags)
+        if seq is None:
+            return
+
+        shard = self._get_shards(vectors.shape[1])[seq % self.n_shards]
+        shard.add(seq, ids, vectors)
+        if shard.changes >= CORPUS_FLUSH_EVERY:
+            shard.save()
+
+    def remove(self, paper_id: str) -> bool:
+        """Drop `paper_id`; the paper's chunks go once no other paper_id points at them."""
+        with self._db_lock, self._conn:
+            row = self._conn.execute("SELECT seq FROM aliases WHERE paper_id = ?", (paper_id,)).fetchone()
+            if row is None:
+                return False
+            seq = row[0]
+            self._conn.execute("DELETE FROM aliases WHERE paper_id = ?", (paper_id,))
+            if self._conn.execute("SELECT 1 FROM aliases WHERE seq = ?", (seq,)).fetchone():
+                return True
+            n_chunks = self._conn.execute("SELECT n_chunks FROM papers WHERE seq = ?", (seq,)).fetchone()[0]
+            self._conn.execute("DELETE FROM papers WHERE seq = ?", (seq,))
+            self._conn.execute("DELETE FROM tags WHERE seq = ?", (seq,))
+            self._conn.execute("DELETE FROM chunks WHERE id >= ? AND id < ?",
+                               (seq << CHUNK_BITS, (seq << CHUNK_BITS) + n_chunks))
+            self._bump_generation()
+
+        if self._shards is not None:
+            shard = self._shards[seq % self.n_shards]
+            shard.remove(seq)
+            if shard.changes >= CORPUS_FLUSH_EVERY:
+                shard.save()
+        return True
+
+    def flush(self):
+        """Snapshot changed shards so the next start only replays what happened after this."""
+        for shard in self._shards or ():
+            shard.save()
+
+    # -------------------------------
+    # Read side (/corpus/ask)
+    # -------------------------------
+    def search(self, query_vector, k: int = 8, paper_ids=None, tags=None, year_from: int = None,
+               year_to: int = None) -> list[dict]:
+        """Top k chunks across the corpus (optionally filtered), best first, with their paper's metadata."""
+        query = _normalize(query_vector)
+        shards = self._get_shards(query.shape[1])
+        self._sync()
+
+        selectors = [(None, None)] * self.n_shards
+        if paper_ids is not None or tags or year_from is not None or year_to is not None:
+            papers = self._filter(paper_ids, tags, year_from, year_to)
+            if not papers:
+                return []
+            by_shard = [[] for _ in range(self.n_shards)]
+            for seq, n_chunks in papers:
+                by_shard[seq % self.n_shards].append(_paper_ids(seq, n_chunks))
+            selectors = [
+                (faiss.IDSelectorBatch(np.concatenate(ids)), sum(len(i) for i in ids)) if ids else (None, 0)
+                for ids in by_shard
+            ]
+
+        scores, ids = [], []
+        for shard, (selector, selected) in zip(shards, selectors):
+            if selected == 0:
+                continue
+            s, i = shard.search(query, k, selector, selected)
+            scores.append(s)
+            ids.append(i)
+        if not ids:
+            return []
+        scores, ids = np.concatenate(scores), np.concatenate(ids)
+        top = np.argsort(-scores)[:k]
+        return self._hits(ids[top].tolist(), scores[top].tolist())
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            papers, chunks = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(n_chunks), 0) FROM papers").fetchone()
+            aliases = self._conn.execute("SELECT COUNT(*) FROM aliases").fetchone()[0]
+        shards = [
+            {"vectors": s.ntotal, "papers": len(s.seqs),
+             "index": f"IVF{s.index.nlist}" if s.is_ivf else "flat", "unsaved_changes": s.changes}
+            for s in self._shards or ()
+        ]
+        return {"papers": papers, "paper_ids": aliases, "chunks": chunks, "nprobe": CORPUS_NPROBE, "shards": shards}
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _bump_generation(self):
+        self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+
+    def _read_generation(self) -> int:
+        with self._db_lock:
+            return int(self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+
+    def _get_shards(self, dim: int) -> list:
+        if self._shards is None:
+            with self._sync_lock:
+                if self._shards is None:
+                    shards = [Shard(i, dim, self.root) for i in range(self.n_shards)]
+                    for shard in shards:
+                        shard.load()
+                    self._reconcile(shards)
+                    self._shards = shards
+        return self._shards
+
+    def _sync(self):
+        """Catch up with papers another worker added or removed since we last looked."""
+        if self._read_generation() != self._generation:
+            with self._sync_lock:
+                self._reconcile(self._shards)
+
+    def _reconcile(self, shards: list):
+        """Make the shards hold exactly the papers in SQLite (startup, or after another worker wrote)."""
+        generation = self._read_generation()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT seq, n_chunks FROM papers").fetchall()
+        wanted = [dict() for _ in shards]
+        for seq, n_chunks in rows:
+            if n_chunks:  # nothing to index (and no id range to read) for an empty paper
+                wanted[seq % len(shards)][seq] = n_chunks
+
+        added = removed = 0
+        for shard, papers in zip(shards, wanted):
+            for seq in shard.seqs - papers.keys():
+                shard.remove(seq)
+                removed += 1
+            for seq in papers.keys() - shard.seqs:
+                ids = _paper_ids(seq, papers[seq])
+                with self._db_lock:
+                    blobs = self._conn.execute(
+                        "SELECT vector FROM chunks WHERE id >= ? AND id < ? ORDER BY id", (int(ids[0]), int(ids[-1]) + 1)
+                    ).fetchall()
+                vectors = np.frombuffer(b"".join(b for (b,) in blobs), dtype=np.float32).reshape(len(blobs), shard.dim)
+                shard.add(seq, ids, vectors)
+                added += 1
+        if added or removed:
+            print(f"[corpus] Synced shards with the corpus db: +{added} / -{removed} papers")
+        self._generation = generation
+
+    def _filter(self, paper_ids, tags, year_from, year_to) -> list[tuple[int, int]]:
+        clauses, params = [], []
+        if paper_ids is not None:
+            clauses.append(f"p.seq IN (SELECT seq FROM aliases WHERE paper_id IN ({','.join('?' * len(paper_ids))}))")
+            params.extend(paper_ids)
+        if tags:
+            clauses.append(f"p.seq IN (SELECT seq FROM tags WHERE tag IN ({','.join('?' * len(tags))}))")
+            params.extend(tags)
+        if year_from is not None:
+            clauses.append("p.year >= ?")
+            params.append(year_from)
+        if year_to is not None:
+            clauses.append("p.year <= ?")
+            params.append(year_to)
+        with self._db_lock:
+            return self._conn.execute(
+                f"SELECT p.seq, p.n_chunks FROM papers p WHERE {' AND '.join(clauses)}", params
+            ).fetchall()
+
+    def _hits(self, ids: list[int], scores: list[float]) -> list[dict]:
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"""SELECT c.id, c.text, p.title, p.year,
+                           (SELECT MIN(a.paper_id) FROM aliases a WHERE a.seq = p.seq)
+                    FROM chunks c JOIN papers p ON p.seq = c.id >> {CHUNK_BITS}
+                    WHERE c.id IN ({','.join('?' * len(ids))})""",
+                ids,
+            ).fetchall()
+        by_id = {row[0]: row[1:] for row in rows}
+        hits = []
+        for chunk_id, score in zip(ids, scores):
+            if chunk_id in by_id:  # removed between the search and this lookup
+                text, title, year, paper_id = by_id[chunk_id]
+                hits.append({"paper_id": paper_id, "title": title, "year": year,
+                             "chunk": chunk_id & ((1 << CHUNK_BITS) - 1), "text": text, "score": score})
+        return hits
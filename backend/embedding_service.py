@@ -0,0 +1,248 @@
+"""
+One embedding service shared by QA retrieval and highlighting.
+
+- Inputs are deduplicated and looked up in a persistent text-hash -> float32
+  vector cache before anything goes over the wire.
+- Cache misses are packed into batches up to the provider's per-request
+  limits (EMBED_BATCH_SIZE inputs / EMBED_BATCH_TOKENS tokens) and the batches
+  run concurrently, so a 500-chunk paper is a handful of requests, not 500.
+- Results come back as a contiguous (n, dim) float32 NumPy array.
+
+EmbeddingService also implements LangChain's `Embeddings` interface, so it can
+be handed straight to FAISS.
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from openai import AsyncOpenAI, OpenAI
+
+from llm_scheduler import scheduler
+from telemetry import span, record_cache
+
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "2048"))       # OpenAI max inputs per request
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "250000"))  # stay under the 300k tokens/request cap
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorCache:
+    """
+    Append-only float32 matrix on disk (`vectors.f32`) plus a SQLite map from
+    text hash to row number. Reads go through np.memmap, so the cache costs
+    4 bytes per dimension and no Python objects per vector.
+
+    API workers share the directory: appends take an exclusive flock on
+    `vectors.lock` around sizing the file, writing the rows and inserting their
+    row numbers, so two processes never claim the same rows.
+    """
+
+    def __init__(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        self.vectors_path = os.path.join(root, "vectors.f32")
+        self.meta_path = os.path.join(root, "meta.json")
+        self.lock_path = os.path.join(root, "vectors.lock")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self.dim = None
+        self._load_dim()
+
+    def _load_dim(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+    def get_many(self, hashes: list[str]) -> dict:
+        """hash -> vector for every hash we have."""
+        if self.dim is None:
+            self._load_dim()  # another worker may have written the first vectors
+        if self.dim is None or not hashes:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                marks = ",".join("?" for _ in part)
+                found.update(self._conn.execute(f"SELECT hash, row FROM rows WHERE hash IN ({marks})", part).fetchall())
+            if not found:
+                return {}
+            n_rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+            return {h: np.array(matrix[row]) for h, row in found.items()}
+
+    def put_many(self, hashes: list[str], vectors: np.ndarray):
+        if not hashes:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self.dim is None:
+                    self._load_dim()
+                if self.dim is None:
+                    self.dim = int(vectors.shape[1])
+                    with open(self.meta_path, "w") as f:
+                        json.dump({"dim": self.dim}, f)
+                row_bytes = 4 * self.dim
+                with open(self.vectors_path, "ab") as f:
+                    # Drop a partial row left by a writer that died mid-append
+                    start = f.seek(0, os.SEEK_END) // row_bytes
+                    f.truncate(start * row_bytes)
+                    f.write(vectors.tobytes())
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO rows (hash, row) VALUES (?, ?)",
+                        [(h, start + i) for i, h in enumerate(hashes)],
+                    )
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class EmbeddingService(Embeddings):
+    def __init__(self, model: str = "text-embedding-3-small", cache_dir: str = EMBED_CACHE_DIR,
+                 batch_size: int = EMBED_BATCH_SIZE, batch_tokens: int = EMBED_BATCH_TOKENS,
+                 concurrency: int = EMBED_CONCURRENCY):
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.concurrency = concurrency
+        self.cache = VectorCache(os.path.join(cache_dir, model))
+        self.requests = 0
+        self._client = None
+        self._aclient = None
+
+    # -------------------------------
+    # NumPy API
+    # -------------------------------
+    def embed_matrix(self, texts: list[str]) -> np.ndarray:
+        order, missing, vectors = self._plan(texts)
+        if missing:
+            client = self._sync_client()
+            for batch in self._batches(missing):
+                self._store(batch, self._request(client, batch), vectors)
+        return self._assemble(order, vectors)
+
+    async def aembed_matrix(self, texts: list[str]) -> np.ndarray:
+        order, missing, vectors = self._plan(texts)
+        if missing:
+            client = self._async_client()
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def run(batch):
+                async with semaphore:
+                    # Embedding input counts against the same tokens-per-minute budget as chat calls
+                    result = await scheduler.run(lambda: self._arequest(client, batch),
+                                                 tokens=sum(_approx_tokens(t) for _, t in batch), label="embeddings")
+                self._store(batch, result, vectors)
+
+            with span("embed", inputs=len(texts), fetched=len(missing)):
+                await asyncio.gather(*(run(b) for b in self._batches(missing)))
+        return self._assemble(order, vectors)
+
+    # -------------------------------
+    # LangChain Embeddings interface
+    # -------------------------------
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_matrix(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_matrix([text])[0].tolist()
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return (await self.aembed_matrix(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_matrix([text]))[0].tolist()
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _plan(self, texts):
+        """Dedupe inputs and pull what we can from the cache."""
+        # The API rejects empty strings
+        texts = [t if t.strip() else " " for t in texts]
+        hashes = [text_hash(t) for t in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self.cache.get_many(list(unique))
+        missing = [(h, t) for h, t in unique.items() if h not in vectors]
+        if unique:
+            record_cache("embedding", hit=not missing)
+        if len(texts) > 1:
+            print(f"[embeddings] {len(texts)} inputs, {len(unique)} unique, {len(missing)} to fetch")
+        return hashes, missing, vectors
+
+    def _batches(self, items):
+        batch, tokens = [], 0
+        for h, text in items:
+            n = _approx_tokens(text)
+            if batch and (len(batch) >= self.batch_size or tokens + n > self.batch_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append((h, text))
+            tokens += n
+        if batch:
+            yield batch
+
+    def _request(self, client, batch) -> np.ndarray:
+        self.requests += 1
+        response = client.embeddings.create(model=self.model, input=[t for _, t in batch])
+        return self._to_matrix(response)
+
+    async def _arequest(self, client, batch) -> np.ndarray:
+        self.requests += 1
+        response = await client.embeddings.create(model=self.model, input=[t for _, t in batch])
+        return self._to_matrix(response)
+
+    @staticmethod
+    def _to_matrix(response) -> np.ndarray:
+        data = sorted(response.data, key=lambda d: d.index)
+        return np.asarray([d.embedding for d in data], dtype=np.float32)
+
+    def _store(self, batch, matrix: np.ndarray, vectors: dict):
+        hashes = [h for h, _ in batch]
+        self.cache.put_many(hashes, matrix)
+        vectors.update(zip(hashes, matrix))
+
+    @staticmethod
+    def _assemble(order, vectors) -> np.ndarray:
+        if not order:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in order]).astype(np.float32, copy=False)
+
+    def _sync_client(self):
+        if self._client is None:
+            self._client = OpenAI(max_retries=2)
+        return self._client
+
+    def _async_client(self):
+        if self._aclient is None:
+            self._aclient = AsyncOpenAI(max_retries=0)  # scheduler retries
+        return self._aclient
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model: str = "text-embedding-3-small") -> EmbeddingService:
+    """Process-wide service per model, so QA and highlighting share one cache and client."""
+    with _services_lock:
+        if model not in _services:
+            _services[model] = EmbeddingService(model)
+        return _services[model]
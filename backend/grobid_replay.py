@@ -0,0 +1,66 @@
+"""
+GROBID stand-in that replays cached TEI, for running and load-testing the
+multi-agent pipeline without a real GROBID.
+
+    uvicorn grobid_replay:app --port 8070
+    GROBID_URL=http://localhost:8070/api/processFulltextDocument uvicorn main:app
+
+POST /api/processFulltextDocument answers with `<sha256 of the PDF>.tei.xml`
+from GROBID_REPLAY_DIR if there is one, else with GROBID_REPLAY_TEI
+(backend/output.tei.xml). It behaves like GROBID under load:
+
+- GROBID_REPLAY_LATENCY seconds of "processing" per paper (plus jitter),
+- at most GROBID_REPLAY_CAPACITY papers at once; the rest get a 503,
+- GROBID_REPLAY_FAIL_RATE of requests fail with a 500.
+"""
+import asyncio
+import hashlib
+import os
+import random
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.responses import PlainTextResponse, Response
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPLAY_DIR = os.getenv("GROBID_REPLAY_DIR", os.path.join(HERE, ".data", "tei"))
+REPLAY_TEI = os.getenv("GROBID_REPLAY_TEI", os.path.join(HERE, "output.tei.xml"))
+REPLAY_LATENCY = float(os.getenv("GROBID_REPLAY_LATENCY", "2.0"))
+REPLAY_CAPACITY = int(os.getenv("GROBID_REPLAY_CAPACITY", "4"))
+REPLAY_FAIL_RATE = float(os.getenv("GROBID_REPLAY_FAIL_RATE", "0"))
+
+app = FastAPI(title="GROBID replay")
+_busy = 0
+
+
+def _tei_for(pdf_bytes: bytes) -> str:
+    path = os.path.join(REPLAY_DIR, hashlib.sha256(pdf_bytes).hexdigest() + ".tei.xml")
+    if not os.path.exists(path):
+        path = REPLAY_TEI
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@app.get("/api/isalive")
+async def isalive():
+    return PlainTextResponse("true")
+
+
+@app.post("/api/processFulltextDocument")
+async def process_fulltext(input: UploadFile = File(...)):
+    global _busy
+    if _busy >= REPLAY_CAPACITY:
+        return Response(status_code=503)
+    _busy += 1
+    try:
+        pdf_bytes = await input.read()
+        await asyncio.sleep(REPLAY_LATENCY * random.uniform(0.8, 1.2))
+        if random.random() < REPLAY_FAIL_RATE:
+            return PlainTextResponse("[GENERAL] replay failure", status_code=500)
+        return Response(_tei_for(pdf_bytes), media_type="application/xml")
+    finally:
+        _busy -= 1
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8070)
@@ -0,0 +1,50 @@
+"""
+Production serving: `gunicorn -c gunicorn.conf.py main:app` from backend/.
+
+Each worker is a full copy of the app; everything they must agree on (papers,
+sessions, jobs, indexes, caches) is in the shared state backend or on disk,
+see state.py. Workers load lazily after the fork and warm their hot indexes
+in the lifespan hook.
+
+What stays per worker, and how it is made to add up:
+
+- Prometheus metrics: every worker writes its samples to files under
+  PROMETHEUS_MULTIPROC_DIR (wiped when the master starts) and /metrics
+  aggregates all of them, whichever worker serves the scrape.
+- LLM limits (llm_scheduler.py): LLM_MAX_IN_FLIGHT and LLM_TOKENS_PER_MINUTE
+  are for the whole deployment; each worker gets 1/LLM_LIMIT_WORKERS of them.
+  The split is static, so an idle worker's share goes unused.
+- /scheduler/stats, /grobid/stats and the cache hit counters describe the
+  worker that answered.
+"""
+import multiprocessing
+import os
+import shutil
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_WORKERS", str(min(multiprocessing.cpu_count(), 4))))
+# Read by the workers, which inherit the master's environment
+os.environ["LLM_LIMIT_WORKERS"] = str(workers)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "prometheus"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Summaries stream for minutes; SSE keeps the connection open
+timeout = int(os.getenv("WEB_TIMEOUT", "600"))
+graceful_timeout = 30
+keepalive = 5
+
+# Not `from state import ...`: that would open the state database in the master, before the fork
+if workers > 1 and os.getenv("STATE_BACKEND", "sqlite") == "memory":
+    raise SystemExit("STATE_BACKEND=memory is per process; use sqlite or redis with more than one worker")
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to this one's
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,179 @@
+"""
+On-disk FAISS index store for the QA path, replacing the in-process
+`vectorstores` dict.
+
+Each paper's index is written once at upload under its index key (content
+hash + chunking + embedding model):
+
+    <root>/<key>/index.faiss     faiss.write_index output
+    <root>/<key>/chunks.npy      chunk offsets, pages and boxes (chunk_store.py)
+    <root>/<key>/text.txt        the paper text the chunks are slices of
+
+paper_id -> index key (plus filename and chunk count) lives in the shared
+state backend (state.py, "papers"), so an /ask can land on any worker.
+
+`/ask` loads indexes lazily with `faiss.read_index(..., IO_FLAG_MMAP)` so the
+vectors live in the OS page cache, shared by every uvicorn worker, and keeps
+an LRU of hot indexes within a memory budget. Every cold load is noted in the
+state backend ("hot"), and `warm()` preloads the most recently used indexes
+when a worker starts. Nothing is lost on restart.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from chunk_store import ChunkDocstore, ChunkTable, RowIds
+from state import state as shared_state
+
+INDEX_DIR = os.getenv("INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "indexes"))
+INDEX_MEMORY_BUDGET = int(os.getenv("INDEX_MEMORY_BUDGET", str(1024 ** 3)))  # 1 GB of hot indexes
+WARM_INDEXES = int(os.getenv("WARM_INDEXES", "16"))  # preloaded at startup (0 = off)
+NOTE_USE_SECONDS = 60
+
+
+def _read_index(path: str):
+    """Memory-map the index when this FAISS build/index type supports it, else read it normally."""
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def chunk_vectorstore(table: ChunkTable, index, embeddings) -> FAISS:
+    """LangChain FAISS over `index` whose row i is chunk i of `table` (Documents are built per hit)."""
+    return FAISS(embedding_function=embeddings, index=index, docstore=ChunkDocstore(table),
+                 index_to_docstore_id=RowIds(len(table)))
+
+
+class IndexStore:
+    def __init__(self, embeddings, root: str = INDEX_DIR, memory_budget: int = INDEX_MEMORY_BUDGET, state=None):
+        self.embeddings = embeddings
+        self.root = root
+        self.memory_budget = memory_budget
+        self.state = state or shared_state
+        self._hot = OrderedDict()  # key -> (vectorstore, approx bytes)
+        self._hot_bytes = 0
+        self._noted = {}  # key -> when its last use was written to the state backend
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    # -------------------------------
+    # Write side (upload)
+    # -------------------------------
+    def exists(self, key: str) -> bool:
+        return ChunkTable.exists(os.path.join(self.root, key))
+
+    def save(self, key: str, vectorstore: FAISS):
+        """
+        Persist a freshly built vectorstore (chunk_vectorstore) under `key`
+        (no-op if another worker beat us to it).
+        """
+        if self.exists(key):
+            return
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        faiss.write_index(vectorstore.index, os.path.join(tmp, "index.faiss"))
+        vectorstore.docstore.table.save(tmp)
+        try:
+            os.rename(tmp, os.path.join(self.root, key))
+        except OSError:
+            # Someone else saved the same key concurrently; theirs is identical
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._remember(key, vectorstore)
+        self._note_use(key, force=True)
+
+    def link(self, paper_id: str, key: str, **meta):
+        """Point `paper_id` at an index, visible to every worker. `meta` (filename, chunks, ...) is stored with it."""
+        self.state.set_json("papers", paper_id, {"index_key": key, "uploaded_at": time.time(), **meta})
+
+    def chunk_count(self, key: str) -> int:
+        vectorstore = self.load(key)
+        return len(vectorstore.index_to_docstore_id) if vectorstore is not None else 0
+
+    # -------------------------------
+    # Read side (/ask)
+    # -------------------------------
+    def resolve(self, paper_id: str):
+        paper = self.state.get_json("papers", paper_id)
+        return paper["index_key"] if paper is not None else None
+
+    def paper(self, paper_id: str):
+        """Stored metadata for an uploaded paper (index_key, filename, chunks, uploaded_at), or None."""
+        return self.state.get_json("papers", paper_id)
+
+    def get(self, paper_id: str):
+        """Vectorstore for `paper_id`, or None if it was never uploaded."""
+        key = self.resolve(paper_id)
+        return self.load(key) if key else None
+
+    def load(self, key: str):
+        with self._lock:
+            hot = self._hot.get(key)
+            if hot is not None:
+                self._hot.move_to_end(key)
+        if hot is not None:
+            self._note_use(key)
+            return hot[0]
+
+        folder = os.path.join(self.root, key)
+        if not self.exists(key):
+            return None
+        index = _read_index(os.path.join(folder, "index.faiss"))
+        vectorstore = chunk_vectorstore(ChunkTable.load(folder), index, self.embeddings)
+        self._remember(key, vectorstore)
+        self._note_use(key, force=True)
+        return vectorstore
+
+    def warm(self, limit: int = WARM_INDEXES) -> list[str]:
+        """Load the `limit` most recently used indexes (within the memory budget). Returns their keys."""
+        recent = sorted(self.state.items("hot").items(), key=lambda kv: float(kv[1]), reverse=True)
+        warmed = []
+        for key, _ in recent[:limit]:
+            if self.load(key) is None:
+                self.state.delete("hot", key)
+                continue
+            warmed.append(key)
+            with self._lock:
+                if self._hot_bytes >= self.memory_budget:
+                    break
+        return warmed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hot_indexes": len(self._hot), "hot_bytes": self._hot_bytes, "memory_budget": self.memory_budget,
+                    "state_backend": self.state.name}
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _note_use(self, key: str, force: bool = False):
+        # Hot indexes are hit on every /ask; a write a minute is plenty for warm()'s ordering
+        now = time.time()
+        if not force and now - self._noted.get(key, 0) < NOTE_USE_SECONDS:
+            return
+        self._noted[key] = now
+        self.state.set("hot", key, str(now))
+
+    @staticmethod
+    def _approx_bytes(vectorstore: FAISS) -> int:
+        index = vectorstore.index
+        return index.ntotal * index.d * 4 + vectorstore.docstore.table.nbytes
+
+    def _remember(self, key: str, vectorstore: FAISS):
+        size = self._approx_bytes(vectorstore)
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                return
+            self._hot[key] = (vectorstore, size)
+            self._hot_bytes += size
+            # Keep at least the index we just loaded, even if it alone exceeds the budget
+            while self._hot_bytes > self.memory_budget and len(self._hot) > 1:
+                _, (_, evicted) = self._hot.popitem(last=False)
+                self._hot_bytes -= evicted
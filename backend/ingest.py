@@ -0,0 +1,121 @@
+"""
+Upload ingestion: every endpoint gets its PDF through here.
+
+    paper = await aread_upload(upload_file)     # read once, size-checked, hashed
+    pages = await aload_pages(paper.data, paper.content_hash)
+
+- The upload (already spooled by Starlette) is read exactly once into memory,
+  hashed on the way, and rejected with UploadTooLarge past MAX_UPLOAD_BYTES.
+  main.py turns that into a 413 in one exception handler.
+- The same bytes go to PyMuPDF (`fitz.open(stream=...)`) and to GROBID, so
+  there are no temp files to copy, reopen or forget to delete.
+- Parsed pages are kept per content hash: a small in-memory LRU in front of
+  the disk paper cache, so /summarize, /upload_pdf_for_qa and the
+  multi-agent pipeline all share one parse of the same paper.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from cache import paper_cache
+from concurrency import io_pool, pdf_pool, run_in_pool
+from pdf_extract import iter_pages
+from telemetry import span, set_tags
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))  # 50 MB
+# Papers whose parsed pages stay in memory (the disk cache keeps the rest)
+PAGE_CACHE_PAPERS = int(os.getenv("PAGE_CACHE_PAPERS", "16"))
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"PDF is larger than the {limit // (1024 * 1024)} MB upload limit")
+        self.size = size
+        self.limit = limit
+
+
+class Paper:
+    """One uploaded PDF: its bytes, content hash and original filename."""
+
+    def __init__(self, data: bytes, content_hash: str, filename: str = None):
+        self.data = data
+        self.content_hash = content_hash
+        self.filename = filename
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+def read_upload(upload_file, max_bytes: int = MAX_UPLOAD_BYTES) -> Paper:
+    """Read an UploadFile once, hashing as we go. Raises UploadTooLarge past `max_bytes`."""
+    declared = getattr(upload_file, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLarge(declared, max_bytes)
+
+    with span("upload_read") as sp:
+        h = hashlib.sha256()
+        buf = bytearray()
+        f = upload_file.file
+        f.seek(0)
+        for block in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+            if len(buf) + len(block) > max_bytes:
+                raise UploadTooLarge(len(buf) + len(block), max_bytes)
+            h.update(block)
+            buf += block
+        sp.tag(bytes=len(buf))
+
+    paper = Paper(bytes(buf), h.hexdigest(), upload_file.filename)
+    set_tags(content_hash=paper.content_hash[:12], bytes=paper.size)
+    return paper
+
+
+async def aread_upload(upload_file, max_bytes: int = MAX_UPLOAD_BYTES) -> Paper:
+    return await run_in_pool(io_pool, read_upload, upload_file, max_bytes)
+
+
+def extract_pages(pdf) -> list[str]:
+    """Plain text of every page, in order (long papers are split across the PDF process pool)."""
+    with span("pdf_extract") as sp:
+        pages = list(iter_pages(pdf))
+        sp.tag(pages=len(pages), chars=sum(len(p) for p in pages))
+    print(f"[backend] Extracted {len(pages)} pages")
+    return pages
+
+
+# -------------------------------
+# Parsed pages per paper
+# -------------------------------
+_pages = OrderedDict()  # content hash -> list of page texts
+_pages_lock = threading.Lock()
+
+
+def load_pages(pdf, content_hash: str = None) -> list[str]:
+    """extract_pages, parsed at most once per content hash (memory LRU, then disk cache)."""
+    if content_hash is None:
+        return extract_pages(pdf)
+
+    with _pages_lock:
+        if content_hash in _pages:
+            _pages.move_to_end(content_hash)
+            return _pages[content_hash]
+
+    pages = paper_cache.get_json("pages", content_hash)
+    if pages is None:
+        pages = extract_pages(pdf)
+        paper_cache.put_json("pages", content_hash, pages)
+    else:
+        print(f"[backend] Using cached pages for {content_hash[:12]} ({len(pages)} pages)")
+
+    with _pages_lock:
+        _pages[content_hash] = pages
+        while len(_pages) > PAGE_CACHE_PAPERS:
+            _pages.popitem(last=False)
+    return pages
+
+
+async def aload_pages(pdf, content_hash: str = None) -> list[str]:
+    """load_pages on the PDF pool so parsing never blocks the event loop."""
+    return await run_in_pool(pdf_pool, load_pages, pdf, content_hash)
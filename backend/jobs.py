@@ -0,0 +1,356 @@
+"""
+Background job queue for long-running summaries.
+
+Submitting a PDF returns a job id immediately; a bounded pool of asyncio
+workers then runs the pipeline and publishes per-stage progress. Job state
+lives in SQLite and the uploaded PDF is kept next to it, so jobs that were
+queued (or mid-run) when the server stopped are picked up again on restart.
+
+With several API workers sharing JOBS_DIR, a job is claimed in SQLite before
+it runs (only one worker wins) and the claim is a lease: the owner renews it
+every JOB_LEASE_SECONDS / 3 while the job runs, and another worker only takes
+a running job over once its lease has expired, i.e. its owner died. An event
+stream opened on a worker that isn't running the job follows it by polling
+the store.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from telemetry import request_trace
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "jobs"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "100"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))  # events() for jobs run by another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))  # a running job is reclaimed this long after its last heartbeat
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobStore:
+    """SQLite-backed job records. Every method is safe to call from any thread."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    params TEXT NOT NULL DEFAULT '{}',
+                    filename TEXT,
+                    pdf_path TEXT,
+                    content_hash TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    owner TEXT,
+                    lease_until REAL
+                )
+            """)
+            # Databases created before leases existed
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def create(self, job: dict):
+        cols = ", ".join(job)
+        marks = ", ".join("?" for _ in job)
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT INTO jobs ({cols}) VALUES ({marks})", [self._encode(k, v) for k, v in job.items()])
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        values = [self._encode(k, v) for k, v in fields.items()] + [job_id]
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", values)
+
+    def claim(self, job_id: str, owner: str, lease: float) -> bool:
+        """
+        Mark a job as running under `owner` for `lease` seconds. Succeeds for a
+        queued job or a running one whose lease has expired; False if another
+        worker holds it.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND COALESCE(lease_until, 0) < ?))",
+                (owner, now + lease, now, job_id, now),
+            )
+        return cur.rowcount == 1
+
+    def renew(self, job_ids, owner: str, lease: float):
+        """Extend the leases `owner` holds on `job_ids`."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        marks = ", ".join("?" for _ in job_ids)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running' AND id IN ({marks})",
+                [time.time() + lease, owner, *job_ids],
+            )
+
+    def release(self, job_id: str, owner: str):
+        """Put a job `owner` is running back in the queue, for whichever worker gets to it first."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, owner),
+            )
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def reclaimable(self, queued_before: float = None) -> list[dict]:
+        """
+        Running jobs whose lease has expired, plus queued jobs (only those last
+        touched before `queued_before`, if given).
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'running' AND COALESCE(lease_until, 0) < ?) "
+                "OR (status = 'queued' AND updated_at < ?) ORDER BY created_at",
+                (now, now + 1 if queued_before is None else queued_before),
+            ).fetchall()
+        return [self._decode(r) for r in rows]
+
+    @staticmethod
+    def _encode(key, value):
+        return json.dumps(value) if key in ("progress", "params", "result") else value
+
+    @staticmethod
+    def _decode(row) -> dict:
+        job = dict(row)
+        for key in ("progress", "params", "result"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+
+class JobQueue:
+    """
+    Bounded worker pool over persisted jobs.
+
+    `runners` maps a job kind to `async def runner(job, report) -> result`, where
+    `report(stage, **info)` records progress for that stage.
+    """
+
+    def __init__(self, runners: dict, jobs_dir: str = JOBS_DIR,
+                 concurrency: int = JOB_CONCURRENCY, max_depth: int = JOB_QUEUE_DEPTH):
+        self.runners = runners
+        self.jobs_dir = jobs_dir
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.store = JobStore(os.path.join(jobs_dir, "jobs.db"))
+        self._queue = asyncio.Queue()
+        self._workers = []
+        self._subscribers = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running = set()   # job ids this queue holds the lease on
+        self._enqueued = set()  # job ids waiting in self._queue
+
+    # -------------------------------
+    # Lifecycle
+    # -------------------------------
+    async def start(self):
+        # Queued jobs, and running ones whose worker stopped renewing the lease; jobs a live
+        # sibling is running keep their lease and are left alone
+        for job in self.store.reclaimable():
+            self._enqueue(job["id"])
+            print(f"[jobs] Re-queued {job['id']} ({job['kind']}, was {job['status']})")
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        self._workers.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def submit(self, kind: str, pdf_bytes: bytes, filename: str, content_hash: str, params: dict = None) -> dict:
+        if kind not in self.runners:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue.qsize() >= self.max_depth:
+            raise QueueFullError(f"Job queue is full ({self.max_depth} waiting)")
+
+        job_id = uuid.uuid4().hex
+        pdf_path = os.path.join(self.jobs_dir, f"{job_id}.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+
+        now = time.time()
+        job = {
+            "id": job_id, "kind": kind, "status": "queued", "stage": None,
+            "progress": {}, "params": params or {}, "filename": filename,
+            "pdf_path": pdf_path, "content_hash": content_hash,
+            "created_at": now, "updated_at": now,
+        }
+        self.store.create(job)
+        self._enqueue(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is not None:
+            job.pop("pdf_path", None)
+            job["queue_position"] = self._position(job_id) if job["status"] == "queued" else None
+        return job
+
+    async def events(self, job_id: str):
+        """Yield the current job snapshot, then every progress event until the job finishes."""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            job = self.get(job_id)
+            if job is None:
+                return
+            yield {"type": "snapshot", "job": job}
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            seen = (job["status"], job["stage"])
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), JOB_POLL_SECONDS)
+                    seen = ("running", event.get("stage", seen[1]))  # so polling doesn't repeat it
+                except asyncio.TimeoutError:
+                    # Nothing published here: the job may be running on another worker
+                    event, seen = self._poll(job_id, seen)
+                    if event is None:
+                        continue
+                yield event
+                if event["type"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            subs = self._subscribers.get(job_id)
+            if subs is not None:
+                subs.discard(queue)
+                if not subs:
+                    self._subscribers.pop(job_id, None)
+
+    # -------------------------------
+    # Internals
+    # -------------------------------
+    def _position(self, job_id: str):
+        try:
+            return list(self._queue._queue).index(job_id)
+        except ValueError:
+            return None
+
+    def _poll(self, job_id: str, seen: tuple):
+        """(event, new `seen`) for whatever changed in the stored job since `seen` = (status, stage)."""
+        job = self.store.get(job_id)
+        if job is None or (job["status"], job["stage"]) == seen:
+            return None, seen
+        status, stage = job["status"], job["stage"]
+        if status == "done":
+            event = {"type": "done", "result": job["result"]}
+        elif status == "failed":
+            event = {"type": "failed", "error": job["error"]}
+        elif stage is not None and stage != seen[1]:
+            event = {"type": "progress", "stage": stage, **job["progress"].get(stage, {})}
+        else:
+            event = {"type": status}
+        return event, (status, stage)
+
+    def _publish(self, job_id: str, event: dict):
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._enqueued:
+            self._enqueued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _worker(self, n: int):
+        while True:
+            job_id = await self._queue.get()
+            self._enqueued.discard(job_id)
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _heartbeat(self):
+        """Renew the leases on our running jobs and pick up jobs orphaned by a worker that died."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                self.store.renew(self._running, self.worker_id, JOB_LEASE_SECONDS)
+                # Queued jobs that sat for a whole lease were most likely submitted to a dead worker
+                for job in self.store.reclaimable(queued_before=time.time() - JOB_LEASE_SECONDS):
+                    if job["id"] not in self._running:
+                        self._enqueue(job["id"])
+            except sqlite3.Error as e:
+                print(f"[jobs] Heartbeat failed: {e}")
+
+    async def _run(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return
+        # Several workers may have this id queued (submitted here, or picked up as orphaned);
+        # only the one whose claim succeeds runs it, and a live owner's lease is never taken
+        if not self.store.claim(job_id, self.worker_id, JOB_LEASE_SECONDS):
+            return
+        self._running.add(job_id)
+
+        progress = job["progress"] or {}
+
+        def report(stage: str, **info):
+            progress[stage] = info
+            self.store.update(job_id, stage=stage, progress=progress)
+            self._publish(job_id, {"type": "progress", "stage": stage, **info})
+
+        self._publish(job_id, {"type": "running"})
+        started = time.time()
+        try:
+            with request_trace(f"job:{job['kind']}", job_id=job_id, content_hash=job["content_hash"]):
+                result = await self.runners[job["kind"]](job, report)
+        except asyncio.CancelledError:
+            # Server shutting down: hand it back to the queue so the next worker to start
+            # (or a live sibling's heartbeat) runs it without waiting for the lease to expire
+            self.store.release(job_id, self.worker_id)
+            raise
+        except Exception as e:
+            print(f"[jobs] {job_id} failed: {e}")
+            self.store.update(job_id, status="failed", error=str(e))
+            self._publish(job_id, {"type": "failed", "error": str(e)})
+        else:
+            self.store.update(job_id, status="done", result=result)
+            self._publish(job_id, {"type": "done", "result": result})
+            print(f"[jobs] {job_id} done in {time.time() - started:.2f}s")
+        finally:
+            self._running.discard(job_id)
+            if job.get("pdf_path") and self.store.get(job_id)["status"] in TERMINAL_STATUSES:
+                try:
+                    os.remove(job["pdf_path"])
+                except FileNotFoundError:
+                    pass
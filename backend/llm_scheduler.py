@@ -0,0 +1,133 @@
+"""
+Process-wide scheduler for outgoing LLM calls.
+
+Every chat completion (single-call summaries, section/map summaries, the
+aggregator, QA answers) goes through `scheduler`, which
+
+- caps the number of in-flight requests across all concurrent users,
+- paces requests against a tokens-per-minute budget (token bucket), and
+- retries 429 / 5xx / connection errors with jittered exponential backoff,
+  honouring Retry-After when the provider sends one.
+
+The OpenAI clients are built with max_retries=0 so retries only happen here.
+
+The limits are for the whole deployment. With several API workers (the
+launchers set LLM_LIMIT_WORKERS to their count) each process enforces its
+1/N share, so together they stay under the provider's limits.
+"""
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+
+import openai
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "16"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "2000000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60.0"))
+LLM_LIMIT_WORKERS = max(1, int(os.getenv("LLM_LIMIT_WORKERS", "1")))  # processes sharing the limits above
+
+
+def estimate_tokens(text: str, completion_tokens: int = 1000) -> int:
+    """Cheap prompt+completion estimate for rate limiting (~4 chars per token)."""
+    return len(text) // 4 + completion_tokens
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._bucket_lock = asyncio.Lock()
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.retries = 0
+
+    async def run(self, call, tokens: int = 0, label: str = "llm"):
+        """
+        Await `call()` (a zero-arg coroutine factory) under the global limits,
+        retrying rate-limit and server errors. Non-retryable errors propagate.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.slot(tokens):
+                    return await call()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = _retry_after(e) or self._backoff(attempt)
+                self.retries += 1
+                print(f"[scheduler] {label}: {type(e).__name__}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """Hold one in-flight slot (after paying `tokens` from the TPM bucket). Used directly for streams."""
+        await self._take_tokens(tokens)
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def _backoff(self, attempt: int) -> float:
+        # "Equal jitter": half deterministic, half random, so bursts of 429s spread out
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    async def _take_tokens(self, tokens: int):
+        if tokens <= 0 or self.tokens_per_minute <= 0:
+            return
+        tokens = min(tokens, self.tokens_per_minute)
+        rate = self.tokens_per_minute / 60.0
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled_at) * rate)
+                self._refilled_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / rate)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "tokens_available": int(self._tokens),
+            "tokens_per_minute": self.tokens_per_minute,
+            "workers_sharing_limits": LLM_LIMIT_WORKERS,
+            "retries": self.retries,
+        }
+
+
+scheduler = LLMScheduler(max_in_flight=max(1, LLM_MAX_IN_FLIGHT // LLM_LIMIT_WORKERS),
+                         tokens_per_minute=LLM_TOKENS_PER_MINUTE // LLM_LIMIT_WORKERS)
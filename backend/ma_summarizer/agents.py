@@ -1,20 +1,85 @@
 import requests
-from lxml import etree
-import re
-import nltk
 import asyncio
-import numpy as np
-from langchain_openai import OpenAIEmbeddings
-from nltk.tokenize import sent_tokenize
-from langchain_core.prompts import PromptTemplate
+import threading
+from collections import OrderedDict
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_openai import ChatOpenAI
+from concurrency import pdf_pool, io_pool, run_in_pool
+from llm_scheduler import scheduler, estimate_tokens
+from embedding_service import get_embedding_service
+from ma_summarizer.sentences import split_sentences
+from ma_summarizer.highlighting import normalize_rows, top_k_similar
+from ma_summarizer.tei import parse_tei_sections
+from ma_summarizer.grobid_client import GrobidClient, GROBID_URL, GROBID_CONNECT_TIMEOUT, GROBID_READ_TIMEOUT
+from telemetry import span, TokenUsageCallback
+from cache import hash_bytes
+from schemas import AggregatedSummary, response_format
+from structured import afinalize
 # from spire.pdf import PdfDocument, PdfTextFinder, PdfTextFindOptions, TextFindParameter
 
 
 
-# Ensure sentence tokenizer is available
-nltk.download("punkt", quiet=True)
+# Bump whenever a prompt changes so its cached outputs are invalidated. They are
+# versioned separately: an aggregator tweak keeps every section summary.
+SECTION_PROMPT_VERSION = "3"
+AGGREGATOR_PROMPT_VERSION = "4"
+PROMPT_VERSION = f"{SECTION_PROMPT_VERSION}.{AGGREGATOR_PROMPT_VERSION}"
+
+# Static instructions go in the system message and the variable content last,
+# so every call shares the same prompt prefix (OpenAI caches identical leading tokens).
+SECTION_SYSTEM_PROMPT = """You are an expert AI research assistant. You will be given one section of a research paper.
+Produce a concise, structured, and academic-style summary of it.
+
+Instructions:
+- Include key points and methodology if present
+- Mention any datasets, results, or experiments
+- Keep summary factual and concise"""
+
+AGGREGATOR_SYSTEM_PROMPT = """You are an expert machine learning research assistant.
+
+You will be given the section summaries of a research paper.
+
+Your task:
+    Utilise the section summaries to produce a highly detailed ML-focused technical summary. Extract every available detail about:
+    - model architecture
+    - input/output modalities
+    - data preprocessing and feature engineering
+    - training setup (optimizers, loss functions, learning rate schedules)
+    - hyperparameters
+    - experiments and ablations
+    - evaluation metrics
+    - datasets used and how they were constructed
+    - results and comparisons with baselines
+    - limitations and implications
+
+
+Format your response strictly in JSON following the template below:
+
+{{
+    "name_of_research_paper": "YoloV5",
+    "objective": "... let the machine see light ...",
+    "models": [
+        {{
+            "name": "YoloV5",
+            "input": "image...",
+            "output": "metadata...",
+            "machine_learning_category": "object detection",
+            "data_engineering": "...",
+            "feature_engineering": "...",
+            "model_training": "...",
+            "model_evaluation": "...",
+            "model_results": "...",
+            "limitations_and_implications": "..."
+        }}
+    ],
+    "key_findings": "..."
+}}"""
+
+# GROBID often emits one-paragraph subsections; anything shorter than this is
+# packed together with its neighbours into one LLM call (up to PACK_MAX_CHARS).
+PACK_MIN_CHARS = 1500
+PACK_MAX_CHARS = 6000
 
 
 class GrobidSectionAgent:
@@ -26,161 +91,219 @@ class GrobidSectionAgent:
        chunks are removed (PyMuPDF handles those separately).
     """
 
-    def __init__(self, grobid_url: str = "http://localhost:8070/api/processFulltextDocument"):
+    def __init__(self, grobid_url: str = GROBID_URL, timeout: float = GROBID_READ_TIMEOUT, client: GrobidClient = None):
         self.grobid_url = grobid_url
+        self.timeout = timeout
+        self.client = client or GrobidClient(grobid_url, read_timeout=timeout)
+        self._session = None
 
-    def extract_sections(self, pdf_path: str):
+    def extract_sections(self, pdf):
         """
-        Sends PDF to GROBID and returns flattened section list:
+        Sends PDF (raw bytes or a path) to GROBID and returns flattened section list:
         [
             { "heading": "Introduction", "content": "Full section text..." },
             ...
         ]
         """
-        with open(pdf_path, "rb") as f:
-            response = requests.post(
-                self.grobid_url,
-                files={"input": f},
-                data={"generateIDs": "true", "teiCoordinates": "true"}
-            )
+        pdf_bytes = pdf if isinstance(pdf, bytes) else _read_file_bytes(pdf)
+        if self._session is None:
+            self._session = requests.Session()  # keep-alive across papers
+        response = self._session.post(
+            self.grobid_url,
+            files={"input": ("paper.pdf", pdf_bytes, "application/pdf")},
+            data={"generateIDs": "true", "teiCoordinates": "true"},
+            timeout=(GROBID_CONNECT_TIMEOUT, self.timeout)
+        )
         response.raise_for_status()
-        xml_text = response.text
-
-        # Parse TEI XML into structured sections
-        sections = self._parse_tei_xml(xml_text)
-
-        # Flatten nested subsections
-        flat_sections = self._flatten_sections(sections)
+        return self._sections_from_tei(response.text)
 
-        # Return only those with actual content
-        return [s for s in flat_sections if s["content"].strip()]
-
-    def _parse_tei_xml(self, xml_text: str):
-        root = etree.fromstring(xml_text.encode("utf-8"))
-        body = root.find(".//{*}body")
-        sections = []
-        if body is not None:
-            for div in body.findall("{*}div"):
-                sections.append(self._parse_div(div))
+    async def aextract_sections(self, pdf):
+        """
+        Async twin of extract_sections: the upload goes through the pooled
+        GrobidClient and TEI parsing runs on the PDF pool, so the event loop
+        stays free. Raises GrobidError when GROBID is down, overloaded or fails.
+        """
+        pdf_bytes = pdf if isinstance(pdf, bytes) else await run_in_pool(io_pool, _read_file_bytes, pdf)
+        with span("grobid", bytes=len(pdf_bytes)) as sp:
+            xml_text = await self.client.process_fulltext(pdf_bytes)
+            sections = await run_in_pool(pdf_pool, self._sections_from_tei, xml_text)
+            sp.tag(sections=len(sections))
         return sections
 
-    def _parse_div(self, div):
-        heading = div.findtext("{*}head")
-        content = " ".join(list(div.itertext())).strip()
-        subsections = [self._parse_div(d) for d in div.findall("{*}div")]
-
-        return {
-            "heading": heading.strip() if heading else "Untitled",
-            "content": content,
-            "subsections": subsections,
-        }
-
-    def _flatten_sections(self, sections):
-        flat = []
-
-        def walk(sec):
-            if sec.get("content", "").strip():
-                flat.append({
-                    "heading": sec.get("heading"),
-                    "content": sec.get("content"),
-                })
-            for s in sec.get("subsections", []):
-                walk(s)
+    def _sections_from_tei(self, xml_text: str):
+        # One streaming pass: each section's own paragraphs once, with ids and coords
+        return parse_tei_sections(xml_text)
 
-        for s in sections:
-            walk(s)
-        return flat
+def _read_file_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
 
 class SectionSummaryAgent:
-    def __init__(self, llm_model: str = "gpt-4o-mini", temperature: float = 0.05):
-        self.llm = ChatOpenAI(model=llm_model, temperature=temperature)
-        self.prompt_template = PromptTemplate.from_template("""
-You are an expert AI research assistant. Summarize the section "{section_name}" 
-from the following content. Produce a concise, structured, and academic-style summary.
-
-Section Text:
-{section_text}
-
-Instructions:
-- Include key points and methodology if present
-- Mention any datasets, results, or experiments
-- Keep summary factual and concise
-""")
+    def __init__(self, llm_model: str = "gpt-4o-mini", temperature: float = 0.05, cache=None):
+        """With a `cache` (cache.PaperCache), each summary is memoized by (section text hash, prompt version, model)."""
+        self.llm_model = llm_model
+        self.cache = cache
+        # Retries are handled by the shared scheduler, not the client
+        self.llm = ChatOpenAI(model=llm_model, temperature=temperature, max_retries=0, stream_usage=True)
+        self.prompt_template = ChatPromptTemplate.from_messages([
+            ("system", SECTION_SYSTEM_PROMPT),
+            ("human", 'Section "{section_name}":\n\n{section_text}'),
+        ])
         self.parser = StrOutputParser()
         self.chain = self.prompt_template | self.llm | self.parser
 
-    async def asummarize(self, section_name: str, section_text: str) -> str:
-        return await self.chain.ainvoke({"section_name": section_name, "section_text": section_text})
+    def _memo_key(self, section_name: str, section_text: str) -> str:
+        return hash_bytes(f"{section_name}\n{section_text}".encode("utf-8"))
+
+    def cached_summary(self, section_name: str, section_text: str):
+        """The memoized summary of this exact section under the current prompt and model, or None."""
+        if self.cache is None:
+            return None
+        return self.cache.get_json("section_summary", self._memo_key(section_name, section_text),
+                                   model=self.llm_model, prompt_version=SECTION_PROMPT_VERSION)
+
+    async def asummarize(self, section_name: str, section_text: str, stage: str = "section_llm") -> str:
+        with span(stage, section=section_name, chars=len(section_text)):
+            summary = await scheduler.run(
+                lambda: self.chain.ainvoke(
+                    {"section_name": section_name, "section_text": section_text},
+                    config={"callbacks": [TokenUsageCallback(stage)]},
+                ),
+                tokens=estimate_tokens(section_text, completion_tokens=500),
+                label=f"section '{section_name}'",
+            )
+        if self.cache is not None:
+            self.cache.put_json("section_summary", self._memo_key(section_name, section_text), summary,
+                                model=self.llm_model, prompt_version=SECTION_PROMPT_VERSION)
+        return summary
 
-async def summarize_sections_parallel(sections, section_agent):
+def pack_small_sections(sections, min_chars: int = PACK_MIN_CHARS, max_chars: int = PACK_MAX_CHARS):
+    """
+    Merge runs of consecutive tiny sections into one pseudo-section so they share
+    an LLM call. Packed entries keep the original headings under "parts".
+    """
+    packed, run = [], []
+
+    def flush():
+        if not run:
+            return
+        if len(run) == 1:
+            packed.append(run[0])
+        else:
+            packed.append({
+                "heading": " / ".join(s["heading"] for s in run),
+                "content": "\n\n".join(f"### {s['heading']}\n{s['content']}" for s in run),
+                "parts": [s["heading"] for s in run],
+            })
+        run.clear()
+
+    run_chars = 0
+    for sec in sections:
+        size = len(sec["content"])
+        if size >= min_chars:
+            flush()
+            run_chars = 0
+            packed.append(sec)
+            continue
+        if run and run_chars + size > max_chars:
+            flush()
+            run_chars = 0
+        run.append(sec)
+        run_chars += size
+    flush()
+    return packed
+
+async def _summarize_or_fail(sec, section_agent) -> dict:
+    """One section summary; a failure becomes an entry with "error" instead of sinking the whole paper."""
+    result = {"section": sec["heading"]}
+    if "parts" in sec:
+        result["parts"] = sec["parts"]
+    try:
+        summary = section_agent.cached_summary(sec["heading"], sec["content"])
+        if summary is not None:
+            result["cached"] = True
+        else:
+            summary = await section_agent.asummarize(sec["heading"], sec["content"])
+        result["summary"] = summary
+    except Exception as e:
+        print(f"[backend] Section '{sec['heading']}' failed: {e}")
+        result["summary"] = ""
+        result["error"] = str(e)
+    return result
+
+async def summarize_sections_parallel(sections, section_agent, on_done=None):
+    """
+    Summarize every section concurrently (in-flight calls are capped by the shared
+    scheduler). `on_done(result)` fires as each one finishes.
+    """
     async def summarize_one(sec):
-        return {
-            "section": sec["heading"],
-            "summary": await section_agent.asummarize(sec["heading"], sec["content"])
-        }
+        result = await _summarize_or_fail(sec, section_agent)
+        if on_done is not None:
+            on_done(result)
+        return result
 
     tasks = [summarize_one(sec) for sec in sections]
     return await asyncio.gather(*tasks)
 
+async def iter_section_summaries(sections, section_agent):
+    """Yield (index, {"section", "summary"}) for each section in completion order, not paper order."""
+    async def summarize_one(i, sec):
+        return i, await _summarize_or_fail(sec, section_agent)
+
+    for next_done in asyncio.as_completed([summarize_one(i, sec) for i, sec in enumerate(sections)]):
+        yield await next_done
+
 class SummaryAggregatorAgent:
     def __init__(self, llm_model: str = "gpt-4o-mini", temperature: float = 0.05):
-        self.llm = ChatOpenAI(model=llm_model, temperature=temperature)
-        self.prompt_template = PromptTemplate.from_template("""
-            You are an expert machine learning research assistant. 
-
-
-            Here is the section summaries from the research paper.
-
-            {sections_text}
-
-            Your task:
-                Utilise the section summaries to produce a highly detailed ML-focused technical summary. Extract every available detail about:
-                - model architecture
-                - input/output modalities
-                - data preprocessing and feature engineering
-                - training setup (optimizers, loss functions, learning rate schedules)
-                - hyperparameters
-                - experiments and ablations
-                - evaluation metrics
-                - datasets used and how they were constructed
-                - results and comparisons with baselines
-                - limitations and implications
-
-
-            Format your response strictly in JSON following the template below:
-
-            {{
-                "name_of_research_paper": "YoloV5",
-                "objective": "... let the machine see light ...",
-                "models": [
-                    {{
-                        "YoloV5": {{
-                            "name": "YoloV5",
-                            "input": "image...",
-                            "output": "metadata...",
-                            "machine_learning_category": "object detection",
-                            "data
-                            "data_engineering": "...",
-                            "feature_engineering": "...",
-                            "model_training": "...",
-                            "model_evaluation": "...",
-                            "model_results": "...",
-                            "limitations_and_implications": "..."
-                        }}
-                    }}
-                ],
-                "key_findings": "..."
-            }}
-            """
-)
+        self.llm_model = llm_model
+        self.llm = ChatOpenAI(model=llm_model, temperature=temperature, max_retries=0, stream_usage=True)
+        self.prompt_template = ChatPromptTemplate.from_messages([
+            ("system", AGGREGATOR_SYSTEM_PROMPT),
+            ("human", "Here are the section summaries from the research paper.\n\n{sections_text}"),
+        ])
         self.parser = StrOutputParser()
+        # Native structured output; avalidate() checks the result and repairs broken fields
+        self.structured_llm = self.llm.bind(response_format=response_format(AggregatedSummary))
+
+    def _sections_text(self, section_summaries: list[dict]) -> str:
+        usable = [s for s in section_summaries if not s.get("error")]
+        if not usable:
+            raise RuntimeError("Every section summary failed; nothing to aggregate")
+        return "\n\n".join([f"## {s['section']}\n{s['summary']}" for s in usable])
 
     def combine(self, section_summaries: list[dict]) -> str:
-        sections_text = "\n\n".join([f"## {s['section']}\n{s['summary']}" for s in section_summaries])
-        chain = self.prompt_template | self.llm | self.parser
+        sections_text = self._sections_text(section_summaries)
+        chain = self.prompt_template | self.structured_llm | self.parser
         return chain.invoke({"sections_text": sections_text})
 
+    async def avalidate(self, text: str, section_summaries: list[dict]) -> str:
+        """The aggregator's JSON, validated against AggregatedSummary with only broken fields re-requested."""
+        messages = self.prompt_template.format_messages(sections_text=self._sections_text(section_summaries))
+        return await afinalize(text, AggregatedSummary, self.llm, messages, "aggregate")
+
+    async def acombine(self, section_summaries: list[dict]) -> str:
+        sections_text = self._sections_text(section_summaries)
+        chain = self.prompt_template | self.structured_llm | self.parser
+        with span("aggregate", sections=len(section_summaries)):
+            text = await scheduler.run(
+                lambda: chain.ainvoke({"sections_text": sections_text}, config={"callbacks": [TokenUsageCallback("aggregate")]}),
+                tokens=estimate_tokens(sections_text, completion_tokens=2000),
+                label="aggregator",
+            )
+        return await self.avalidate(text, section_summaries)
+
+    async def astream_combine(self, section_summaries: list[dict]):
+        """Yield the aggregated summary token by token (validate the joined text with avalidate)."""
+        sections_text = self._sections_text(section_summaries)
+        chain = self.prompt_template | self.structured_llm | self.parser
+        with span("aggregate", sections=len(section_summaries), streamed=True):
+            async with scheduler.slot(estimate_tokens(sections_text, completion_tokens=2000)):
+                async for token in chain.astream({"sections_text": sections_text},
+                                                 config={"callbacks": [TokenUsageCallback("aggregate")]}):
+                    if token:
+                        yield token
+
 
 class SummaryHighlighterAgent:
     """
@@ -201,51 +324,113 @@ class SummaryHighlighterAgent:
 
 
     """
-    def __init__(self, embedding_model: str = "text-embedding-3-small"):
-        self.embedder = OpenAIEmbeddings(model=embedding_model)
+    def __init__(self, embedding_model: str = "text-embedding-3-small", max_papers: int = 32):
+        self.embedder = get_embedding_service(embedding_model)
+        # (paper key, hash of the chunk texts) -> normalized float32 chunk matrix, so repeat calls
+        # skip the embedding lookups and norms; the text hash keeps a re-chunked paper from
+        # matching against a stale matrix
+        self._chunk_matrices = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_papers = max_papers
+
+    @staticmethod
+    def _matrix_key(all_chunks: list[dict], paper_key):
+        if paper_key is None:
+            return None
+        return paper_key, hash_bytes("\0".join(c["content"] for c in all_chunks).encode("utf-8"))
+
+    def _cached_matrix(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            matrix = self._chunk_matrices.get(key)
+            if matrix is not None:
+                self._chunk_matrices.move_to_end(key)
+            return matrix
+
+    def _chunk_matrix(self, key, chunk_vectors):
+        """Normalized matrix for `key`, filled from `chunk_vectors` unless another call got there first."""
+        normalized = normalize_rows(chunk_vectors)
+        if key is None:
+            return normalized
+        with self._lock:
+            if key in self._chunk_matrices:
+                self._chunk_matrices.move_to_end(key)
+                return self._chunk_matrices[key]
+            self._chunk_matrices[key] = normalized
+            while len(self._chunk_matrices) > self.max_papers:
+                self._chunk_matrices.popitem(last=False)
+        return normalized
+
+    def _build_results(self, summary_sentences, all_chunks, indices, scores):
+        results = []
+        for i, sent in enumerate(summary_sentences):
+            for j, score in zip(indices[i], scores[i]):
+                chunk = all_chunks[j]
+                results.append({
+                    "summary_sentence": sent,
+                    "matched_chunk": chunk["content"],
+                    "page": chunk.get("page"),
+                    "coords": chunk.get("coords"),
+                    "similarity": float(score)
+                })
+        return results
 
-    def link_summary_to_sources(self, final_summary: str, all_chunks: list[dict], top_k: int = 1):
+    def link_summary_to_sources(self, final_summary: str, all_chunks: list[dict], top_k: int = 1, paper_key: str = None):
         """
         Compute semantic similarity between summary sentences and source chunks.
         Returns a mapping of summary sentences to source text with metadata.
+        Pass `paper_key` (e.g. the content hash) to reuse the normalized chunk matrix across calls.
         """
         # 1. Split the final summary into sentences
-        summary_sentences = sent_tokenize(final_summary)
-        print("Highlight agent Summary sentences:", summary_sentences[:5])
+        summary_sentences = split_sentences(final_summary)
+        print(f"Highlight agent: {len(summary_sentences)} summary sentences, {len(all_chunks)} chunks")
 
+        # 2. Prepare embeddings (cached + batched by the embedding service)
+        key = self._matrix_key(all_chunks, paper_key)
+        chunk_matrix = self._cached_matrix(key)
+        if chunk_matrix is None:
+            chunk_matrix = self._chunk_matrix(key, self.embedder.embed_matrix([c["content"] for c in all_chunks]))
+        summary_matrix = normalize_rows(self.embedder.embed_matrix(summary_sentences))
 
-        # 2. Prepare embeddings
-        chunk_texts = [c["content"] for c in all_chunks]
-        print("Highlight agent Chunk texts:", chunk_texts[:5])
-        chunk_embeddings = self.embedder.embed_documents(chunk_texts)
-        summary_embeddings = self.embedder.embed_documents(summary_sentences)
+        # 3. Top-k cosine matches for all sentences in one blocked pass
+        indices, scores = top_k_similar(summary_matrix, chunk_matrix, top_k=top_k)
 
-        # 3. Compute cosine similarity
-        chunk_matrix = np.array(chunk_embeddings)
-        summary_matrix = np.array(summary_embeddings)
+        # 4. Build mapping results
+        return self._build_results(summary_sentences, all_chunks, indices, scores)
 
-        similarity_matrix = np.dot(summary_matrix, chunk_matrix.T) / (
-            np.linalg.norm(summary_matrix, axis=1, keepdims=True)
-            * np.linalg.norm(chunk_matrix, axis=1)
-        )
+    async def alink_summary_to_sources(self, final_summary: str, all_chunks: list[dict], top_k: int = 1, paper_key: str = None):
+        """Async link_summary_to_sources: embeddings via aembed_matrix, matrix math on the PDF pool."""
+        with span("highlight", chunks=len(all_chunks)) as sp:
+            summary_sentences = await run_in_pool(pdf_pool, split_sentences, final_summary)
+            sp.tag(sentences=len(summary_sentences))
 
-        # 4. Build mapping results
-        results = []
-        for i, sent in enumerate(summary_sentences):
-            # Find top-k most similar chunks
-            top_indices = np.argsort(similarity_matrix[i])[::-1][:top_k]
-            matches = [
-                {
-                    "summary_sentence": sent,
-                    "matched_chunk": all_chunks[j]["content"],
-                    "page": all_chunks[j].get("page"),
-                    "coords": all_chunks[j].get("coords"),
-                    "similarity": float(similarity_matrix[i][j])
-                }
-                for j in top_indices
-            ]
-            results.extend(matches)
+            key = await run_in_pool(pdf_pool, self._matrix_key, all_chunks, paper_key)
+            chunk_matrix = self._cached_matrix(key)
+            chunks = None if chunk_matrix is not None else await self.embedder.aembed_matrix([c["content"] for c in all_chunks])
+            summary_matrix = await self.embedder.aembed_matrix(summary_sentences)
 
-        print("results of highlight agent:", results[:5])
+            def match():
+                matrix = chunk_matrix if chunk_matrix is not None else self._chunk_matrix(key, chunks)
+                return top_k_similar(normalize_rows(summary_matrix), matrix, top_k=top_k)
 
-        return results
+            indices, scores = await run_in_pool(pdf_pool, match)
+        return self._build_results(summary_sentences, all_chunks, indices, scores)
+
+def sentence_chunks(sections: list[dict]) -> list[dict]:
+    """
+    Sentence-level source chunks for highlighting, tagged with their section
+    heading and the page/coords of the paragraph they came from (when known).
+    """
+    chunks = []
+    for sec in sections:
+        paragraphs = sec.get("paragraphs") or [{"text": sec["content"], "page": sec.get("page"), "coords": sec.get("coords")}]
+        for para in paragraphs:
+            for sent in split_sentences(para["text"]):
+                chunks.append({
+                    "content": sent,
+                    "section": sec["heading"],
+                    "page": para.get("page") or sec.get("page"),
+                    "coords": para.get("coords") or sec.get("coords"),
+                })
+    return chunks
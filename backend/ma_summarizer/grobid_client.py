@@ -0,0 +1,172 @@
+"""
+Pooled async client for GROBID's processFulltextDocument.
+
+- One httpx.AsyncClient per process, with keep-alive connections and
+  separate connect / read timeouts.
+- At most GROBID_CONCURRENCY papers in flight (GROBID has a fixed pool of
+  engines and answers 503 when it is full).
+- 503s and connection errors are retried with jittered backoff.
+- A circuit breaker stops sending work after GROBID_BREAKER_FAILURES
+  consecutive failures and lets one probe through after
+  GROBID_BREAKER_RESET seconds. While it is open, calls fail fast with
+  GrobidUnavailable and the pipeline falls back to the PyMuPDF heading
+  splitter (heading_splitter.py).
+
+Point GROBID_URL at grobid_replay.py to run the multi-agent path offline.
+"""
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+GROBID_URL = os.getenv("GROBID_URL", "http://localhost:8070/api/processFulltextDocument")
+GROBID_CONNECT_TIMEOUT = float(os.getenv("GROBID_CONNECT_TIMEOUT", "5"))
+GROBID_READ_TIMEOUT = float(os.getenv("GROBID_READ_TIMEOUT", "120"))
+GROBID_CONCURRENCY = int(os.getenv("GROBID_CONCURRENCY", "4"))
+GROBID_MAX_RETRIES = int(os.getenv("GROBID_MAX_RETRIES", "2"))
+GROBID_BREAKER_FAILURES = int(os.getenv("GROBID_BREAKER_FAILURES", "5"))
+GROBID_BREAKER_RESET = float(os.getenv("GROBID_BREAKER_RESET", "30"))
+
+
+class GrobidError(Exception):
+    """GROBID could not process this paper; callers should fall back."""
+
+
+class GrobidUnavailable(GrobidError):
+    """GROBID is down, overloaded or the breaker is open."""
+
+
+class CircuitBreaker:
+    """closed -> (N consecutive failures) -> open -> (reset_after) -> half-open -> one probe."""
+
+    def __init__(self, failure_threshold: int = GROBID_BREAKER_FAILURES, reset_after: float = GROBID_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def end_probe(self):
+        """The probe ended without a verdict (cancelled, unexpected error): let the next call probe."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            if self.opened_at is None:
+                print(f"[grobid] Circuit open after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class GrobidClient:
+    def __init__(self, url: str = GROBID_URL, connect_timeout: float = GROBID_CONNECT_TIMEOUT,
+                 read_timeout: float = GROBID_READ_TIMEOUT, concurrency: int = GROBID_CONCURRENCY,
+                 max_retries: int = GROBID_MAX_RETRIES, breaker: CircuitBreaker = None):
+        self.url = url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._slots = None
+        self.in_flight = 0
+        self.requests = 0
+        self.fallbacks = 0
+
+    async def process_fulltext(self, pdf_bytes: bytes) -> str:
+        """TEI XML for `pdf_bytes`. Raises GrobidError (GrobidUnavailable when GROBID itself is down)."""
+        probe = self.breaker.state == "half-open"
+        if not self.breaker.allow():
+            self.fallbacks += 1
+            raise GrobidUnavailable("GROBID circuit breaker is open")
+        try:
+            return await self._post(pdf_bytes)
+        finally:
+            # record_success / record_failure already ended it; this covers cancellation and anything else
+            if probe:
+                self.breaker.end_probe()
+
+    async def _post(self, pdf_bytes: bytes) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore():
+                    self.in_flight += 1
+                    try:
+                        response = await self._http().post(
+                            self.url,
+                            files={"input": ("paper.pdf", pdf_bytes, "application/pdf")},
+                            data={"generateIDs": "true", "teiCoordinates": "true"},
+                        )
+                    finally:
+                        self.in_flight -= 1
+                self.requests += 1
+                if response.status_code == 503:
+                    raise GrobidUnavailable("GROBID is overloaded (503)")
+                response.raise_for_status()
+                self.breaker.record_success()
+                return response.text
+            except (GrobidUnavailable, httpx.TransportError) as e:
+                if attempt == self.max_retries:
+                    self.breaker.record_failure()
+                    self.fallbacks += 1
+                    raise GrobidUnavailable(str(e) or type(e).__name__) from e
+                delay = min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"[grobid] {type(e).__name__}: {e}; retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except httpx.HTTPStatusError as e:
+                # 4xx/500 for this particular PDF: GROBID itself is fine
+                self.breaker.record_success()
+                self.fallbacks += 1
+                raise GrobidError(f"GROBID returned {e.response.status_code}") from e
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "fallbacks": self.fallbacks,
+        }
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._slots
@@ -0,0 +1,91 @@
+"""
+Fallback section splitter for when GROBID is down or overloaded.
+
+Uses PyMuPDF's span-level font info: the most common font size (by
+characters) is taken as body text, and a short line counts as a heading if
+it is set noticeably larger than body text, or bold at body size and looks
+like a numbered / known section title. Everything up to the next heading is
+that section's content. References and anything after them are dropped, like
+GROBID's <body>.
+
+Returns the same shape as GrobidSectionAgent.extract_sections, plus the page
+each section starts on.
+"""
+import re
+from collections import Counter
+
+from pdf_extract import open_pdf
+
+HEADING_SIZE_RATIO = 1.15
+MAX_HEADING_CHARS = 100
+MAX_HEADING_WORDS = 12
+BOLD_FLAG = 16
+
+_NUMBERED = re.compile(r"^(\d+(\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.)\s+\S")
+_KNOWN = re.compile(
+    r"^(abstract|introduction|background|related work|methods?|methodology|materials and methods|"
+    r"experiments?|results|discussion|conclusions?|limitations|future work|acknowledge?ments?|appendix)\b",
+    re.IGNORECASE,
+)
+_REFERENCES = re.compile(r"^(\d+\.?\s+)?(references|bibliography|works cited)\s*$", re.IGNORECASE)
+
+
+def _lines(doc):
+    """(page number, text, max font size, is bold) for every text line."""
+    for page_no, page in enumerate(doc, start=1):
+        for block in page.get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                spans = [s for s in line["spans"] if s["text"].strip()]
+                if not spans:
+                    continue
+                text = " ".join(s["text"].strip() for s in spans)
+                size = max(s["size"] for s in spans)
+                bold = all(s["flags"] & BOLD_FLAG or "bold" in s["font"].lower() for s in spans)
+                yield page_no, text, round(size, 1), bold
+
+
+def _body_size(lines) -> float:
+    sizes = Counter()
+    for _, text, size, _ in lines:
+        sizes[size] += len(text)
+    return sizes.most_common(1)[0][0] if sizes else 0.0
+
+
+def _is_heading(text: str, size: float, bold: bool, body_size: float) -> bool:
+    if len(text) > MAX_HEADING_CHARS or len(text.split()) > MAX_HEADING_WORDS:
+        return False
+    # Headings don't end mid-sentence; short ones like "A. Setup." are fine
+    if text.endswith((",", ";", ":")) or (text.endswith(".") and len(text.split()) > 4):
+        return False
+    if not re.search(r"[A-Za-z]", text):
+        return False
+    if size >= body_size * HEADING_SIZE_RATIO:
+        return True
+    return bold and size >= body_size * 0.95 and bool(_NUMBERED.match(text) or _KNOWN.match(text))
+
+
+def split_sections(pdf) -> list[dict]:
+    """[{"heading", "content", "page"}] from font/heading heuristics; `pdf` is raw bytes or a path."""
+    with open_pdf(pdf) as doc:
+        lines = list(_lines(doc))
+
+    body_size = _body_size(lines)
+    sections = []
+    current = {"heading": "Untitled", "content": [], "page": 1}
+    for page_no, text, size, bold in lines:
+        if _is_heading(text, size, bold, body_size):
+            if _REFERENCES.match(text):
+                break
+            if current["content"]:
+                sections.append(current)
+            current = {"heading": text, "content": [], "page": page_no}
+        else:
+            current["content"].append(text)
+    if current["content"]:
+        sections.append(current)
+
+    # Re-join hyphenated line breaks, then collapse whitespace
+    for sec in sections:
+        content = re.sub(r"-\s*\n\s*(?=[a-z])", "", "\n".join(sec["content"]))
+        sec["content"] = re.sub(r"\s+", " ", content).strip()
+    return [s for s in sections if s["content"]]
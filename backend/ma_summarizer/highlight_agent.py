@@ -3,14 +3,18 @@
 import faiss
 import numpy as np
 import fitz  # PyMuPDF
-from openai import OpenAI
+from embedding_service import get_embedding_service
+from ma_summarizer.sentences import split_sentences
+from ma_summarizer.tei import page_of
 
 class HighlightAgent:
     def __init__(self, embedding_model: str = "text-embedding-3-small"):
         self.embedding_model = embedding_model
-        self.client = OpenAI()
+        # Shared, batched + cached embedding service (one request per ~2k chunks, not one per chunk)
+        self.embedder = get_embedding_service(embedding_model)
         self.index = None
         self.chunk_metadata = []
+        self.table = None  # chunk_store.ChunkTable, when built with build_index_from_table
 
     def build_index(self, flat_sections):
         """
@@ -20,56 +24,87 @@ class HighlightAgent:
         chunks = [chunk for sec in flat_sections for chunk in sec.get("chunks", [])]
         self.chunk_metadata = chunks
 
-        # Create embeddings for each chunk
-        embeddings = []
-        for chunk in chunks:
-            emb = self.client.embeddings.create(
-                input=chunk["content"],
-                model=self.embedding_model
-            )["data"][0]["embedding"]
-            embeddings.append(emb)
-
-        embeddings = np.array(embeddings).astype("float32")
+        # Create embeddings for all chunks in batched requests
+        embeddings = self.embedder.embed_matrix([chunk["content"] for chunk in chunks])
         dim = embeddings.shape[1]
         self.index = faiss.IndexFlatL2(dim)
         self.index.add(embeddings)
 
+    def build_index_from_table(self, table, vectors=None):
+        """
+        Build the index over a QA chunk table (page and box per chunk, see
+        chunk_store.py). `vectors` are its chunk embeddings, if already known.
+        """
+        self.table = table
+        self.chunk_metadata = []
+        if vectors is None:
+            vectors = self.embedder.embed_matrix(list(table.texts))
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.index = faiss.IndexFlatL2(vectors.shape[1])
+        self.index.add(vectors)
+
     def search_chunks(self, query, top_k=3):
         """
         Return top-k chunks most relevant to the query.
         """
-        query_emb = np.array(
-            self.client.embeddings.create(
-                input=query,
-                model=self.embedding_model
-            )["data"][0]["embedding"]
-        ).astype("float32")
+        return self.search_many([query], top_k=top_k)[0]
+
+    def search_many(self, queries, top_k=3):
+        """
+        Top-k chunks for each query, embedding all queries in one batch.
+        """
+        return [[self._chunk(i) for i in row] for row in self._search_rows(queries, top_k)]
+
+    def _search_rows(self, queries, top_k):
+        query_embs = self.embedder.embed_matrix(queries)
+        distances, indices = self.index.search(query_embs, k=top_k)
+        return [[int(i) for i in row if i >= 0] for row in indices]
+
+    def _chunk(self, i):
+        if self.table is not None:
+            return {"content": self.table.text_at(i), **self.table.metadata(i)}
+        return self.chunk_metadata[i]
 
-        distances, indices = self.index.search(np.array([query_emb]), k=top_k)
-        results = [self.chunk_metadata[i] for i in indices[0]]
-        return results
+    def _location(self, i):
+        """(page, (x0, y0, x1, y1)) of row i, or (None, None)."""
+        if self.table is not None:
+            return self.table.locate(i)
+        chunk = self.chunk_metadata[i]
+        coords = chunk.get("coords")
+        page = page_of(coords) or chunk.get("page")
+        if not coords or page is None:
+            return None, None
+        # TEI coords are "page,x,y,w,h[;page,x,y,w,h...]", one box per line: join the boxes on the first page
+        boxes = []
+        for entry in coords.split(";"):
+            try:
+                p, x, y, w, h = map(float, entry.split(","))
+            except ValueError:
+                continue
+            if int(p) == page:
+                boxes.append((x, y, x + w, y + h))
+        if not boxes:
+            return page, None
+        return page, (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                      max(b[2] for b in boxes), max(b[3] for b in boxes))
 
     def highlight_summary(self, summary_text, pdf_path, output_path, top_k=3):
         """
         Highlight supporting chunks for each sentence in the summary.
         """
-        # Split summary into sentences (naive split)
-        import re
-        sentences = re.split(r'(?<=[.!?])\s+', summary_text)
+        sentences = split_sentences(summary_text)
 
         pdf = fitz.open(pdf_path)
 
-        for sentence in sentences:
-            top_chunks = self.search_chunks(sentence, top_k=top_k)
-            for chunk in top_chunks:
-                if chunk["coords"] and chunk["page"] is not None:
-                    page = pdf[chunk["page"] - 1]  # PyMuPDF pages are 0-indexed
-                    try:
-                        x0, y0, x1, y1 = map(float, chunk["coords"].split(","))
-                        rect = fitz.Rect(x0, y0, x1, y1)
-                        page.addHighlightAnnot(rect)
-                    except Exception as e:
-                        print(f"Failed to highlight chunk: {e}")
+        for rows in self._search_rows(sentences, top_k):
+            for i in rows:
+                try:
+                    page, rect = self._location(i)
+                    if page is None or rect is None:
+                        continue
+                    pdf[page - 1].add_highlight_annot(fitz.Rect(*rect))  # PyMuPDF pages are 0-indexed
+                except Exception as e:
+                    print(f"Failed to highlight chunk: {e}")
 
         pdf.save(output_path)
         print(f"Saved highlighted PDF to {output_path}")
@@ -0,0 +1,59 @@
+"""
+Vectorized top-k matching between summary sentences and source chunks.
+
+Chunk embeddings are L2-normalized once per paper into a float32 matrix, so
+cosine similarity is a plain inner product. Summary sentences are scored in
+memory-bounded blocks, and each block keeps only its top-k with
+`np.argpartition` instead of argsorting whole rows. For very large papers the
+search goes through a FAISS inner-product index instead.
+"""
+import numpy as np
+import faiss
+
+# Max floats in one (sentences x chunks) score block: 16M float32 = 64 MB
+BLOCK_FLOATS = 16 * 1024 * 1024
+# From this many chunks on, FAISS IndexFlatIP (multi-threaded BLAS) beats numpy blocks
+FAISS_MIN_CHUNKS = 50_000
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """float32 copy of `matrix` with unit-length rows (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_similar(queries: np.ndarray, chunks: np.ndarray, top_k: int = 1, block_floats: int = BLOCK_FLOATS):
+    """
+    Top-k chunk indices and cosine scores for every query row.
+
+    Both inputs must already be row-normalized float32. Returns (indices, scores),
+    each of shape (n_queries, k) with k = min(top_k, n_chunks), best match first.
+    """
+    n_queries, n_chunks = len(queries), len(chunks)
+    k = min(top_k, n_chunks)
+    if n_queries == 0 or k == 0:
+        return np.zeros((n_queries, 0), dtype=np.int64), np.zeros((n_queries, 0), dtype=np.float32)
+
+    if n_chunks >= FAISS_MIN_CHUNKS:
+        index = faiss.IndexFlatIP(chunks.shape[1])
+        index.add(chunks)
+        scores, indices = index.search(queries, k)
+        return indices.astype(np.int64), scores
+
+    indices = np.empty((n_queries, k), dtype=np.int64)
+    scores = np.empty((n_queries, k), dtype=np.float32)
+    rows_per_block = max(1, block_floats // n_chunks)
+    for start in range(0, n_queries, rows_per_block):
+        sims = queries[start:start + rows_per_block] @ chunks.T
+        if k == 1:
+            top = sims.argmax(axis=1)[:, None]
+        else:
+            # Unordered top-k per row, then sort just those k
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+        indices[start:start + len(sims)] = top
+        scores[start:start + len(sims)] = np.take_along_axis(sims, top, axis=1)
+    return indices, scores
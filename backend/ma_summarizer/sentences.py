@@ -0,0 +1,49 @@
+"""
+Sentence splitter for summaries and paper paragraphs, replacing NLTK's punkt.
+
+punkt needed `nltk.download("punkt")` at import time, which hangs or fails
+without network and added NLTK to every cold start. Scientific prose is
+regular enough for a rule-based splitter: break after . ! ? (plus closing
+quotes/brackets) when whitespace and an upper-case letter, digit or opening
+quote/bracket follow, except after the abbreviations, initials and citation
+forms listed below.
+"""
+import re
+
+# Lower-cased, without the trailing period
+ABBREVIATIONS = frozenset("""
+    al approx ca cf dept dr e.g eq eqs etc fig figs i.e inc jr ltd mr mrs ms no nos
+    p pp prof ref refs sec secs sr st tab vol vols vs viz
+""".split())
+
+_BOUNDARY = re.compile(r"""[.!?]+["')\]]*(?=\s+["'(\[]?[A-Z0-9])""")
+_LAST_WORD = re.compile(r"(\S+)$")
+_DOTTED = re.compile(r"(?:[a-z]\.)+[a-z]")  # "e.g", "u.s"
+
+
+def _is_abbreviation(text: str) -> bool:
+    """True if `text` (everything up to a candidate boundary, ending in '.') ends in an abbreviation."""
+    match = _LAST_WORD.search(text[:-1])
+    if match is None:
+        return False
+    word = match.group(1).lstrip("([\"'").lower()
+    # Single initials ("J. Smith") and dotted forms ("e.g", "U.S") are never sentence ends
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()) or bool(_DOTTED.fullmatch(word))
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split `text` into sentences, stripped and without empties."""
+    sentences = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        end = match.end()
+        if text[match.start()] == "." and end - match.start() == 1 and _is_abbreviation(text[start:end]):
+            continue
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = end
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
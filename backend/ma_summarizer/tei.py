@@ -0,0 +1,146 @@
+"""
+Streaming parser for GROBID TEI.
+
+    for section in iter_tei_sections(xml_bytes):
+        section["heading"], section["content"], section["page"], section["paragraphs"]
+
+Walks the document once with lxml `iterparse` instead of building the whole
+tree:
+
+- Each <div> in <body> yields only its *own* paragraphs, exactly once. A
+  parent's text is no longer repeated inside its subsections (itertext() over
+  the whole subtree did that), so nothing is summarized twice.
+- If a div's own paragraphs come both before and after a nested div, they are
+  yielded as two pieces, so the output keeps document order.
+- Finished elements are cleared, along with their already-processed
+  siblings, so memory stays flat however long the paper is.
+- xml:id and `coords` ("page,x,y,w,h;...") are kept for every head /
+  paragraph / formula (and their <s> children), for page-aware highlighting.
+"""
+import io
+import re
+
+from lxml import etree
+
+# Part of the cache key for parsed sections; bump when the output changes
+TEI_PARSER_VERSION = "stream-1"
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+# Block elements whose text belongs to the enclosing section
+TEXT_TAGS = {"p", "formula"}
+_SPACES = re.compile(r"\s+")
+
+
+def _local(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _text(elem) -> str:
+    return _SPACES.sub(" ", "".join(elem.itertext())).strip()
+
+
+def _coords(elem) -> str:
+    """The element's coords plus those of its <s> children, ';'-joined."""
+    parts = [elem.get("coords")] + [s.get("coords") for s in elem.iterfind(".//{*}s")]
+    return ";".join(p for p in parts if p) or None
+
+
+def page_of(coords: str):
+    """First page number in a TEI coords string."""
+    if not coords:
+        return None
+    try:
+        return int(float(coords.split(",", 1)[0]))
+    except ValueError:
+        return None
+
+
+def _release(elem):
+    """Free a finished element and any processed siblings before it."""
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _section(div: dict) -> dict:
+    paragraphs = div["paragraphs"]
+    coords = ";".join(p["coords"] for p in paragraphs if p["coords"]) or div["coords"]
+    return {
+        "heading": div["heading"] or "Untitled",
+        "number": div["number"],
+        "level": div["level"],
+        "id": div["id"],
+        "content": " ".join(p["text"] for p in paragraphs),
+        "page": page_of(div["coords"]) or next((p["page"] for p in paragraphs if p["page"]), None),
+        "coords": coords,
+        "paragraphs": paragraphs,
+    }
+
+
+def iter_tei_sections(source):
+    """
+    Yield body sections of a TEI document in document order. `source` is XML
+    text/bytes or a binary file object. Sections without text are skipped.
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    stack = []      # open <div>s in <body>
+    in_body = False
+    text_depth = 0  # >0 while inside a <p>/<formula>; their children are handled with them
+
+    for event, elem in etree.iterparse(source, events=("start", "end"), huge_tree=True):
+        tag = _local(elem.tag)
+
+        if event == "start":
+            if tag == "body":
+                in_body = True
+            elif in_body and tag == "div" and not text_depth:
+                if stack and stack[-1]["paragraphs"]:
+                    # Parent text before this subsection goes out first
+                    yield _section(stack[-1])
+                    stack[-1]["paragraphs"] = []
+                stack.append({
+                    "heading": None, "number": None, "level": len(stack) + 1,
+                    "id": elem.get(XML_ID), "coords": None, "paragraphs": [],
+                })
+            elif tag in TEXT_TAGS:
+                text_depth += 1
+            continue
+
+        # end events
+        if tag in TEXT_TAGS:
+            text_depth -= 1
+            if stack and not text_depth and elem.getparent() is not None and _local(elem.getparent().tag) == "div":
+                text = _text(elem)
+                if text:
+                    coords = _coords(elem)
+                    stack[-1]["paragraphs"].append(
+                        {"id": elem.get(XML_ID), "text": text, "coords": coords, "page": page_of(coords)}
+                    )
+                _release(elem)
+        elif tag == "head" and stack and not text_depth and _local(elem.getparent().tag) == "div":
+            div = stack[-1]
+            div["heading"] = _text(elem) or None
+            div["number"] = elem.get("n")
+            div["id"] = div["id"] or elem.get(XML_ID)
+            div["coords"] = _coords(elem)
+            _release(elem)
+        elif tag == "div" and in_body and stack and not text_depth:
+            div = stack.pop()
+            if div["paragraphs"]:
+                yield _section(div)
+            _release(elem)
+        elif tag == "body":
+            in_body = False
+            _release(elem)
+            break  # <back> (references, annexes) isn't summarized
+        elif not text_depth and (tag in ("teiHeader", "facsimile") or (in_body and not stack and tag in ("figure", "note"))):
+            _release(elem)
+
+
+def parse_tei_sections(source) -> list[dict]:
+    return list(iter_tei_sections(source))
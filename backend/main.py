@@ -1,14 +1,61 @@
-from fastapi import FastAPI, UploadFile, Form, File
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, Form, File, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import tempfile, shutil, os, time
-from summarizer import extract_pdf_text, summarize_paper_text
-from qa import  create_vectorstore_from_pdf, answer_question_with_rag
-from ma_summarizer.agents import GrobidSectionAgent, SectionSummaryAgent, SummaryAggregatorAgent, summarize_sections_parallel, SummaryHighlighterAgent
-from ma_summarizer.highlight_agent import HighlightAgent
+import time
+from cache import paper_cache
+from concurrency import io_pool, run_in_pool
+from ingest import aread_upload, UploadTooLarge
+from jobs import JobQueue, QueueFullError
+from sse import format_sse, SSE_HEADERS
+from pdf_extract import shutdown_pool as shutdown_pdf_processes
+from telemetry import request_trace, set_tags, metrics_payload, METRICS_CONTENT_TYPE
+from warmup import Services, WARM_START
 import uuid
 
-app = FastAPI(title="PDF Summarizer API")
+# qa and pipelines (LangChain, FAISS, OpenAI clients) load after startup; see warmup.py
+services = Services(("qa", "pipelines"), warmups={"qa": "warm_retrievers"})
+
+
+def _read_job_pdf(job) -> bytes:
+    with open(job["pdf_path"], "rb") as f:
+        return f.read()
+
+async def _run_summary_job(job, report):
+    pipelines = await services.get("pipelines")
+    summary_type = job["params"].get("summary_type", "detailed")
+    summary = pipelines.get_cached_summary(job["content_hash"], summary_type)
+    if summary is None:
+        pdf_bytes = await run_in_pool(io_pool, _read_job_pdf, job)
+        summary = await pipelines.run_summary_pipeline(pdf_bytes, job["content_hash"], summary_type, report=report)
+    return {"summary": summary, "paper_id": job["id"], "filename": job["filename"]}
+
+async def _run_multi_agent_job(job, report):
+    pipelines = await services.get("pipelines")
+    result = pipelines.get_cached_multi_agent_result(job["content_hash"])
+    if result is None:
+        pdf_bytes = await run_in_pool(io_pool, _read_job_pdf, job)
+        result = await pipelines.run_multi_agent_pipeline(pdf_bytes, job["content_hash"], report=report)
+    return {**result, "ma_filename": job["filename"]}
+
+job_queue = JobQueue({"summary": _run_summary_job, "multi-agent": _run_multi_agent_job})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Import qa/pipelines and preload the indexes /ask used most recently in the background:
+    # the server accepts connections (and answers /health) straight away
+    if WARM_START:
+        services.start()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    if services.loaded("pipelines"):
+        await services.modules["pipelines"].grobid_agent.client.aclose()
+    if services.loaded("qa"):
+        services.modules["qa"].corpus.flush()
+    shutdown_pdf_processes()
+
+app = FastAPI(title="PDF Summarizer API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,128 +65,368 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def save_temp_pdf(upload_file: UploadFile) -> str:
-    """Save an uploaded PDF to a temp file and return the file path."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        shutil.copyfileobj(upload_file.file, tmp)
-        return tmp.name
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """One trace per request: stage spans, tokens and cache hits, printed as a `[trace]` JSON line."""
+    with request_trace(request.url.path) as trace:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            trace.endpoint = route.path  # /jobs/{job_id}, not one label per id
+        response.headers["X-Request-ID"] = trace.request_id
+        return response
 
-# test solution: store uplaoded paper text in memory 
-vectorstores = {}
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large(request: Request, exc: UploadTooLarge):
+    """Every upload goes through ingest.read_upload, so the size limit is enforced here only."""
+    print(f"[❌] Rejected upload of {exc.size} bytes (limit {exc.limit})")
+    return JSONResponse({"error": str(exc)}, status_code=413)
 
 @app.post("/summarize")
 async def summarize_api(pdf: UploadFile = File(...), summary_type: str = Form("detailed")):
+    pipelines = await services.get("pipelines")
     start_time = time.time()
     print("\n[🟢] Received request")
 
-    pdf_path = save_temp_pdf(pdf)
-    print(f"[📄] Saved PDF temporarily: {pdf_path}")
-
     paper_id = str(uuid.uuid4())
     print("Paper ID: ", paper_id)
 
+    # 0️⃣ Same bytes + same settings → return the stored summary, no extraction or tokens
+    paper = await aread_upload(pdf)
+    set_tags(paper_id=paper_id, summary_type=summary_type)
+    cached_summary = pipelines.get_cached_summary(paper.content_hash, summary_type)
+    if cached_summary is not None:
+        print(f"[⚡] Cache hit for {paper.content_hash[:12]} in {time.time() - start_time:.3f}s\n")
+        return JSONResponse({
+            "summary": cached_summary,
+            "paper_id": paper_id,
+            "filename": pdf.filename,
+            "cached": True})
+
     try:
-        # 1️⃣ Extract text
-        t1 = time.time()
-        print("[🔍] Extracting text from PDF...")
-        paper_text = extract_pdf_text(pdf_path)
-        print(f"[✅] Text extracted ({len(paper_text)} chars) in {time.time() - t1:.2f}s")
-
-        # 2️⃣ Truncate long text
-        paper_text = paper_text[:400000]
-        print(f"[✂️] Text truncated to {len(paper_text)} chars")
-
-        # 3️⃣ Generate summary
-        t2 = time.time()
-        print("[🤖] Sending text to OpenAI model...")
-        summary = summarize_paper_text(paper_text, summary_type)
-        print(f"[✅] OpenAI summarization done in {time.time() - t2:.2f}s")
+        summary = await pipelines.run_summary_pipeline(paper.data, paper.content_hash, summary_type)
 
         print(f"[🏁] Total time: {time.time() - start_time:.2f}s\n")
         return JSONResponse({
             "summary": summary,
             "paper_id": paper_id,
-            "filename": pdf.filename})
+            "filename": pdf.filename,
+            "cached": False})
 
     except Exception as e:
         print(f"[❌] Error: {e}")
         return JSONResponse({"summary": f"Error: {str(e)}"}, status_code=500)
 
-    finally:
-        os.remove(pdf_path)
-        print(f"[🧹] Temporary file deleted: {pdf_path}")
+def _split_list(value: str) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
 
 @app.post("/upload_pdf_for_qa")
-async def upload_pdf_for_qa(file: UploadFile = File(...), paper_id: str = Form(...)):
-    tmp_path = save_temp_pdf(file)
+async def upload_pdf_for_qa(file: UploadFile = File(...), paper_id: str = Form(...),
+                            year: int = Form(None), tags: str = Form("")):
+    qa = await services.get("qa")
+    paper = await aread_upload(file)
+    set_tags(paper_id=paper_id)
+    key = qa.index_key(paper.content_hash)
+
+    # Index already on disk (this or another worker built it) → just point paper_id at it
+    if not qa.index_store.exists(key):
+        # Create vectorstore (pages, chunks and embeddings come from the cache on re-upload)
+        vectorstore = await qa.acreate_vectorstore_from_pdf(paper.data, content_hash=paper.content_hash)
+        await run_in_pool(io_pool, qa.index_store.save, key, vectorstore)
 
-    # Create vectorstore
-    vectorstore = create_vectorstore_from_pdf(tmp_path)
-    vectorstores[paper_id] = vectorstore
+    chunks = await run_in_pool(io_pool, qa.index_store.chunk_count, key)
+    # In the shared state backend, so /ask finds it from any worker
+    await run_in_pool(io_pool, qa.index_store.link, paper_id, key, filename=file.filename, chunks=chunks)
+    # Also searchable from /corpus/ask (year and comma-separated tags are optional filters there)
+    await run_in_pool(io_pool, qa.add_paper_to_corpus, paper_id, key, file.filename, year, _split_list(tags))
 
-    return {"status": "ok", "paper_id": paper_id, "chunks": len(vectorstore.index_to_docstore_id)}
+    return {"status": "ok", "paper_id": paper_id, "chunks": chunks}
 
 @app.post("/ask")
 async def ask_question(session_id: str = Form(...), paper_id: str = Form(...), question: str = Form(...)):
+    qa = await services.get("qa")
     if not question.strip(): 
         return JSONResponse({"error": "Question cannot be empty"}, status_code = 400)
     """Answer a question about a previously uploaded paper."""
-    if paper_id not in vectorstores:
+    set_tags(paper_id=paper_id)
+    retriever = await run_in_pool(io_pool, qa.get_retriever, paper_id)
+    if retriever is None:
         return JSONResponse(content={"error": "Paper not found / RAG not ready"}, status_code=404)
 
-    vectorstore = vectorstores[paper_id]
-    answer = answer_question_with_rag(session_id, vectorstore, question)
-    return {"answer": answer}
+    from sessions import session_key  # loaded with the qa service; keeps langchain out of startup
 
-grobid_agent = GrobidSectionAgent()
-section_agent = SectionSummaryAgent()
-aggregator_agent = SummaryAggregatorAgent()
-highlight_agent = HighlightAgent()
+    # One history per user *and* paper; sources carry each retrieved chunk's page and box for highlighting
+    sources = []
+    answer = await qa.aanswer_question_with_rag(session_key(session_id, paper_id), retriever, question, sources=sources)
+    return {"answer": answer, "sources": sources}
 
 @app.post("/multi-agent-summarize")
 async def multi_agent_summarize(pdf: UploadFile = File(...)):
+    pipelines = await services.get("pipelines")
     start_time = time.time()
     print("\n[🟢] Received request")
-    # Save uploaded PDF temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        shutil.copyfileobj(pdf.file, tmp)
-        pdf_path = tmp.name
-        print(f"[📄] Saved PDF temporarily: {pdf_path}")
 
-    # 1. extract sections 
-    t1 = time.time()
-    sections = grobid_agent.extract_sections(pdf_path)
-    print(f"[✅] Sections extracted ({len(sections)} sections) in {time.time() - t1:.2f}s")
+    paper = await aread_upload(pdf)
+    cached_result = pipelines.get_cached_multi_agent_result(paper.content_hash)
+    if cached_result is not None:
+        print(f"[⚡] Cache hit for {paper.content_hash[:12]} in {time.time() - start_time:.3f}s\n")
+        return JSONResponse({**cached_result, "ma_filename": pdf.filename, "paper_hash": paper.content_hash, "cached": True})
 
-    # 2. Summarize each section 
-    t2 = time.time()
-    section_summaries = await summarize_sections_parallel(sections, section_agent)
-    print(f"[✅] Section summarization done in {time.time() - t2:.2f}s")
+    result = await pipelines.run_multi_agent_pipeline(paper.data, paper.content_hash)
 
+    return JSONResponse({
+        "summary": result["summary"], 
+        "sections": result["sections"],
+        "highlights": result["highlights"],
+        "ma_filename": pdf.filename,
+        "partial": result.get("partial", False),
+        "section_source": result.get("section_source", "grobid"),
+        "paper_hash": paper.content_hash,
+        "cached": False})
 
+@app.post("/multi-agent-summarize/{paper_hash}/aggregate")
+async def reaggregate(paper_hash: str):
+    """
+    Re-run only the aggregator over the paper's stored section summaries (after an
+    aggregator prompt change, or when aggregation failed). `paper_hash` comes from
+    the /multi-agent-summarize response.
+    """
+    pipelines = await services.get("pipelines")
+    result = await pipelines.rerun_aggregation(paper_hash)
+    if result is None:
+        return JSONResponse({"error": "No stored section summaries for this paper; summarize it first"}, status_code=404)
+    return JSONResponse({**result, "cached": False})
 
-    # 3. Aggregate summaries
-    t3 = time.time()
-    final_summary = aggregator_agent.combine(section_summaries)
-    print(f"[✅] Final summarization done in {time.time() - t3:.2f}s")
+# -------------------------------
+# Cross-paper questions
+# -------------------------------
+@app.post("/corpus/ask")
+async def ask_corpus(session_id: str = Form(...), question: str = Form(...), paper_ids: str = Form(""),
+                     tags: str = Form(""), year_from: int = Form(None), year_to: int = Form(None),
+                     top_k: int = Form(None)):
+    """Answer a question across every uploaded paper, optionally limited by paper ids, tags or year."""
+    qa = await services.get("qa")
+    if not question.strip():
+        return JSONResponse({"error": "Question cannot be empty"}, status_code=400)
+    filters = {"paper_ids": _split_list(paper_ids) or None, "tags": _split_list(tags) or None,
+               "year_from": year_from, "year_to": year_to}
+    set_tags(corpus=True)
+    from sessions import session_key
 
-    # # 4. Compute sentence-level highlights 
-    # t4 = time.time()
-    # highlighter = SummaryHighlighterAgent()
-    # highlights = highlighter.link_summary_to_sources(
-    #     final_summary = final_summary, 
-    #     all_chunks = [chunk for sec in sections for chunk in sec["chunks"]]
-    # )
-    # print(f"[✅] Highlight mapping done in {time.time() - t4:.2f}s")
+    answer, hits = await qa.aanswer_corpus_question(session_key(session_id, "corpus"), question, filters,
+                                                    top_k or qa.CORPUS_TOP_K)
+    sources = [{k: h[k] for k in ("paper_id", "title", "year", "chunk", "score")} for h in hits]
+    return {"answer": answer, "sources": sources}
 
+@app.delete("/corpus/papers/{paper_id}")
+async def remove_from_corpus(paper_id: str):
+    """Stop answering from this paper in /corpus/ask (its per-paper /ask index is kept)."""
+    qa = await services.get("qa")
+    removed = await run_in_pool(io_pool, qa.corpus.remove, paper_id)
+    if not removed:
+        return JSONResponse({"error": "Paper not in corpus"}, status_code=404)
+    return {"status": "ok", "paper_id": paper_id}
 
-    return JSONResponse({
-        "summary": final_summary, 
-        "sections": section_summaries,
-        # "highlights": highlights,
-        "ma_filename": pdf.filename})
+@app.get("/corpus/stats")
+async def corpus_stats():
+    """Papers and chunks in the corpus index, per-shard index type and size."""
+    qa = await services.get("qa")
+    return await run_in_pool(io_pool, qa.corpus.stats)
+
+# -------------------------------
+# Streaming (SSE) variants
+# -------------------------------
+def _sse_pipeline(events, endpoint: str = "stream", **tags):
+    """Wrap an (event, data) async generator as an SSE response."""
+    async def stream():
+        try:
+            # The middleware's trace closes once headers are sent, so the stream gets its own
+            with request_trace(endpoint, **tags):
+                async for event, data in events:
+                    yield format_sse(data, event=event)
+        except Exception as e:
+            print(f"[❌] Stream error: {e}")
+            yield format_sse({"error": str(e)}, event="error")
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _cached_events(meta: dict, result: dict):
+    yield "meta", meta
+    yield "done", result
+
+@app.post("/summarize/stream")
+async def summarize_stream(pdf: UploadFile = File(...), summary_type: str = Form("detailed")):
+    """SSE: `meta`, then `token` events as the summary is generated, then `done` with the full text."""
+    pipelines = await services.get("pipelines")
+    paper_id = str(uuid.uuid4())
+    meta = {"paper_id": paper_id, "filename": pdf.filename}
+    paper = await aread_upload(pdf)
+
+    cached_summary = pipelines.get_cached_summary(paper.content_hash, summary_type)
+    if cached_summary is not None:
+        return _sse_pipeline(_cached_events({**meta, "cached": True}, {"summary": cached_summary}))
+
+    async def events():
+        yield "meta", {**meta, "cached": False}
+        async for item in pipelines.stream_summary_pipeline(paper.data, paper.content_hash, summary_type):
+            yield item
+
+    return _sse_pipeline(events(), "/summarize/stream", paper_id=paper_id, content_hash=paper.content_hash[:12])
+
+@app.post("/ask/stream")
+async def ask_stream(session_id: str = Form(...), paper_id: str = Form(...), question: str = Form(...)):
+    """SSE: `token` events for the answer, then `done` with the full text and its sources."""
+    qa = await services.get("qa")
+    if not question.strip():
+        return JSONResponse({"error": "Question cannot be empty"}, status_code = 400)
+    retriever = await run_in_pool(io_pool, qa.get_retriever, paper_id)
+    if retriever is None:
+        return JSONResponse(content={"error": "Paper not found / RAG not ready"}, status_code=404)
+
+    from sessions import session_key
+
+    async def events():
+        parts, sources = [], []
+        async for token in qa.astream_answer_with_rag(session_key(session_id, paper_id), retriever, question,
+                                                      sources=sources):
+            parts.append(token)
+            yield "token", {"text": token}
+        yield "done", {"answer": "".join(parts), "sources": sources}
+
+    return _sse_pipeline(events(), endpoint="/ask/stream", paper_id=paper_id)
+
+@app.post("/multi-agent-summarize/stream")
+async def multi_agent_summarize_stream(pdf: UploadFile = File(...)):
+    """SSE: `sections`, one `section` event per finished section, aggregator `token`s, then `done`."""
+    pipelines = await services.get("pipelines")
+    meta = {"ma_filename": pdf.filename}
+    paper = await aread_upload(pdf)
+
+    cached_result = pipelines.get_cached_multi_agent_result(paper.content_hash)
+    if cached_result is not None:
+        return _sse_pipeline(_cached_events({**meta, "cached": True}, cached_result))
+
+    async def events():
+        yield "meta", {**meta, "cached": False}
+        async for item in pipelines.stream_multi_agent_pipeline(paper.data, paper.content_hash):
+            yield item
+
+    return _sse_pipeline(events(), "/multi-agent-summarize/stream", content_hash=paper.content_hash[:12])
+
+# -------------------------------
+# Background jobs
+# -------------------------------
+@app.post("/jobs")
+async def submit_job(pdf: UploadFile = File(...), mode: str = Form("summary"), summary_type: str = Form("detailed")):
+    """Queue a summary ("summary" or "multi-agent") and return its job id straight away."""
+    paper = await aread_upload(pdf)
+    try:
+        job = job_queue.submit(mode, paper.data, paper.filename, paper.content_hash, {"summary_type": summary_type})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except QueueFullError as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "30"})
+    return JSONResponse({"job_id": job["id"], "status": job["status"], "queue_position": job["queue_position"]},
+                        status_code=202)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """SSE stream of per-stage progress, ending with a `done` or `failed` event."""
+    if job_queue.get(job_id) is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+
+    async def stream():
+        async for event in job_queue.events(job_id):
+            yield format_sse(event, event=event["type"])
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving (qa/pipelines may still be loading)."""
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once qa/pipelines are imported and hot indexes warmed, 503 until then."""
+    status = services.status()
+    if services.ready or (not WARM_START and status["error"] is None):
+        return status
+    return JSONResponse(status, status_code=503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, token counters, cache hits."""
+    return Response(metrics_payload(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counts per artifact kind plus current cache size."""
+    return await run_in_pool(io_pool, paper_cache.stats)
+
+@app.get("/indexes/stats")
+async def index_stats():
+    """Hot (in-memory) FAISS indexes against the memory budget."""
+    qa = await services.get("qa")
+    return qa.index_store.stats()
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """In-flight LLM calls, remaining TPM budget and retry count."""
+    qa = await services.get("qa")
+    return qa.scheduler.stats()
+
+@app.get("/answer-cache/stats")
+async def answer_cache_stats():
+    """Semantic answer cache: hit rate, follow-ups that bypassed it, evictions."""
+    qa = await services.get("qa")
+    return qa.answer_cache.stats()
+
+@app.delete("/answer-cache/{paper_id}")
+async def invalidate_answer_cache(paper_id: str):
+    """Forget the cached answers for a paper (every upload of the same PDF shares them)."""
+    qa = await services.get("qa")
+    key = await run_in_pool(io_pool, qa.index_store.resolve, paper_id)
+    if key is None:
+        return JSONResponse({"error": "Paper not found"}, status_code=404)
+    return {"status": "ok", "paper_id": paper_id, "dropped": await run_in_pool(io_pool, qa.answer_cache.invalidate, key)}
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Live QA sessions, their history tokens, and TTL / LRU evictions."""
+    qa = await services.get("qa")
+    return qa.sessions.stats()
+
+@app.get("/grobid/stats")
+async def grobid_stats():
+    """GROBID circuit breaker state, in-flight papers and heuristic fallbacks."""
+    pipelines = await services.get("pipelines")
+    return pipelines.grobid_agent.client.stats()
 
 if __name__ == "__main__":
+    # Development: `python main.py` (one worker, auto-reload).
+    # Production: `WEB_WORKERS=4 python main.py`, or gunicorn -c gunicorn.conf.py main:app
+    import os
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
+    from state import STATE_BACKEND
+    workers = int(os.getenv("WEB_WORKERS", "1"))
+    if workers > 1 and STATE_BACKEND == "memory":
+        raise SystemExit("STATE_BACKEND=memory is per process; use sqlite or redis with WEB_WORKERS > 1")
+    if workers > 1:
+        # Same setup as gunicorn.conf.py: shared metrics files, LLM limits split between the workers
+        import shutil
+        os.environ["LLM_LIMIT_WORKERS"] = str(workers)
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                                            os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "prometheus"))
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+    uvicorn.run("main:app", host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "5000")),
+                workers=workers, reload=workers == 1)
     
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Page-level PDF text extraction, split across worker processes.
+
+PyMuPDF's get_text holds the GIL, so on 100+ page papers a thread pool does
+not help. Long documents are cut into page ranges and each range is parsed
+in a ProcessPoolExecutor; `iter_pages` yields the pages back in order as
+soon as the range holding them is done.
+
+Kept deliberately light because every worker process imports this module;
+even fitz is only imported when the first PDF is opened, so the API can
+start without it.
+
+Pages are joined with PAGE_SEPARATOR everywhere, and `page_offsets` /
+`page_for_offset` map a character offset in that joined text back to a page
+number, for chunking and highlighting.
+"""
+import bisect
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_PROCESSES = int(os.getenv("PDF_PROCESSES", str(min(4, os.cpu_count() or 1))))
+# Below this many pages a single in-thread pass beats shipping bytes to workers
+PARALLEL_MIN_PAGES = int(os.getenv("PARALLEL_MIN_PAGES", "40"))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "16"))
+PAGE_SEPARATOR = "\n"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    """Started on first use: most requests hit the page cache and never need it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent has live threads (executors, httpx, sqlite)
+            _pool = ProcessPoolExecutor(max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def open_pdf(pdf):
+    """fitz document from raw bytes (no copy, no temp file) or from a path."""
+    import fitz  # PyMuPDF
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+def extract_range(pdf, start: int, stop: int) -> list[str]:
+    """Text of pages [start, stop). Runs in the worker processes."""
+    with open_pdf(pdf) as doc:
+        return [doc[i].get_text() for i in range(start, min(stop, doc.page_count))]
+
+
+def page_blocks(pdf) -> list[list[tuple]]:
+    """
+    Text blocks of every page as (x0, y0, x1, y1, text), in reading order.
+    Their texts are what `get_text()` concatenates, so chunk offsets can be
+    mapped back to rectangles (chunk_store.py).
+    """
+    with open_pdf(pdf) as doc:
+        return [[b[:5] for b in page.get_text("blocks") if b[6] == 0] for page in doc]
+
+
+def page_count(pdf) -> int:
+    with open_pdf(pdf) as doc:
+        return doc.page_count
+
+
+def iter_pages(pdf, workers: int = None, pages_per_task: int = PAGES_PER_TASK):
+    """
+    Yield page texts in page order.
+
+    Short documents (or workers <= 1) are read in this thread; longer ones are
+    split into `pages_per_task` ranges across the process pool. A path is
+    cheaper to hand to workers than bytes, but both work.
+    """
+    workers = PDF_PROCESSES if workers is None else workers
+    n_pages = page_count(pdf)
+    if workers <= 1 or n_pages < PARALLEL_MIN_PAGES:
+        with open_pdf(pdf) as doc:
+            for page in doc:
+                yield page.get_text()
+        return
+
+    pool = _process_pool() if workers == PDF_PROCESSES else ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    if isinstance(pdf, (bytearray, memoryview)):
+        pdf = bytes(pdf)
+    futures = [pool.submit(extract_range, pdf, start, start + pages_per_task)
+               for start in range(0, n_pages, pages_per_task)]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if pool is not _pool:
+            pool.shutdown(wait=False)
+
+
+def submit_extract(pdf):
+    """
+    Every page of one document as a single process-pool task (a concurrent
+    Future of the page list). For batch runs, where whole papers rather than
+    page ranges are the unit of parallelism.
+    """
+    return _process_pool().submit(extract_range, pdf, 0, sys.maxsize)
+
+
+def page_offsets(pages: list[str], sep: str = PAGE_SEPARATOR) -> list[int]:
+    """Start offset of every page in `sep.join(pages)`."""
+    offsets, pos = [], 0
+    for text in pages:
+        offsets.append(pos)
+        pos += len(text) + len(sep)
+    return offsets
+
+
+def page_for_offset(offsets: list[int], offset: int) -> int:
+    """1-based page number holding character `offset` of the joined text."""
+    return max(1, bisect.bisect_right(offsets, offset))
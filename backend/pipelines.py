@@ -0,0 +1,286 @@
+"""
+The summarization pipelines, shared by the HTTP endpoints and the background
+job workers.
+
+Each pipeline takes the PDF bytes (see ingest.py) plus their content hash and reports progress
+through `report(stage, **info)`; callers decide whether that is a no-op or a
+job event. Results are written to the paper cache, so the endpoints can return
+a repeat upload without ever calling into here.
+"""
+import os
+import time
+from contextlib import aclosing
+
+from compaction import COMPACT_STRIP_REFERENCES
+from summarizer import aload_summary_text, acondense_paper_text, asummarize_paper_text, astream_summary, afinalize_summary, SUMMARY_MODEL, PROMPT_VERSION
+from ma_summarizer.agents import GrobidSectionAgent, SectionSummaryAgent, SummaryAggregatorAgent, summarize_sections_parallel, iter_section_summaries
+from ma_summarizer.agents import pack_small_sections, SummaryHighlighterAgent, sentence_chunks
+from ma_summarizer.agents import PROMPT_VERSION as MA_PROMPT_VERSION, SECTION_PROMPT_VERSION
+from ma_summarizer.highlight_agent import HighlightAgent
+from ma_summarizer.grobid_client import GrobidError
+from ma_summarizer.heading_splitter import split_sections
+from ma_summarizer.tei import TEI_PARSER_VERSION
+from cache import paper_cache
+from concurrency import pdf_pool, run_in_pool
+from telemetry import span
+from structured import IncrementalJSONParser, is_partial
+
+grobid_agent = GrobidSectionAgent()
+section_agent = SectionSummaryAgent(cache=paper_cache)  # memoized per section text
+aggregator_agent = SummaryAggregatorAgent()
+highlight_agent = HighlightAgent()
+highlighter = SummaryHighlighterAgent()
+
+# Sentence-level source highlights for multi-agent summaries
+ENABLE_HIGHLIGHTS = os.getenv("ENABLE_HIGHLIGHTS", "1") == "1"
+
+
+def _no_report(stage: str, **info):
+    pass
+
+
+def summary_params(summary_type: str) -> dict:
+    return {"summary_type": summary_type, "model": SUMMARY_MODEL, "prompt_version": PROMPT_VERSION,
+            "strip_references": COMPACT_STRIP_REFERENCES}
+
+
+def multi_agent_params() -> dict:
+    return {"model": aggregator_agent.llm_model, "prompt_version": MA_PROMPT_VERSION}
+
+
+def section_summaries_params() -> dict:
+    return {"model": section_agent.llm_model, "prompt_version": SECTION_PROMPT_VERSION, "parser": TEI_PARSER_VERSION}
+
+
+def get_cached_summary(content_hash: str, summary_type: str):
+    return paper_cache.get_json("summary", content_hash, **summary_params(summary_type))
+
+
+def get_cached_multi_agent_result(content_hash: str):
+    return paper_cache.get_json("multi_agent_summary", content_hash, **multi_agent_params())
+
+
+async def aget_sections(pdf_bytes: bytes, content_hash: str):
+    """
+    (sections, source): GROBID sections (cached), or PyMuPDF heading-heuristic
+    sections when GROBID is down or fails on this paper. Fallback sections are never cached,
+    so the paper gets proper GROBID sections once it is back.
+    """
+    sections = paper_cache.get_json("grobid_sections", content_hash, parser=TEI_PARSER_VERSION)
+    if sections is not None:
+        return sections, "grobid"
+    try:
+        sections = await grobid_agent.aextract_sections(pdf_bytes)
+    except GrobidError as e:
+        print(f"[⚠️] GROBID failed ({e}), splitting sections by font heuristics")
+        with span("heading_split") as sp:
+            sections = await run_in_pool(pdf_pool, split_sections, pdf_bytes)
+            sp.tag(sections=len(sections))
+        return sections, "heuristic"
+    paper_cache.put_json("grobid_sections", content_hash, sections, parser=TEI_PARSER_VERSION)
+    return sections, "grobid"
+
+
+async def _ahighlights(final_summary: str, sections: list[dict], content_hash: str):
+    """Map summary sentences back to source sentences; never fails the request."""
+    if not ENABLE_HIGHLIGHTS:
+        return None
+    try:
+        t4 = time.time()
+        highlights = await highlighter.alink_summary_to_sources(
+            final_summary=final_summary,
+            all_chunks=sentence_chunks(sections),
+            paper_key=content_hash,
+        )
+        print(f"[✅] Highlight mapping done in {time.time() - t4:.2f}s")
+        return highlights
+    except Exception as e:
+        print(f"[⚠️] Highlight mapping failed: {e}")
+        return None
+
+
+def _store_section_summaries(content_hash: str, section_summaries: list[dict], source: str):
+    """Keep a paper's section summaries so the aggregator can be re-run on its own."""
+    paper_cache.put_json("section_summaries", content_hash, {"sections": section_summaries, "source": source},
+                         **section_summaries_params())
+
+
+def _finish_multi_agent(content_hash: str, final_summary: str, section_summaries: list[dict], highlights, source: str) -> dict:
+    result = {"summary": final_summary, "sections": section_summaries, "highlights": highlights,
+              "paper_hash": content_hash}
+    if source != "grobid":
+        result["section_source"] = source
+    if any(s.get("error") for s in section_summaries) or is_partial(final_summary):
+        # Partial result: return it, but don't cache it so a re-run can fill the gaps
+        result["partial"] = True
+    elif source == "grobid":
+        paper_cache.put_json("multi_agent_summary", content_hash, result, **multi_agent_params())
+    return result
+
+
+async def run_summary_pipeline(pdf_bytes: bytes, content_hash: str, summary_type: str = "detailed",
+                               report=_no_report) -> str:
+    """extract → chunk (map-reduce if the paper is too long) → summarize. Returns the summary string."""
+    # 1️⃣ Extract text
+    t1 = time.time()
+    report("extract", status="running")
+    print("[🔍] Extracting text from PDF...")
+    paper_text = await aload_summary_text(pdf_bytes, content_hash)
+    print(f"[✅] Text extracted ({len(paper_text)} chars) in {time.time() - t1:.2f}s")
+    report("extract", status="done", chars=len(paper_text))
+
+    # 2️⃣ Chunk long papers (map-reduce) so nothing gets truncated
+    t2 = time.time()
+    report("chunk", status="running")
+    paper_text, mode = await acondense_paper_text(paper_text)
+    print(f"[✂️] Summary input ready ({mode}, {len(paper_text)} chars) in {time.time() - t2:.2f}s")
+    report("chunk", status="done", mode=mode)
+
+    # 3️⃣ Generate summary
+    t2 = time.time()
+    report("summarize", status="running")
+    print("[🤖] Sending text to OpenAI model...")
+    summary = await asummarize_paper_text(paper_text, summary_type)
+    print(f"[✅] OpenAI summarization done in {time.time() - t2:.2f}s")
+    report("summarize", status="done")
+
+    if not is_partial(summary):
+        paper_cache.put_json("summary", content_hash, summary, **summary_params(summary_type))
+    return summary
+
+
+async def run_multi_agent_pipeline(pdf_bytes: bytes, content_hash: str, report=_no_report, sections=None) -> dict:
+    """
+    extract (GROBID) → chunk (sections) → summarize (per section) → aggregate.
+    `sections` is an (raw_sections, source) pair from a caller that already ran aget_sections.
+    """
+    # 1. extract sections
+    t1 = time.time()
+    report("extract", status="running")
+    raw_sections, source = sections if sections is not None else await aget_sections(pdf_bytes, content_hash)
+    print(f"[✅] Sections extracted ({len(raw_sections)} sections, {source}) in {time.time() - t1:.2f}s")
+    report("extract", status="done", source=source)
+    sections = pack_small_sections(raw_sections)
+    report("chunk", status="done", sections=len(sections))
+
+    # 2. Summarize each section
+    t2 = time.time()
+    report("summarize", status="running", done=0, total=len(sections))
+    done = 0
+
+    def on_section_done(result):
+        nonlocal done
+        done += 1
+        report("summarize", status="running", done=done, total=len(sections), section=result["section"])
+
+    # Sections summarized before (same text, prompt and model) come from the cache; only new or failed ones hit the LLM
+    section_summaries = await summarize_sections_parallel(sections, section_agent, on_done=on_section_done)
+    _store_section_summaries(content_hash, section_summaries, source)
+    failed = [s["section"] for s in section_summaries if s.get("error")]
+    reused = sum(1 for s in section_summaries if s.get("cached"))
+    print(f"[✅] Section summarization done in {time.time() - t2:.2f}s ({reused} reused, {len(failed)} failed)")
+    report("summarize", status="done", done=done, total=len(sections), failed=failed, reused=reused)
+
+    return await _aggregate_and_highlight(content_hash, section_summaries, raw_sections, source, report)
+
+
+async def _aggregate_and_highlight(content_hash: str, section_summaries: list[dict], raw_sections, source: str,
+                                   report=_no_report) -> dict:
+    # 3. Aggregate summaries
+    t3 = time.time()
+    report("aggregate", status="running")
+    final_summary = await aggregator_agent.acombine(section_summaries)
+    print(f"[✅] Final summarization done in {time.time() - t3:.2f}s")
+    report("aggregate", status="done")
+
+    # 4. Compute sentence-level highlights
+    report("highlight", status="running")
+    highlights = await _ahighlights(final_summary, raw_sections, content_hash) if raw_sections else None
+    report("highlight", status="done")
+
+    return _finish_multi_agent(content_hash, final_summary, section_summaries, highlights, source)
+
+
+async def rerun_aggregation(content_hash: str, report=_no_report):
+    """
+    Re-run only the aggregator (and highlights) over a paper's stored section
+    summaries, e.g. after an aggregator prompt change. None if the paper's
+    sections were never summarized under the current section prompt and model.
+    """
+    stored = paper_cache.get_json("section_summaries", content_hash, **section_summaries_params())
+    if stored is None:
+        return None
+    # Highlights need the source sentences; they are only kept for GROBID sections
+    raw_sections = paper_cache.get_json("grobid_sections", content_hash, parser=TEI_PARSER_VERSION) \
+        if stored["source"] == "grobid" else None
+    print(f"[🔁] Re-aggregating {len(stored['sections'])} stored section summaries for {content_hash[:12]}")
+    return await _aggregate_and_highlight(content_hash, stored["sections"], raw_sections, stored["source"], report)
+
+
+# -------------------------------
+# Streaming variants: yield (event, data) pairs for SSE
+# -------------------------------
+async def _relay_tokens(tokens, parts: list, as_json: bool):
+    """
+    Relay LLM tokens as `token` events into `parts`. For JSON output also emit a
+    `field` event per completed top-level field, and stop reading as soon as
+    the stream stops being JSON: the validation step re-requests what's missing.
+    """
+    parser = IncrementalJSONParser() if as_json else None
+    async with aclosing(tokens):
+        async for token in tokens:
+            parts.append(token)
+            yield "token", {"text": token}
+            if parser is None:
+                continue
+            for name, value in parser.feed(token):
+                yield "field", {"name": name, "value": value}
+            if parser.error:
+                print(f"[⚠️] Stream stopped being valid JSON ({parser.error}); repairing the rest")
+                break
+
+
+async def stream_summary_pipeline(pdf_bytes: bytes, content_hash: str, summary_type: str = "detailed"):
+    """Like run_summary_pipeline, but yields each summary token as it arrives."""
+    paper_text = await aload_summary_text(pdf_bytes, content_hash)
+    yield "stage", {"stage": "chunk", "chars": len(paper_text)}
+    paper_text, mode = await acondense_paper_text(paper_text)
+    yield "stage", {"stage": "summarize", "mode": mode}
+
+    t0 = time.time()
+    first_token_at = None
+    parts = []
+    async for event, data in _relay_tokens(astream_summary(paper_text, summary_type), parts, summary_type != "short"):
+        if first_token_at is None:
+            first_token_at = time.time()
+            print(f"[⏱️] First summary token after {first_token_at - t0:.2f}s")
+        yield event, data
+
+    summary = await afinalize_summary("".join(parts), paper_text, summary_type)
+    if not is_partial(summary):
+        paper_cache.put_json("summary", content_hash, summary, **summary_params(summary_type))
+    yield "done", {"summary": summary}
+
+
+async def stream_multi_agent_pipeline(pdf_bytes: bytes, content_hash: str):
+    """
+    Yields each section summary as soon as it finishes (completion order), then
+    streams the aggregator's tokens once every section is in.
+    """
+    raw_sections, source = await aget_sections(pdf_bytes, content_hash)
+    sections = pack_small_sections(raw_sections)
+    yield "sections", {"total": len(sections), "headings": [s["heading"] for s in sections], "source": source}
+
+    section_summaries = [None] * len(sections)
+    async for i, result in iter_section_summaries(sections, section_agent):
+        section_summaries[i] = result
+        yield "section", {"index": i, **result}
+    _store_section_summaries(content_hash, section_summaries, source)
+
+    parts = []
+    async for item in _relay_tokens(aggregator_agent.astream_combine(section_summaries), parts, as_json=True):
+        yield item
+
+    final_summary = await aggregator_agent.avalidate("".join(parts), section_summaries)
+    highlights = await _ahighlights(final_summary, raw_sections, content_hash)
+    yield "done", _finish_multi_agent(content_hash, final_summary, section_summaries, highlights, source)
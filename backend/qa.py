@@ -1,57 +1,193 @@
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 # from langchain_community.document_loaders import PyMuPDFLoader
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from summarizer import extract_pdf_text
-from langchain_core.callbacks import UsageMetadataCallbackHandler
+from summarizer import count_tokens
+from ingest import load_pages, aload_pages
+from pdf_extract import PAGE_SEPARATOR, page_blocks
+from chunk_store import ChunkTable, chunk_texts
+from cache import paper_cache, make_key
+from index_store import IndexStore, WARM_INDEXES, chunk_vectorstore
+from embedding_service import get_embedding_service
+from concurrency import pdf_pool, io_pool, run_in_pool
+from llm_scheduler import scheduler, estimate_tokens
+from telemetry import span, TokenUsageCallback
+from sessions import SessionStore, WindowedHistory
+from state import state
+from retrieval import HybridRetriever, get_reranker
+from corpus import CorpusIndex
+from answer_cache import AnswerCache, is_follow_up
+from langchain_core.messages import HumanMessage, AIMessage
+from collections import OrderedDict
+import numpy as np
+import faiss
+import threading
+import functools
 
 import os
 
 # -------------------------------
 # 1. Initialize LLM and embeddings
 # -------------------------------
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
-embeddings = OpenAIEmbeddings()
-callback = UsageMetadataCallbackHandler()
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, max_retries=0, stream_usage=True)  # retries go through llm_scheduler
+embeddings = get_embedding_service(EMBEDDING_MODEL)
+
+# Persisted, memory-mapped FAISS indexes shared by every worker
+index_store = IndexStore(embeddings)
+
+def index_key(content_hash: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> str:
+    """Index store key: same bytes + chunking + embedding model -> same index."""
+    return make_key(content_hash, "faiss_index", chunk_size=chunk_size, chunk_overlap=chunk_overlap, model=EMBEDDING_MODEL)
+
+# BM25 + FAISS retrievers for recently asked-about papers (the BM25 side lives in memory only)
+RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "64"))
+reranker = get_reranker()
+_retrievers = OrderedDict()
+_retrievers_lock = threading.Lock()
+
+def get_retriever(paper_id: str, chunk_overlap: int = 100):
+    """HybridRetriever for a previously uploaded paper, or None. Blocking (index load + BM25 build)."""
+    key = index_store.resolve(paper_id)
+    if key is None:
+        return None
+    return _retriever_for_key(key, chunk_overlap)
+
+def _retriever_for_key(key: str, chunk_overlap: int = 100):
+    with _retrievers_lock:
+        if key in _retrievers:
+            _retrievers.move_to_end(key)
+            return _retrievers[key]
+
+    vectorstore = index_store.load(key)
+    if vectorstore is None:
+        return None
+    retriever = HybridRetriever.from_vectorstore(vectorstore, reranker=reranker, chunk_overlap=chunk_overlap, key=key)
+    with _retrievers_lock:
+        _retrievers[key] = retriever
+        while len(_retrievers) > RETRIEVER_CACHE_SIZE:
+            _retrievers.popitem(last=False)
+    return retriever
+
+def warm_retrievers() -> int:
+    """Blocking: load the most recently used indexes and build their retrievers, so a new worker starts warm."""
+    keys = index_store.warm(min(WARM_INDEXES, RETRIEVER_CACHE_SIZE))
+    for key in keys:
+        _retriever_for_key(key)
+    return len(keys)
+
+# Every QA paper also goes into one cross-paper index for /corpus/ask
+corpus = CorpusIndex()
+
+def add_paper_to_corpus(paper_id: str, key: str, title: str = None, year: int = None, tags=()):
+    """Blocking: add an uploaded paper's chunks to the corpus (just the alias and metadata if its index key is already in)."""
+    if corpus.link(paper_id, key, title=title, year=year, tags=tags):
+        return
+    vectorstore = index_store.load(key)
+    if vectorstore is None:
+        return
+    texts = list(chunk_texts(vectorstore))
+    if not texts:
+        return
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    corpus.add(paper_id, key, texts, vectors, title=title, year=year, tags=tags)
 
 # -------------------------------
 # 2. Load PDF, chunk, create vectorstore
 # -------------------------------
-def create_vectorstore_from_pdf(pdf_path: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> FAISS:
-    # Reuse your existing PDF extraction
-    text = extract_pdf_text(pdf_path)
+def _cached_chunks_and_vectors(content_hash, params):
+    """Same bytes + same chunking + same embedding model -> reuse chunks and vectors."""
+    if content_hash is None:
+        return None, None
+    chunks = paper_cache.get_json("chunks", content_hash, **params)
+    vectors = paper_cache.get_array("embeddings", content_hash, model=EMBEDDING_MODEL, **params)
+    if chunks is None or vectors is None or len(chunks) != len(vectors):
+        return None, None
+    print(f"[backend] Using cached embeddings for {content_hash[:12]} ({len(chunks)} chunks)")
+    return chunks, vectors
 
-    # Chunk the text for RAG
+def _split_text(text: str, chunk_size: int, chunk_overlap: int) -> list[str]:
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    chunks = splitter.split_text(text)
+    return splitter.split_text(text)
+
+def _store_chunks_and_vectors(content_hash, params, chunks, vectors):
+    if content_hash is None:
+        return
+    paper_cache.put_json("chunks", content_hash, chunks, **params)
+    paper_cache.put_array("embeddings", content_hash, np.asarray(vectors, dtype=np.float32),
+                          model=EMBEDDING_MODEL, **params)
+
+def _build_vectorstore(pages: list[str], chunks: list[str], vectors, layout) -> FAISS:
+    """Flat L2 index (what FAISS.from_embeddings builds) over a columnar chunk table: no Document per chunk."""
+    table = ChunkTable.from_chunks(pages, chunks, layout)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return chunk_vectorstore(table, index, embeddings)
+
+def _page_layout(pdf):
+    """Text block boxes per page for chunk highlighting, or None if the PDF can't be laid out."""
+    try:
+        return page_blocks(pdf)
+    except Exception as e:
+        print(f"[backend] No page layout, chunks get pages but no boxes: {e}")
+        return None
+
+def create_vectorstore_from_pdf(pdf, chunk_size: int = 1000, chunk_overlap: int = 100,
+                                content_hash: str = None) -> FAISS:
+    params = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    chunks, vectors = _cached_chunks_and_vectors(content_hash, params)
+    # Reuse your existing PDF extraction
+    pages = load_pages(pdf, content_hash)
+
+    if chunks is None:
+        # Chunk the text for RAG
+        chunks = _split_text(PAGE_SEPARATOR.join(pages), chunk_size, chunk_overlap)
+        vectors = embeddings.embed_matrix(chunks)
+        _store_chunks_and_vectors(content_hash, params, chunks, vectors)
+
+    # Create vectorstore (chunk pages and boxes come from the per-page text and layout)
+    return _build_vectorstore(pages, chunks, vectors, _page_layout(pdf))
+
+async def acreate_vectorstore_from_pdf(pdf, chunk_size: int = 1000, chunk_overlap: int = 100,
+                                       content_hash: str = None) -> FAISS:
+    """Async twin of create_vectorstore_from_pdf (`pdf` is raw bytes or a path): parsing on the PDF pool, embeddings via aembed_matrix."""
+    params = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    chunks, vectors = await run_in_pool(io_pool, _cached_chunks_and_vectors, content_hash, params)
+    pages = await aload_pages(pdf, content_hash)
+
+    if chunks is None:
+        chunks = await run_in_pool(pdf_pool, _split_text, PAGE_SEPARATOR.join(pages), chunk_size, chunk_overlap)
+        vectors = await embeddings.aembed_matrix(chunks)
+        await run_in_pool(io_pool, _store_chunks_and_vectors, content_hash, params, chunks, vectors)
+
+    layout = await run_in_pool(pdf_pool, _page_layout, pdf)
+    return await run_in_pool(pdf_pool, _build_vectorstore, pages, chunks, vectors, layout)
 
-    # Create vectorstore
-    vectorstore = FAISS.from_texts(chunks, embeddings)
-    return vectorstore
 # -------------------------------
 # 3. Define prompt template
 # -------------------------------
 prompt = ChatPromptTemplate.from_messages([
     ("system", "You are a helpful research assistant."),
     MessagesPlaceholder(variable_name="history"),
-    ("human", "{question}")
+    # Retrieved context is only in this turn's prompt; history stores the bare question
+    ("human", "Here are the relevant parts of the research paper:\n\n{context}\n\nQuestion: {question}")
 ])
 chain = prompt | llm
 
 # -------------------------------
 # 4. Setup session-based history
 # -------------------------------
-_store = {}
+# Keyed by sessions.session_key(user session, paper); TTL + LRU, token-budgeted window,
+# written through to the shared state backend so any worker can continue a session
+sessions = SessionStore(count_tokens=count_tokens, state=state)
 
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
-    if session_id not in _store:
-        _store[session_id] = InMemoryChatMessageHistory()
-    return _store[session_id]
+def get_session_history(session_id: str) -> WindowedHistory:
+    return sessions.get(session_id)
 
 conversation = RunnableWithMessageHistory(
     chain,
@@ -60,32 +196,171 @@ conversation = RunnableWithMessageHistory(
     history_messages_key="history"
 )
 
+# Near-duplicate questions over the same chunks reuse the stored answer (per paper, TTL + LRU)
+answer_cache = AnswerCache(state=state)
+
+def _lookup_answer(session_id: str, retriever: HybridRetriever, question: str, query_vector, hits):
+    """(cached answer or None, whether this question may use the answer cache at all)."""
+    history = get_session_history(session_id)
+    if retriever.key is None or is_follow_up(question, bool(history.messages)):
+        answer_cache.bypass()
+        return None, False
+    answer = answer_cache.lookup(retriever.key, query_vector, [i for i, _ in hits])
+    if answer is not None:
+        # The cached turn still goes into this session's history, so follow-ups make sense
+        history.add_messages([HumanMessage(content=question), AIMessage(content=answer)])
+    return answer, True
+
 # -------------------------------
 # 5. RAG-enabled Q&A function
 # -------------------------------
-def answer_question_with_rag(session_id: str, vectorstore: FAISS, question: str, top_k=5):
-    # 1. Retrieve most relevant chunks from vectorstore
-    docs = vectorstore.similarity_search(question, k=top_k)
-    context_text = "\n\n".join([doc.page_content if hasattr(doc, 'page_content') else doc for doc in docs])
-    
-    # 2. Combine retrieved context with user question
-    user_input = (
-        f"Here are the relevant parts of the research paper:\n\n"
-        f"{context_text}\n\n"
-        f"Question: {question}"
-    )
+def answer_question_with_rag(session_id: str, retriever: HybridRetriever, question: str, top_k=5):
+    # 1. Retrieve most relevant chunks (BM25 + vectors, overlapping neighbours merged)
+    query_vector = embeddings.embed_matrix([question])[0]
+    hits = retriever.search(question, query_vector, k=top_k)
+    cached, cacheable = _lookup_answer(session_id, retriever, question, query_vector, hits)
+    if cached is not None:
+        return cached
+    context_text = "\n\n".join(retriever.build_context(hits))
     
-    # 3. Invoke conversation with session memory
+    # 2. Invoke conversation with session memory (context goes into this turn only)
     result = conversation.invoke(
-        {"question": user_input},
+        {"question": question, "context": context_text},
         config={"configurable": {"session_id": session_id},
-            "callbacks": [callback]}
+            "callbacks": [TokenUsageCallback("qa_llm")]}
     )
 
-    print("QnA token usage metadata: ", callback.usage_metadata)
-    
+    if cacheable:
+        answer_cache.store(retriever.key, question, query_vector, [i for i, _ in hits], result.content)
     return result.content
 
+async def _abuild_rag_input(session_id: str, retriever: HybridRetriever, question: str, top_k: int, sources: list = None):
+    """(rag input, cached answer or None, store callback or None). Hit locations are appended to `sources`."""
+    with span("qa_retrieval", top_k=top_k) as sp:
+        query_vector = (await embeddings.aembed_matrix([question]))[0]
+        # BM25 scoring, the FAISS search and the answer-cache mat-vec are CPU work: keep them off the event loop
+        hits = await run_in_pool(io_pool, retriever.search, question, query_vector, k=top_k)
+        if sources is not None:
+            sources.extend(retriever.locate(hits))
+        cached, cacheable = await run_in_pool(io_pool, _lookup_answer, session_id, retriever, question,
+                                              query_vector, hits)
+        sp.tag(answer_cache="hit" if cached is not None else "miss" if cacheable else "bypass")
+        if cached is not None:
+            return None, cached, None
+        context = retriever.build_context(hits)
+        sp.tag(chunks=len(retriever.texts), context_blocks=len(context))
+    context_text = "\n\n".join(context)
+
+    store = (functools.partial(answer_cache.store, retriever.key, question, query_vector, [i for i, _ in hits])
+             if cacheable else None)
+    return {"question": question, "context": context_text}, None, store
+
+def _estimate_prompt_tokens(session_id: str, rag_input: dict) -> int:
+    history = get_session_history(session_id)
+    return estimate_tokens(rag_input["context"] + rag_input["question"]) + history.token_count
+
+async def aanswer_question_with_rag(session_id: str, retriever: HybridRetriever, question: str, top_k=5,
+                                    sources: list = None):
+    """
+    Async twin of answer_question_with_rag (query embedding + LLM call never block the loop).
+    Pass a list as `sources` to get each retrieved chunk's page and box appended to it.
+    """
+    rag_input, cached, store = await _abuild_rag_input(session_id, retriever, question, top_k, sources)
+    if cached is not None:
+        return cached
+
+    with span("qa_llm"):
+        result = await scheduler.run(
+            lambda: conversation.ainvoke(
+                rag_input,
+                config={"configurable": {"session_id": session_id},
+                    "callbacks": [TokenUsageCallback("qa_llm")]}
+            ),
+            tokens=_estimate_prompt_tokens(session_id, rag_input),
+            label="qa answer",
+        )
+
+    if store is not None:
+        store(result.content)
+    return result.content
+
+async def astream_answer_with_rag(session_id: str, retriever: HybridRetriever, question: str, top_k=5,
+                                  sources: list = None):
+    """Yield answer tokens as they arrive. The full answer is saved to session history once the stream ends."""
+    rag_input, cached, store = await _abuild_rag_input(session_id, retriever, question, top_k, sources)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    with span("qa_llm", streamed=True):
+        async with scheduler.slot(_estimate_prompt_tokens(session_id, rag_input)):
+            async for chunk in conversation.astream(
+                rag_input,
+                config={"configurable": {"session_id": session_id},
+                    "callbacks": [TokenUsageCallback("qa_llm")]}
+            ):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+
+    if store is not None:
+        store("".join(parts))
+
+# -------------------------------
+# 6. Questions across the whole corpus
+# -------------------------------
+CORPUS_TOP_K = int(os.getenv("CORPUS_TOP_K", "8"))
+
+corpus_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are a helpful research assistant. Answer from the excerpts below, which come from several "
+               "research papers, and cite papers by their [number]. Say so when the excerpts do not cover the question."),
+    MessagesPlaceholder(variable_name="history"),
+    ("human", "Excerpts from the paper collection:\n\n{context}\n\nQuestion: {question}")
+])
+
+corpus_conversation = RunnableWithMessageHistory(
+    corpus_prompt | llm,
+    get_session_history,
+    input_messages_key="question",
+    history_messages_key="history"
+)
+
+def _corpus_context(hits: list[dict]) -> str:
+    """Excerpts grouped per paper, numbered in order of the paper's best hit."""
+    papers = {}
+    for hit in hits:
+        papers.setdefault(hit["paper_id"], []).append(hit)
+    blocks = []
+    for n, paper_hits in enumerate(papers.values(), start=1):
+        first = paper_hits[0]
+        header = f"[{n}] {first['title'] or first['paper_id']}" + (f" ({first['year']})" if first["year"] else "")
+        excerpts = "\n...\n".join(h["text"] for h in sorted(paper_hits, key=lambda h: h["chunk"]))
+        blocks.append(f"{header}\n{excerpts}")
+    return "\n\n".join(blocks)
+
+async def aanswer_corpus_question(session_id: str, question: str, filters: dict = None, top_k: int = CORPUS_TOP_K):
+    """Answer from the best chunks across every uploaded paper (optionally filtered). Returns (answer, hits)."""
+    with span("corpus_retrieval", top_k=top_k, filtered=bool(filters)) as sp:
+        query_vector = (await embeddings.aembed_matrix([question]))[0]
+        hits = await run_in_pool(io_pool, corpus.search, query_vector, k=top_k, **(filters or {}))
+        sp.tag(hits=len(hits), papers=len({h["paper_id"] for h in hits}))
+    if not hits:
+        return "None of the uploaded papers match this question and filter.", []
+
+    rag_input = {"question": question, "context": _corpus_context(hits)}
+    with span("qa_llm", corpus=True):
+        result = await scheduler.run(
+            lambda: corpus_conversation.ainvoke(
+                rag_input,
+                config={"configurable": {"session_id": session_id},
+                    "callbacks": [TokenUsageCallback("qa_llm")]}
+            ),
+            tokens=_estimate_prompt_tokens(session_id, rag_input),
+            label="corpus answer",
+        )
+    return result.content, hits
+
 # -------------------------------
 # Example usage:
 # -------------------------------
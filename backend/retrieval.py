@@ -0,0 +1,236 @@
+"""
+Hybrid retrieval for the QA path: BM25 + FAISS, fused, optionally reranked.
+
+Pure vector search misses exact tokens (hyperparameter names, table values,
+"Eq. 3"), so every paper also gets an in-memory BM25 inverted index over the
+same chunks. A query:
+
+1. dense: FAISS top-N candidates for the query embedding,
+2. sparse: BM25 scores from the inverted index (NumPy scatter-add over the
+   postings of the query terms only),
+3. fuse: min-max normalize both over the candidate pool and mix with
+   HYBRID_ALPHA (1.0 = vectors only, 0.0 = BM25 only),
+4. rerank (optional, RERANKER): re-score the top candidates with a local
+   cross-encoder, or a lexical stand-in when none is installed,
+5. dedupe: adjacent chunks share CHUNK_OVERLAP characters, so neighbours are
+   merged and exact duplicates dropped before the context is built.
+
+Steps 1-5 take ~1 ms for a 1k-chunk paper; the query embedding comes from
+the embedding service (cached). For indexes with a chunk table
+(chunk_store.py), `locate` maps hits to their page and box on that page.
+"""
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from chunk_store import ChunkDocstore, chunk_texts
+
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# "none", "overlap" (lexical stand-in) or a sentence-transformers cross-encoder model name
+RERANKER = os.getenv("RERANKER", "none")
+CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "30"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Keeps "3.2", "gpt-4o", "lr=0.001"-style pieces, "Eq" and "(3)" as separate tokens
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which "
+    "with how does do did paper".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of texts. Per-posting weights are precomputed
+    at build time, so a query is one scatter-add per query term.
+    """
+
+    def __init__(self, texts: list[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.n_docs = len(texts)
+        docs = [Counter(tokenize(t)) for t in texts]
+        lengths = np.array([sum(d.values()) for d in docs], dtype=np.float32)
+        avg_len = float(lengths.mean()) if self.n_docs else 0.0
+
+        postings = defaultdict(lambda: ([], []))
+        for doc_id, counts in enumerate(docs):
+            for term, tf in counts.items():
+                ids, tfs = postings[term]
+                ids.append(doc_id)
+                tfs.append(tf)
+
+        self.postings = {}
+        for term, (ids, tfs) in postings.items():
+            ids = np.asarray(ids, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            idf = math.log(1 + (self.n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = k1 * (1 - b + b * lengths[ids] / (avg_len or 1.0))
+            self.postings[term] = (ids, (idf * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32))
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                np.add.at(scores, posting[0], posting[1])
+        return scores
+
+
+# -------------------------------
+# Rerankers
+# -------------------------------
+class OverlapReranker:
+    """
+    Dependency-free cross-encoder stand-in: scores each (query, chunk) pair on
+    query-term coverage plus matching query bigrams.
+    """
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        terms = tokenize(query)
+        if not terms:
+            return np.zeros(len(texts), dtype=np.float32)
+        bigrams = set(zip(terms, terms[1:]))
+        term_set = set(terms)
+        out = np.empty(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            coverage = len(term_set & set(tokens)) / len(term_set)
+            phrase = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            out[i] = coverage + 0.5 * phrase
+        return out
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder  # optional dependency
+        self.model = CrossEncoder(model_name)
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        return np.asarray(self.model.predict([(query, t) for t in texts]), dtype=np.float32)
+
+
+def get_reranker(name: str = RERANKER):
+    if not name or name == "none":
+        return None
+    if name == "overlap":
+        return OverlapReranker()
+    try:
+        return CrossEncoderReranker(name)
+    except ImportError:
+        print(f"[retrieval] sentence-transformers not installed, using the overlap reranker instead of {name}")
+        return OverlapReranker()
+
+
+# -------------------------------
+# Hybrid retriever
+# -------------------------------
+def _minmax(values: np.ndarray) -> np.ndarray:
+    if values.size == 0:
+        return values
+    lo, hi = float(values.min()), float(values.max())
+    return (values - lo) / (hi - lo) if hi > lo else np.ones_like(values)
+
+
+def _merge_overlap(a: str, b: str, max_overlap: int) -> str:
+    """a + b without the text b repeats from the end of a."""
+    for size in range(min(max_overlap, len(a), len(b)), 0, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return a + "\n" + b
+
+
+class HybridRetriever:
+    def __init__(self, texts, index, alpha: float = HYBRID_ALPHA, reranker=None,
+                 chunk_overlap: int = 100, key: str = None, table=None):
+        """
+        `index` is the paper's FAISS index; row i of it is texts[i] (any sequence).
+        `key` names the paper for caches; `table` is its ChunkTable, if it has one.
+        """
+        self.texts = texts
+        self.table = table
+        self.key = key
+        self.index = index
+        self.alpha = alpha
+        self.reranker = reranker
+        self.chunk_overlap = chunk_overlap
+        self.bm25 = BM25Index(texts)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        table = vectorstore.docstore.table if isinstance(vectorstore.docstore, ChunkDocstore) else None
+        return cls(chunk_texts(vectorstore), vectorstore.index, table=table, **kwargs)
+
+    def search(self, query: str, query_vector: np.ndarray, k: int = 5, candidates: int = CANDIDATES) -> list[tuple[int, float]]:
+        """[(chunk index, score)], best first."""
+        n = len(self.texts)
+        if n == 0:
+            return []
+        pool = min(max(candidates, k), n)
+
+        # 1. dense candidates (FAISS returns L2 distances or inner products depending on the index)
+        q = np.ascontiguousarray(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))
+        dists, ids = self.index.search(q, pool)
+        dense = {int(i): float(d) for i, d in zip(ids[0], dists[0]) if i >= 0}
+        higher_is_better = getattr(self.index, "metric_type", 1) == 0  # faiss.METRIC_INNER_PRODUCT
+
+        # 2. sparse candidates
+        bm25 = self.bm25.scores(query)
+        sparse_top = np.argpartition(-bm25, pool - 1)[:pool] if pool < n else np.arange(n)
+        candidates_ids = np.fromiter(set(dense) | {int(i) for i in sparse_top if bm25[i] > 0}, dtype=np.int64)
+
+        # 3. fuse on the candidate pool; chunks outside FAISS's top-N get the worst dense score
+        raw_dense = np.array([dense.get(int(i), np.nan) for i in candidates_ids], dtype=np.float32)
+        if not higher_is_better:
+            raw_dense = -raw_dense
+        worst = np.nanmin(raw_dense) if np.isfinite(raw_dense).any() else 0.0
+        dense_scores = _minmax(np.nan_to_num(raw_dense, nan=worst))
+        sparse_scores = _minmax(bm25[candidates_ids])
+        fused = self.alpha * dense_scores + (1 - self.alpha) * sparse_scores
+
+        order = np.argsort(-fused)
+        ranked = [(int(candidates_ids[i]), float(fused[i])) for i in order]
+
+        # 4. optional rerank of the head of the list
+        if self.reranker is not None:
+            head = ranked[:max(2 * k, 10)]
+            rerank_scores = self.reranker.score(query, [self.texts[i] for i, _ in head])
+            head = [head[j] for j in np.argsort(-rerank_scores, kind="stable")]
+            ranked = head + ranked[len(head):]
+        return ranked[:k]
+
+    def locate(self, hits: list[tuple[int, float]]) -> list[dict]:
+        """Page, offsets and box of each hit (None fields when built without a chunk table)."""
+        if self.table is None:
+            return [{"chunk": i, "score": score, "page": None, "bbox": None} for i, score in hits]
+        return [{**self.table.metadata(i), "score": score} for i, score in hits]
+
+    def build_context(self, hits: list[tuple[int, float]]) -> list[str]:
+        """
+        Chunk texts for `hits` with neighbouring chunks merged (their shared
+        overlap kept once) and duplicate texts dropped, best group first.
+        """
+        best = {i: rank for rank, (i, _) in enumerate(hits)}
+        groups = []
+        for i in sorted(best):
+            if groups and i == groups[-1][-1] + 1:
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        groups.sort(key=lambda g: min(best[i] for i in g))
+
+        seen, context = set(), []
+        for group in groups:
+            text = self.texts[group[0]]
+            for i in group[1:]:
+                text = _merge_overlap(text, self.texts[i], self.chunk_overlap)
+            if text not in seen:
+                seen.add(text)
+                context.append(text)
+        return context
@@ -0,0 +1,103 @@
+"""
+Pydantic models for the JSON summaries.
+
+`PaperSummary` is the single-call "detailed" summary, `AggregatedSummary` the
+multi-agent aggregator's output. Both are sent to OpenAI as a strict
+`response_format` (see `response_format`), so every field is required and no
+extra keys are allowed; "not specified" is the model's way to leave one empty.
+
+The model answers with `models` as a plain list. `to_document` turns that back
+into the documented shape (`[{"<model name>": {...}}]`) that clients and the
+cached summaries use.
+"""
+from pydantic import BaseModel, ConfigDict
+
+
+class _Strict(BaseModel):
+    # additionalProperties: false on every object, as strict mode requires
+    model_config = ConfigDict(extra="forbid")
+
+
+class PaperMetadata(_Strict):
+    title: str
+    authors: list[str]
+    publication_venue: str
+    publication_year: str
+    doi: str
+    research_domain: str
+    paper_type: str
+
+
+class ModelTraining(_Strict):
+    optimizer: str
+    loss_function: str
+    learning_rate: str
+    epochs: str
+    batch_size: str
+    training_pipeline: str
+    early_stopping: str
+    other_hyperparameters: str
+
+
+class ModelEvaluation(_Strict):
+    evaluation_metrics: str
+    baselines_compared: str
+    experimental_setup: str
+
+
+class ModelDetails(_Strict):
+    name: str
+    version: str
+    input: str
+    output: str
+    machine_learning_category: str
+    data_engineering: str
+    feature_engineering: str
+    model_training: ModelTraining
+    model_evaluation: ModelEvaluation
+    model_results: str
+    limitations_and_implications: str
+
+
+class PaperSummary(_Strict):
+    name_of_research_paper: str
+    objective: str
+    paper_metadata: PaperMetadata
+    models: list[ModelDetails]
+    key_findings: str
+
+
+class AggregatedModel(_Strict):
+    name: str
+    input: str
+    output: str
+    machine_learning_category: str
+    data_engineering: str
+    feature_engineering: str
+    model_training: str
+    model_evaluation: str
+    model_results: str
+    limitations_and_implications: str
+
+
+class AggregatedSummary(_Strict):
+    name_of_research_paper: str
+    objective: str
+    models: list[AggregatedModel]
+    key_findings: str
+
+
+def response_format(schema: type[BaseModel]) -> dict:
+    """OpenAI structured-output `response_format` for a model (bind it on the chat model)."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "strict": True, "schema": schema.model_json_schema()},
+    }
+
+
+def to_document(summary: BaseModel) -> dict:
+    """Validated summary -> the documented JSON shape (each model keyed by its name)."""
+    doc = summary.model_dump()
+    if "models" in doc:
+        doc["models"] = [{m["name"]: m} for m in doc["models"]]
+    return doc
@@ -0,0 +1,169 @@
+"""
+Bounded chat memory for /ask.
+
+Sessions are keyed per user *and* paper (`session_key`), live in an LRU of at
+most SESSION_MAX_COUNT entries, and expire SESSION_TTL seconds after their
+last use. Each session only keeps the most recent turns that fit in
+HISTORY_TOKEN_BUDGET tokens, so the replayed history (and with it prompt size
+and latency) stops growing with the conversation.
+
+The history only ever holds the bare questions and answers: retrieved
+context is part of the prompt for the current turn only (see qa.py), so old
+chunks are never replayed.
+
+With a `state` backend (state.py) every change is also written there under a
+new revision, and `get` reloads a session whose stored revision differs from
+the local copy, so consecutive questions can land on different workers.
+"""
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(60 * 60)))  # 1 hour idle
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+
+
+def session_key(session_id: str, paper_id: str) -> str:
+    return f"{session_id}:{paper_id}"
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class WindowedHistory(BaseChatMessageHistory):
+    """Chat history that drops its oldest turns once it goes over `token_budget`."""
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, count_tokens=_approx_tokens, on_change=None):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.on_change = on_change  # called with the history after every change (SessionStore persists it)
+        self.rev = None  # revision of the last persisted / loaded state
+        self._messages = []
+        self._tokens = []  # token count per message, parallel to _messages
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self):
+        with self._lock:
+            return list(self._messages)
+
+    @property
+    def token_count(self) -> int:
+        with self._lock:
+            return sum(self._tokens)
+
+    def add_messages(self, messages):
+        with self._lock:
+            for message in messages:
+                self._messages.append(message)
+                self._tokens.append(self._count(message))
+            self._trim()
+        self._changed()
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._tokens.clear()
+        self._changed()
+
+    def load(self, messages, rev):
+        """Replace the contents with a stored copy (no on_change)."""
+        with self._lock:
+            self._messages = list(messages)
+            self._tokens = [self._count(m) for m in self._messages]
+            self.rev = rev
+
+    def _count(self, message) -> int:
+        return self.count_tokens(message.content if isinstance(message.content, str) else str(message.content))
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.rev = uuid.uuid4().hex
+            self.on_change(self)
+
+    def _trim(self):
+        # Drop whole turns (question + answer) from the front; always keep the latest turn
+        while sum(self._tokens) > self.token_budget and len(self._messages) > 2:
+            del self._messages[:2]
+            del self._tokens[:2]
+
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX_COUNT,
+                 token_budget: int = HISTORY_TOKEN_BUDGET, count_tokens=_approx_tokens, state=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.state = state  # shared backend (state.py), or None for process-local sessions
+        self._sessions = OrderedDict()  # key -> (history, last used)
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, key: str) -> WindowedHistory:
+        """History for `key`, created on first use. Also the RunnableWithMessageHistory factory."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.pop(key, None)
+            history = entry[0] if entry else self._new_history(key)
+            self._sessions[key] = (history, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+        if self.state is not None:
+            # Another worker may have answered in this session since we last saw it
+            stored = self.state.get_json("sessions", key)
+            if stored is None:
+                if history.rev is not None:
+                    history.load([], None)  # expired or dropped in the shared store
+            elif stored["rev"] != history.rev:
+                history.load(messages_from_dict(stored["messages"]), stored["rev"])
+        return history
+
+    def drop(self, key: str):
+        with self._lock:
+            self._sessions.pop(key, None)
+        if self.state is not None:
+            self.state.delete("sessions", key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl,
+                "history_token_budget": self.token_budget,
+                "history_tokens": sum(h.token_count for h, _ in self._sessions.values()),
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "state_backend": self.state.name if self.state is not None else "local",
+            }
+
+    def _new_history(self, key: str) -> WindowedHistory:
+        on_change = functools.partial(self._persist, key) if self.state is not None else None
+        return WindowedHistory(self.token_budget, self.count_tokens, on_change=on_change)
+
+    def _persist(self, key: str, history: WindowedHistory):
+        self.state.set_json("sessions", key, {"rev": history.rev, "messages": messages_to_dict(history.messages)},
+                            ttl=self.ttl)
+
+    def _expire(self, now: float):
+        # Ordered by last use, so expired sessions are all at the front
+        while self._sessions:
+            key, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used < self.ttl:
+                break
+            del self._sessions[key]
+            self.expired += 1
@@ -0,0 +1,13 @@
+"""Tiny helpers for Server-Sent Events responses."""
+import json
+
+
+def format_sse(data, event: str = None) -> str:
+    """Encode one SSE message. `data` is JSON-encoded unless it is already a string."""
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in payload.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
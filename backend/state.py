@@ -0,0 +1,204 @@
+"""
+Shared state for running several API workers side by side.
+
+Anything one worker writes that another must see goes through a small
+key-value backend, grouped in namespaces:
+
+    papers    paper_id -> {index_key, filename, chunks, uploaded_at}  (index_store.py)
+    sessions  session key -> chat history, expiring SESSION_TTL after last use  (sessions.py)
+    hot       index key -> last time it was loaded, for warm starts  (index_store.py)
+    answers   index key -> answer cache generation, bumped on invalidate  (answer_cache.py)
+
+Large artifacts stay where they were: FAISS indexes under INDEX_DIR, the paper
+cache, the corpus SQLite, so those directories must be shared too (same host,
+or a network volume when workers run on several hosts).
+
+STATE_BACKEND picks the backend:
+
+- "sqlite" (default): one WAL-mode SQLite file, STATE_PATH. Enough for any
+  number of workers on one host.
+- "redis": any Redis-compatible server at STATE_URL (needs the `redis`
+  package: pip install -r requirements-redis.txt), for workers on several hosts.
+- "memory": process-local dicts. Single worker only; handy in benchmarks.
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_PATH = os.getenv("STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "state.db"))
+STATE_URL = os.getenv("STATE_URL", "redis://localhost:6379/0")
+STATE_PREFIX = os.getenv("STATE_PREFIX", "summarizer:")  # Redis key prefix
+PURGE_EVERY = 500  # SQLite: drop expired rows every this many writes
+
+
+class StateBackend(ABC):
+    """get/set/delete/items over string values; `ttl` is in seconds (None = keep)."""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, ns: str, key: str):
+        ...
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: str, ttl: float = None):
+        ...
+
+    @abstractmethod
+    def delete(self, ns: str, key: str):
+        ...
+
+    @abstractmethod
+    def items(self, ns: str) -> dict:
+        ...
+
+    def get_json(self, ns: str, key: str):
+        value = self.get(ns, key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, ns: str, key: str, value, ttl: float = None):
+        self.set(ns, key, json.dumps(value, ensure_ascii=False), ttl)
+
+    def close(self):
+        pass
+
+
+class MemoryState(StateBackend):
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}  # (ns, key) -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, ns, key):
+        with self._lock:
+            entry = self._data.get((ns, key))
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[(ns, key)]
+                return None
+            return entry[0]
+
+    def set(self, ns, key, value, ttl=None):
+        with self._lock:
+            self._data[(ns, key)] = (value, time.time() + ttl if ttl else None)
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def items(self, ns):
+        now = time.time()
+        with self._lock:
+            return {k: v for (n, k), (v, exp) in self._data.items() if n == ns and (exp is None or exp > now)}
+
+
+class SQLiteState(StateBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = STATE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Several processes write here: wait for their locks instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    ns TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (ns, key)
+                )
+            """)
+
+    def get(self, ns, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM kv WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def set(self, ns, key, value, ttl=None):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                               (ns, key, value, time.time() + ttl if ttl else None))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def delete(self, ns, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def items(self, ns):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE ns = ? AND (expires_at IS NULL OR expires_at > ?)", (ns, time.time())
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisState(StateBackend):
+    name = "redis"
+
+    def __init__(self, url: str = STATE_URL, prefix: str = STATE_PREFIX, client=None):
+        """`client` replaces the connection, e.g. `fakeredis.FakeRedis(decode_responses=True)` in tests."""
+        if client is None:
+            if redis is None:
+                raise RuntimeError("STATE_BACKEND=redis needs the `redis` package (pip install -r requirements-redis.txt)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self._client = client
+        self.prefix = prefix
+
+    def _key(self, ns, key):
+        return f"{self.prefix}{ns}:{key}"
+
+    def get(self, ns, key):
+        return self._client.get(self._key(ns, key))
+
+    def set(self, ns, key, value, ttl=None):
+        self._client.set(self._key(ns, key), value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, ns, key):
+        self._client.delete(self._key(ns, key))
+
+    def items(self, ns):
+        keys = list(self._client.scan_iter(match=self._key(ns, "*"), count=1000))
+        if not keys:
+            return {}
+        start = len(self._key(ns, ""))
+        return {k[start:]: v for k, v in zip(keys, self._client.mget(keys)) if v is not None}
+
+    def close(self):
+        self._client.close()
+
+
+def make_state(backend: str = STATE_BACKEND) -> StateBackend:
+    if backend == "sqlite":
+        return SQLiteState()
+    if backend == "redis":
+        return RedisState()
+    if backend == "memory":
+        return MemoryState()
+    raise ValueError(f"Unknown STATE_BACKEND {backend!r} (sqlite, redis or memory)")
+
+
+state = make_state()
@@ -0,0 +1,202 @@
+"""
+Validation and targeted repair for the JSON summaries (schemas.py).
+
+The summary LLMs are bound to a strict `response_format`, which makes invalid
+output rare but not impossible: an answer can still be cut off at the token
+limit, or a refusal / network hiccup can leave half a document. Rather than
+re-running the whole pipeline, `afinalize`
+
+1. parses what came back, salvaging every complete top-level field of a
+   truncated answer with `IncrementalJSONParser`,
+2. validates it against the schema,
+3. asks the same model for only the missing or invalid fields (same prompt, so
+   the provider's prefix cache covers almost all of the repair's input),
+   merging them in, at most MAX_REPAIR_ROUNDS times.
+
+Fields still invalid after that don't throw the rest of a paid-for answer
+away: the document comes back as is, marked `"partial": true` with the
+problems under `"invalid_fields"`. Callers check `is_partial` and don't
+cache it, so the next request tries again.
+
+`IncrementalJSONParser` also runs on streamed answers, so a stream that stops
+being JSON is noticed on the token that breaks it.
+"""
+import json
+import os
+
+from langchain.messages import AIMessage, HumanMessage
+from pydantic import ConfigDict, ValidationError, create_model
+
+from llm_scheduler import scheduler, estimate_tokens
+from schemas import response_format, to_document
+from telemetry import span, TokenUsageCallback, STRUCTURED_OUTPUTS, REPAIRED_FIELDS
+
+MAX_REPAIR_ROUNDS = int(os.getenv("MAX_REPAIR_ROUNDS", "2"))
+
+REPAIR_PROMPT = (
+    "Your previous answer was cut off or did not match the required schema. "
+    "Return ONLY the following fields, following the same instructions as before:\n"
+    "{problems}"
+)
+
+
+def is_partial(text: str) -> bool:
+    """True for a document afinalize returned with fields it couldn't repair."""
+    try:
+        doc = json.loads(text)
+    except (TypeError, ValueError):
+        return False  # short summaries are prose
+    return isinstance(doc, dict) and doc.get("partial") is True
+
+
+class IncrementalJSONParser:
+    """
+    Feed a JSON object chunk by chunk; each top-level field is returned by
+    `feed` as soon as its value is complete. Text before the opening brace
+    (a markdown fence, say) is skipped. `error` is set on the first character
+    that can't be part of a valid object, `done` once the object is closed.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.started = False
+        self.done = False
+        self.error = None
+        self._stack = []  # expected closing brackets
+        self._member = []  # characters of the current top-level "key": value
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> list[tuple[str, object]]:
+        completed = []
+        for ch in text:
+            if self.done or self.error:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self._stack.append("}")
+                continue
+            if self._in_string:
+                self._member.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                if self._stack[-1] != ch:
+                    self.error = f"unexpected {ch!r}"
+                    break
+                self._stack.pop()
+                if not self._stack:
+                    self._finish_member(completed)
+                    self.done = True
+                    continue
+            elif ch == "," and len(self._stack) == 1:
+                self._finish_member(completed)
+                continue
+            self._member.append(ch)
+        return completed
+
+    def _finish_member(self, completed: list):
+        member = "".join(self._member).strip()
+        self._member = []
+        if not member:
+            return
+        try:
+            (key, value), = json.loads("{" + member + "}").items()
+        except ValueError as e:
+            self.error = f"invalid field {member[:40]!r}: {e}"
+            return
+        self.fields[key] = value
+        completed.append((key, value))
+
+
+def parse_document(text: str) -> dict:
+    """The answer as a dict: all of it if it's valid JSON, else every complete top-level field."""
+    try:
+        doc = json.loads(text)
+    except ValueError:
+        parser = IncrementalJSONParser()
+        parser.feed(text)
+        return parser.fields
+    return doc if isinstance(doc, dict) else {}
+
+
+def invalid_fields(doc: dict, schema) -> dict:
+    """Top-level field -> first validation problem, for every field that is missing or wrong."""
+    try:
+        schema.model_validate(doc)
+        return {}
+    except ValidationError as e:
+        problems = {}
+        for err in e.errors():
+            if err["loc"] and err["loc"][0] in schema.model_fields:
+                problems.setdefault(err["loc"][0], err["msg"])
+        return problems
+
+
+def validate_json(text: str, schema) -> tuple:
+    """afinalize without a model to ask: (pretty JSON, {}) if valid, else (None, problems)."""
+    doc = {k: v for k, v in parse_document(text).items() if k in schema.model_fields}
+    problems = invalid_fields(doc, schema)
+    STRUCTURED_OUTPUTS.labels(schema.__name__, "failed" if problems else "valid").inc()
+    if problems:
+        return None, problems
+    return json.dumps(to_document(schema.model_validate(doc)), indent=4, ensure_ascii=False), {}
+
+
+async def _arepair(schema, problems: dict, llm, messages: list, previous: str, stage: str) -> dict:
+    fields = {name: (schema.model_fields[name].annotation, ...) for name in problems}
+    patch_schema = create_model(f"{schema.__name__}Patch", __config__=ConfigDict(extra="forbid"), **fields)
+    prompt = REPAIR_PROMPT.format(problems="\n".join(f"- {name}: {msg}" for name, msg in problems.items()))
+    repair_messages = [*messages, AIMessage(content=previous), HumanMessage(content=prompt)]
+    bound = llm.bind(response_format=response_format(patch_schema))
+
+    with span(f"{stage}_repair", fields=len(problems)):
+        response = await scheduler.run(
+            lambda: bound.ainvoke(repair_messages, config={"callbacks": [TokenUsageCallback(f"{stage}_repair")]}),
+            tokens=estimate_tokens("".join(str(m.content) for m in repair_messages), completion_tokens=1000),
+            label=f"{schema.__name__} repair",
+        )
+    patch = parse_document(response.content)
+    return {name: patch[name] for name in problems if name in patch}
+
+
+async def afinalize(text: str, schema, llm, messages: list, stage: str) -> str:
+    """
+    `text` (the model's answer to `messages`) validated against `schema`, with
+    broken fields re-requested from `llm`. Returns the document as pretty JSON,
+    marked partial (see is_partial) if some fields are still invalid at the end.
+    """
+    with span("validate", schema=schema.__name__):
+        doc = {k: v for k, v in parse_document(text).items() if k in schema.model_fields}
+        problems = invalid_fields(doc, schema)
+
+    repaired = []
+    for round_no in range(1, MAX_REPAIR_ROUNDS + 1):
+        if not problems:
+            break
+        print(f"[backend] ⚠️ {schema.__name__}: re-requesting {sorted(problems)} (repair round {round_no})")
+        patch = await _arepair(schema, problems, llm, messages, text, stage)
+        doc.update(patch)
+        repaired += list(patch)
+        problems = invalid_fields(doc, schema)
+
+    outcome = "failed" if problems else "repaired" if repaired else "valid"
+    STRUCTURED_OUTPUTS.labels(schema.__name__, outcome).inc()
+    for name in repaired:
+        REPAIRED_FIELDS.labels(schema.__name__, name).inc()
+    if problems:
+        print(f"[backend] ⚠️ {schema.__name__} still invalid after {MAX_REPAIR_ROUNDS} repair rounds: "
+              f"{sorted(problems)}; returning it as partial")
+        return json.dumps({**doc, "partial": True, "invalid_fields": problems}, indent=4, ensure_ascii=False)
+    return json.dumps(to_document(schema.model_validate(doc)), indent=4, ensure_ascii=False)
@@ -5,8 +5,21 @@ from langchain.messages import SystemMessage, HumanMessage
 # from langchain_core.callbacks import UsageMetadataCallbackHandler
 # import PyPDF2
 # import fitz # PyMuPDF
-from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from dotenv import load_dotenv
+import asyncio
+import os
+import threading
+import tiktoken
+from concurrency import pdf_pool, run_in_pool
+from ingest import load_pages
+from pdf_extract import PAGE_SEPARATOR
+from compaction import compact_pages
+from ma_summarizer.agents import SectionSummaryAgent
+from llm_scheduler import scheduler, estimate_tokens
+from telemetry import span, TokenUsageCallback
+from schemas import PaperSummary, response_format
+from structured import afinalize
 
 load_dotenv()
 
@@ -15,125 +28,346 @@ load_dotenv()
 # To get token usage 
 # handler = UsageMetadataCallbackHandler()
 
+SUMMARY_MODEL = "gpt-4o-mini"
+# Bump whenever the summary prompts change so cached summaries are invalidated
+PROMPT_VERSION = "4"
+
+# Papers up to this many tokens go to the model in one call; longer ones are map-reduced.
+# gpt-4o-mini has a 128k window, so leave room for the schema prompt and a long JSON answer.
+SINGLE_CALL_TOKEN_BUDGET = int(os.getenv("SINGLE_CALL_TOKEN_BUDGET", "100000"))
+MAP_CHUNK_TOKENS = int(os.getenv("MAP_CHUNK_TOKENS", "8000"))
+MAP_CHUNK_OVERLAP = int(os.getenv("MAP_CHUNK_OVERLAP", "200"))
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "8"))
+# Partial summaries are merged in groups of at most this many tokens per reduce call
+REDUCE_GROUP_TOKENS = int(os.getenv("REDUCE_GROUP_TOKENS", "12000"))
+MAX_REDUCE_ROUNDS = 5
+MAP_ATTEMPTS = int(os.getenv("MAP_ATTEMPTS", "2"))  # tries per map/reduce chunk before it is dropped
+
 # Initialize langchain chat model 
 llm = ChatOpenAI(
-    model = "gpt-4o-mini",
-    temperature = 0.05
+    model = SUMMARY_MODEL,
+    temperature = 0.05,
+    max_retries = 0,  # retries go through llm_scheduler
+    stream_usage = True  # token counts for streamed calls too
 )
 
-def extract_pdf_text(pdf_path):
-    print("[backend] Extracting text from PDF using LangChain PyMuPDFLoader...")
+# Map/reduce calls reuse the per-section prompt from the multi-agent pipeline
+chunk_agent = SectionSummaryAgent(llm_model=SUMMARY_MODEL)
+
+# tiktoken downloads its BPE file on first use, so the encoding is loaded lazily and
+# token counts fall back to ~4 chars per token when it can't be fetched (offline, sandboxed)
+CHARS_PER_TOKEN = 4
+_encoding = None
+_encoding_lock = threading.Lock()
 
-    # Load the PDF as LangChain documents (each page = one Document)
-    loader = PyMuPDFLoader(pdf_path, mode="page")
-    docs = loader.load()
+def _get_encoding():
+    """tiktoken encoding for SUMMARY_MODEL, or None if it can't be loaded."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    try:
+                        _encoding = tiktoken.encoding_for_model(SUMMARY_MODEL)
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"[backend] tiktoken encoding unavailable ({e}); estimating {CHARS_PER_TOKEN} chars per token")
+                    _encoding = False
+    return _encoding or None
 
-    print(f"[backend] PDF has {len(docs)} pages")
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def split_by_tokens(text: str, chunk_tokens: int = MAP_CHUNK_TOKENS, overlap: int = MAP_CHUNK_OVERLAP) -> list[str]:
+    encoding = _get_encoding()
+    if encoding is None:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_tokens * CHARS_PER_TOKEN,
+                                                  chunk_overlap=overlap * CHARS_PER_TOKEN)
+    else:
+        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=encoding.name, chunk_size=chunk_tokens, chunk_overlap=overlap
+        )
+    return splitter.split_text(text)
 
-    # Concatenate all pages
-    text = "\n".join([d.page_content for d in docs])
+def truncate_to_tokens(text: str, budget: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:budget * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= budget else encoding.decode(tokens[:budget])
 
+def extract_pdf_text(pdf):
+    """Full text of a PDF given as raw bytes or a path (see pdf_extract.page_offsets for page lookups)."""
+    text = PAGE_SEPARATOR.join(load_pages(pdf))
     print(f"[backend] Finished extraction ({len(text)} chars)")
     return text
 
-def summarize_paper_text(paper_text, summary_type="detailed", output_format="json"):
-    print(f"[backend] Starting summarization ({len(paper_text)} chars, type={summary_type}, format={output_format})")
-    system_prompt = (
-        "You are an expert scientific summarizer. "
-        "You will read the entire research paper and produce a thorough, factual, structured summary. "
-        "Be precise and avoid hallucinations."
-    )
+def load_paper_text(pdf, content_hash=None):
+    """extract_pdf_text, sharing the parsed pages of anything we've already seen with these bytes."""
+    return PAGE_SEPARATOR.join(load_pages(pdf, content_hash))
+
+async def aload_paper_text(pdf, content_hash=None):
+    """load_paper_text on the PDF pool so PyMuPDF parsing never blocks the event loop."""
+    return await run_in_pool(pdf_pool, load_paper_text, pdf, content_hash)
+
+def load_summary_text(pdf, content_hash=None):
+    """
+    Paper text as the summarizer sees it: compacted (see compaction.py).
+    Only for summaries; QA and highlighting need the raw text to quote from.
+    """
+    pages = load_pages(pdf, content_hash)
+    with span("compact") as sp:
+        text = compact_pages(pages)
+        before, after = count_tokens(PAGE_SEPARATOR.join(pages)), count_tokens(text)
+        sp.tag(tokens_before=before, tokens_after=after, tokens_saved=before - after)
+    print(f"[backend] Compacted paper text: {before} -> {after} tokens")
+    return text
+
+async def aload_summary_text(pdf, content_hash=None):
+    return await run_in_pool(pdf_pool, load_summary_text, pdf, content_hash)
 
+# -------------------------------
+# Prompts: static instructions + schema first, paper text last.
+# OpenAI reuses a cached prompt prefix (>= 1024 identical leading tokens), so
+# everything that's the same for every paper has to come before the paper.
+# -------------------------------
+SUMMARY_SYSTEM_PROMPT = (
+    "You are an expert scientific summarizer. "
+    "You will read the entire research paper and produce a thorough, factual, structured summary. "
+    "Be precise and avoid hallucinations."
+)
+
+SHORT_SUMMARY_INSTRUCTIONS = (
+    "Provide a concise summary (3–5 bullet points or one paragraph) "
+    "highlighting the paper’s objectives, methods, and findings."
+)
+
+DETAILED_SUMMARY_INSTRUCTIONS = """You are an expert machine learning research assistant.
+
+Your task:
+Produce an extremely detailed summary of the paper with a strong focus on
+machine learning methods, data engineering, feature engineering, training
+pipeline, evaluation details, and detailed results.
+
+You MUST:
+- Follow the JSON schema as given below.
+- Do NOT add or remove fields.
+- Do NOT rename fields.
+- Do NOT change the structure.
+- All values must be strings, except where arrays or objects are explicitly required.
+- If the paper does NOT explicitly mention a detail (e.g., optimizer, loss, version, batch size, hidden dimensions), you MUST write: "not specified".
+- Do NOT infer or guess under any circumstances.
+- Ensure the output is valid JSON.
+- Include version information for the model if present in the paper (e.g., v1, v2, “2023 version”). If not mentioned, set: "version": "not specified".
+
+Here is the REQUIRED JSON schema you MUST follow:
+
+{
+    "name_of_research_paper": "YoloV5",
+    "objective": "... let the machine see light ...",
+    "paper_metadata": {
+        "title": "...",
+        "authors": ["..."],
+        "publication_venue": "...",
+        "publication_year": "number",
+        "doi": "...",
+        "research_domain": "string (e.g., Computer Vision, NLP, Machine Learning, etc.)",
+        "paper_type": "string (e.g., Empirical Study, Theoretical Analysis, Survey, etc.)"
+        },
+    "models": [
+        {
+            "name": "YoloV5",
+            "version": "vX.X or not specified",
+            "input": "image...",
+            "output": "metadata...",
+            "machine_learning_category": "object detection",
+            "data_engineering": "...",
+            "feature_engineering": "...",
+            "model_training": {
+                "optimizer": "...",
+                "loss_function": "...",
+                "learning_rate": "...",
+                "epochs": "...",
+                "batch_size": "...",
+                "training_pipeline": "...",
+                "early_stopping": "...",
+                "other_hyperparameters": "..."
+            },
+            "model_evaluation": {
+                "evaluation_metrics": "...",
+                "baselines_compared": "...",
+                "experimental_setup": "..."
+            },
+            "model_results": "...",
+            "limitations_and_implications": "..."
+        }
+    ],
+    "key_findings": "..."
+}
+
+You MUST produce only JSON as the output. No explanations, no commentary, no markdown.
+The research paper follows in the next message."""
+
+def summary_static_prompt(summary_type="detailed") -> str:
+    """Everything before the paper text: identical across papers, so it's the cacheable prefix."""
+    instructions = SHORT_SUMMARY_INSTRUCTIONS if summary_type == "short" else DETAILED_SUMMARY_INSTRUCTIONS
+    return f"{SUMMARY_SYSTEM_PROMPT}\n\n{instructions}"
+
+def build_summary_messages(paper_text, summary_type="detailed"):
     if summary_type == "short":
-        user_prompt = (
-            "Provide a concise summary (3–5 bullet points or one paragraph) "
-            "highlighting the paper’s objectives, methods, and findings.\n\n"
-            f"Paper text:\n{paper_text}"
-        )
+        user_prompt = f"Paper text:\n{paper_text}"
     else:
-        user_prompt = (
-            f"""
-            You are an expert machine learning research assistant. 
-
-
-            Here is the full text of a research paper:
-
-            {paper_text}
-
-            Your task:
-            Produce an extremely detailed summary of the paper with a strong focus on
-            machine learning methods, data engineering, feature engineering, training
-            pipeline, evaluation details, and detailed results.
-
-            You MUST:
-            - Follow the JSON schema as given below with pretty print.
-            - Do NOT add or remove fields.
-            - Do NOT rename fields.
-            - Do NOT change the structure.
-            - All values must be strings, except where arrays or objects are explicitly required.
-            - If the paper does NOT explicitly mention a detail (e.g., optimizer, loss, version, batch size, hidden dimensions), you MUST write: "not specified".
-            - Do NOT infer or guess under any circumstances.
-            - Ensure the output is valid JSON.
-            - Include version information for the model if present in the paper (e.g., v1, v2, “2023 version”). If not mentioned, set: "version": "not specified".
-
-            Here is the REQUIRED JSON schema you MUST follow:
-
-            {{
-                "name_of_research_paper": "YoloV5",
-                "objective": "... let the machine see light ...",
-                "paper_metadata": {{
-                    "title": "...",
-                    "authors": ["..."],
-                    "publication_venue": "...",
-                    "publication_year": "number",
-                    "doi": "...",
-                    "research_domain": "string (e.g., Computer Vision, NLP, Machine Learning, etc.)",
-                    "paper_type": "string (e.g., Empirical Study, Theoretical Analysis, Survey, etc.)"
-                    }},
-                "models": [
-                    {{
-                        "YoloV5": {{
-                            "name": "YoloV5",
-                            "version": "vX.X or not specified",
-                            "input": "image...",
-                            "output": "metadata...",
-                            "machine_learning_category": "object detection",
-                            "data_engineering": "...",
-                            "feature_engineering": "...",
-                            "model_training": {{
-                                "optimizer": "...",
-                                "loss_function": "...",
-                                "learning_rate": "...",
-                                "epochs": "...",
-                                "batch_size": "...",
-                                "training_pipeline": "...",
-                                "early_stopping": "...",
-                                "other_hyperparameters": "..."
-                            }},
-                            "model_evaluation": {{
-                                "evaluation_metrics": "...",
-                                "baselines_compared": "...",
-                                "experimental_setup": "..."
-                            }},
-                            "model_results": "...",
-                            "limitations_and_implications": "..."
-                        }}
-                    }}
-                ],
-                "key_findings": "..."
-            }}
-
-            You MUST produce only JSON as the output. No explanations, no commentary, no markdown.
-            """
-        )
+        user_prompt = f"Here is the full text of a research paper:\n\n{paper_text}"
 
     # utilise LangChain's structured messages
-    messages = [
-        SystemMessage(content=system_prompt),
+    return [
+        SystemMessage(content=summary_static_prompt(summary_type)),
         HumanMessage(content=user_prompt)
     ]
+
+def summary_llm(summary_type="detailed"):
+    """Detailed summaries are JSON: ask for it natively, with PaperSummary as a strict response_format."""
+    return llm if summary_type == "short" else llm.bind(response_format=response_format(PaperSummary))
+
+async def afinalize_summary(text, paper_text, summary_type="detailed"):
+    """Validate a detailed summary, re-requesting only broken fields (see structured.py). Short ones are prose."""
+    if summary_type == "short":
+        return text
+    return await afinalize(text, PaperSummary, llm, build_summary_messages(paper_text, summary_type), "summary_llm")
+
+def summarize_paper_text(paper_text, summary_type="detailed", output_format="json"):
+    print(f"[backend] Starting summarization ({len(paper_text)} chars, type={summary_type}, format={output_format})")
+    messages = build_summary_messages(paper_text, summary_type)
     
-    response = llm.invoke(messages)
+    response = summary_llm(summary_type).invoke(messages)
 
     return response.content
     # return response.choices[0].message.content
+
+async def asummarize_paper_text(paper_text, summary_type="detailed", output_format="json"):
+    """Async twin of summarize_paper_text for use inside request handlers."""
+    print(f"[backend] Starting async summarization ({len(paper_text)} chars, type={summary_type}, format={output_format})")
+    messages = build_summary_messages(paper_text, summary_type)
+
+    bound = summary_llm(summary_type)
+    with span("summary_llm", summary_type=summary_type):
+        response = await scheduler.run(
+            lambda: bound.ainvoke(messages, config={"callbacks": [TokenUsageCallback("summary_llm")]}),
+            tokens=estimate_tokens(messages[0].content + messages[-1].content, completion_tokens=4000),
+            label="paper summary",
+        )
+
+    return await afinalize_summary(response.content, paper_text, summary_type)
+
+# -------------------------------
+# Map-reduce for papers that don't fit one call
+# -------------------------------
+async def _amap_summaries(parts: list[str], label: str, semaphore: asyncio.Semaphore) -> list[str]:
+    """
+    Summaries of `parts`, in order. A part that still fails after MAP_ATTEMPTS
+    tries is left out rather than failing the paper; only if every part fails
+    is the first error raised.
+    """
+    async def summarize_one(i, part):
+        async with semaphore:
+            return await chunk_agent.asummarize(f"{label} {i + 1} of {len(parts)}", part, stage="map_llm")
+
+    results = [None] * len(parts)
+    pending = list(range(len(parts)))
+    for attempt in range(1, MAP_ATTEMPTS + 1):
+        outcomes = await asyncio.gather(*(summarize_one(i, parts[i]) for i in pending), return_exceptions=True)
+        failed = []
+        for i, outcome in zip(pending, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, Exception):
+                print(f"[backend] {label} {i + 1} of {len(parts)} failed (attempt {attempt}): {outcome}")
+                failed.append((i, outcome))
+            else:
+                results[i] = outcome
+        pending = [i for i, _ in failed]
+        if not pending:
+            break
+    if pending:
+        if len(pending) == len(parts):
+            raise failed[0][1]
+        print(f"[backend] Dropping {len(pending)} of {len(parts)} {label.lower()} summaries that kept failing")
+    return [r for r in results if r is not None]
+
+def _group_by_tokens(summaries: list[str], budget: int) -> list[str]:
+    """Greedily pack consecutive summaries into groups of at most `budget` tokens."""
+    groups, current, current_tokens = [], [], 0
+    for summary in summaries:
+        tokens = count_tokens(summary)
+        if current and current_tokens + tokens > budget:
+            groups.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+async def acondense_paper_text(paper_text: str):
+    """
+    Return (text, mode) where text fits SINGLE_CALL_TOKEN_BUDGET.
+
+    Short papers come back unchanged ("single"). Long ones are split on a token
+    budget, each chunk is summarized concurrently (bounded by MAP_CONCURRENCY),
+    and the partial summaries are merged hierarchically until they fit ("map-reduce").
+    Notes still over budget after MAX_REDUCE_ROUNDS are truncated to it ("map-reduce-truncated").
+    """
+    with span("chunk") as sp:
+        n_tokens = await run_in_pool(pdf_pool, count_tokens, paper_text)
+        sp.tag(paper_tokens=n_tokens)
+        if n_tokens <= SINGLE_CALL_TOKEN_BUDGET:
+            print(f"[backend] Paper is {n_tokens} tokens, summarizing in a single call")
+            sp.tag(mode="single")
+            return paper_text, "single"
+
+        chunks = await run_in_pool(pdf_pool, split_by_tokens, paper_text)
+        sp.tag(mode="map-reduce", chunks=len(chunks))
+
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    print(f"[backend] Paper is {n_tokens} tokens, map-reducing over {len(chunks)} chunks")
+    summaries = await _amap_summaries(chunks, "Part", semaphore)
+
+    for round_no in range(1, MAX_REDUCE_ROUNDS + 1):
+        notes = "\n\n".join(summaries)
+        if len(summaries) == 1 or await run_in_pool(pdf_pool, count_tokens, notes) <= SINGLE_CALL_TOKEN_BUDGET:
+            break
+        groups = await run_in_pool(pdf_pool, _group_by_tokens, summaries, REDUCE_GROUP_TOKENS)
+        print(f"[backend] Reduce round {round_no}: {len(summaries)} summaries -> {len(groups)} groups")
+        summaries = await _amap_summaries(groups, "Combined notes", semaphore)
+
+    notes = "\n\n".join(f"### Part {i + 1}\n{s}" for i, s in enumerate(summaries))
+    text = f"(Section-by-section notes covering the whole paper, in order)\n\n{notes}"
+    # Reduce rounds ran out with the notes still too long: cut them to the budget rather than overflow the window
+    n_tokens = await run_in_pool(pdf_pool, count_tokens, text)
+    if n_tokens > SINGLE_CALL_TOKEN_BUDGET:
+        print(f"[backend] Notes still {n_tokens} tokens after {MAX_REDUCE_ROUNDS} reduce rounds, "
+              f"truncating to {SINGLE_CALL_TOKEN_BUDGET}")
+        text = await run_in_pool(pdf_pool, truncate_to_tokens, text, SINGLE_CALL_TOKEN_BUDGET)
+        return text, "map-reduce-truncated"
+    return text, "map-reduce"
+
+async def asummarize_paper(paper_text, summary_type="detailed"):
+    """Summarize a paper of any length, picking single-call or map-reduce from its token count."""
+    text, mode = await acondense_paper_text(paper_text)
+    print(f"[backend] Summary input ready ({mode}, {len(text)} chars)")
+    return await asummarize_paper_text(text, summary_type)
+
+async def astream_summary(paper_text, summary_type="detailed"):
+    """Yield summary tokens as the model produces them (validate the joined text with afinalize_summary)."""
+    print(f"[backend] Starting streamed summarization ({len(paper_text)} chars, type={summary_type})")
+    messages = build_summary_messages(paper_text, summary_type)
+
+    with span("summary_llm", summary_type=summary_type, streamed=True):
+        async with scheduler.slot(estimate_tokens(messages[0].content + messages[-1].content, completion_tokens=4000)):
+            async for chunk in summary_llm(summary_type).astream(messages, config={"callbacks": [TokenUsageCallback("summary_llm")]}):
+                if chunk.content:
+                    yield chunk.content
@@ -0,0 +1,224 @@
+"""
+Per-request tracing and Prometheus metrics for the summarization pipelines.
+
+    with span("pdf_extract", bytes=len(pdf_bytes)) as sp:
+        ...
+        sp.tag(pages=n)
+
+Every span lands in three places:
+- the `summarizer_stage_seconds{stage}` histogram (p50/p99 per stage on /metrics),
+- the current request's trace, printed as one JSON line when the request ends,
+- an OpenTelemetry span, if opentelemetry is installed and OTEL_TRACING=1.
+
+With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py does it), every worker
+process writes its samples there and /metrics sums them across workers.
+
+LLM token usage is collected with `TokenUsageCallback(stage)` passed in the
+LangChain call config, and cache lookups with `record_cache`. The callback
+class is built on first use, so importing this module doesn't load LangChain.
+"""
+import contextvars
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:
+    _otel_trace = None
+
+_tracer = _otel_trace.get_tracer("paper-summarizer") if _otel_trace and os.getenv("OTEL_TRACING") == "1" else None
+
+STAGE_SECONDS = Histogram(
+    "summarizer_stage_seconds", "Wall time per pipeline stage", ["stage", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+REQUEST_SECONDS = Histogram(
+    "summarizer_request_seconds", "Wall time per HTTP request", ["endpoint", "status"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320),
+)
+LLM_TOKENS = Counter("summarizer_llm_tokens_total", "LLM tokens by stage", ["stage", "direction"])
+PAPER_TOKENS = Histogram(
+    "summarizer_paper_tokens", "Total LLM tokens (in+out) spent per request", ["endpoint"],
+    buckets=(0, 1e3, 5e3, 1e4, 2.5e4, 5e4, 1e5, 2e5, 5e5, 1e6),
+)
+UPLOAD_BYTES = Histogram(
+    "summarizer_upload_bytes", "Uploaded PDF size", buckets=(1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7),
+)
+CACHE_EVENTS = Counter("summarizer_cache_events_total", "Cache lookups", ["kind", "result"])
+# Structured (JSON) summaries: outcome is valid / repaired / failed. Repair calls book their
+# tokens under "<stage>_repair" in LLM_TOKENS, so the re-request rate and its cost are both visible.
+STRUCTURED_OUTPUTS = Counter("summarizer_structured_outputs_total", "JSON summaries by validation outcome",
+                             ["schema", "outcome"])
+REPAIRED_FIELDS = Counter("summarizer_repaired_fields_total", "Summary fields re-requested after validation",
+                          ["schema", "field"])
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+_current = contextvars.ContextVar("summarizer_trace", default=None)
+
+
+class Span:
+    def __init__(self, name: str, tags: dict):
+        self.name = name
+        self.tags = tags
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = "ok"
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    @property
+    def elapsed(self) -> float:
+        return self.duration if self.duration is not None else time.perf_counter() - self.start
+
+
+class RequestTrace:
+    def __init__(self, endpoint: str, **tags):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.tags = tags
+        self.spans = []
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.tokens_cached = 0  # part of tokens_in served from OpenAI's prompt cache
+        self.cache = {}
+        self.start = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            **self.tags,
+            "duration_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_cached": self.tokens_cached,
+            "cache": self.cache,
+            "spans": [
+                {"stage": s.name, "ms": round(s.elapsed * 1000, 1), "status": s.status, **s.tags}
+                for s in self.spans
+            ],
+        }
+
+
+def set_tags(**tags):
+    """Attach tags (paper_id, bytes, ...) to the current request trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.tags.update(tags)
+    if "bytes" in tags:
+        UPLOAD_BYTES.observe(tags["bytes"])
+
+
+@contextmanager
+def request_trace(endpoint: str, **tags):
+    """Open a trace for one request; prints it as a JSON line and records metrics when done."""
+    trace = RequestTrace(endpoint, **tags)
+    token = _current.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        REQUEST_SECONDS.labels(endpoint, status).observe(time.perf_counter() - trace.start)
+        if trace.tokens_in or trace.tokens_out:
+            PAPER_TOKENS.labels(endpoint).observe(trace.tokens_in + trace.tokens_out)
+        if trace.spans:
+            print("[trace] " + json.dumps(trace.as_dict(), default=str))
+
+
+@contextmanager
+def span(stage: str, **tags):
+    sp = Span(stage, tags)
+    trace = _current.get()
+    if trace is not None:
+        trace.spans.append(sp)
+    otel = _tracer.start_as_current_span(stage) if _tracer is not None else None
+    otel_span = otel.__enter__() if otel is not None else None
+    try:
+        yield sp
+    except BaseException:
+        sp.status = "error"
+        raise
+    finally:
+        sp.duration = time.perf_counter() - sp.start
+        STAGE_SECONDS.labels(stage, sp.status).observe(sp.duration)
+        if otel_span is not None:
+            for key, value in {**(trace.tags if trace else {}), **sp.tags}.items():
+                if isinstance(value, (str, int, float, bool)):
+                    otel_span.set_attribute(key, value)
+            otel.__exit__(None, None, None)
+
+
+def record_tokens(stage: str, tokens_in: int, tokens_out: int, tokens_cached: int = 0):
+    """`tokens_cached` is the part of `tokens_in` that hit the provider's prompt-prefix cache."""
+    LLM_TOKENS.labels(stage, "in").inc(tokens_in)
+    LLM_TOKENS.labels(stage, "out").inc(tokens_out)
+    LLM_TOKENS.labels(stage, "cached").inc(tokens_cached)
+    trace = _current.get()
+    if trace is not None:
+        trace.tokens_in += tokens_in
+        trace.tokens_out += tokens_out
+        trace.tokens_cached += tokens_cached
+
+
+def record_cache(kind: str, hit: bool):
+    result = "hit" if hit else "miss"
+    CACHE_EVENTS.labels(kind, result).inc()
+    trace = _current.get()
+    if trace is not None:
+        trace.cache[f"{kind}_{result}"] = trace.cache.get(f"{kind}_{result}", 0) + 1
+
+
+def metrics_payload() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def _token_usage_callback_class():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TokenUsageCallback(BaseCallbackHandler):
+        """LangChain callback that books each LLM call's token usage under `stage`."""
+
+        def __init__(self, stage: str):
+            self.stage = stage
+
+        def on_llm_end(self, response, **kwargs):
+            tokens_in = tokens_out = tokens_cached = 0
+            for generations in response.generations:
+                for gen in generations:
+                    usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                    if usage:
+                        tokens_in += usage.get("input_tokens", 0)
+                        tokens_out += usage.get("output_tokens", 0)
+                        tokens_cached += (usage.get("input_token_details") or {}).get("cache_read", 0)
+            if not (tokens_in or tokens_out):
+                usage = (response.llm_output or {}).get("token_usage") or {}
+                tokens_in = usage.get("prompt_tokens", 0)
+                tokens_out = usage.get("completion_tokens", 0)
+                tokens_cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+            if tokens_in or tokens_out:
+                record_tokens(self.stage, tokens_in, tokens_out, tokens_cached)
+
+    return TokenUsageCallback
+
+
+def __getattr__(name):
+    if name == "TokenUsageCallback":
+        globals()[name] = cls = _token_usage_callback_class()
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
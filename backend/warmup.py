@@ -0,0 +1,79 @@
+"""
+Deferred loading of the heavy parts of the API.
+
+qa and pipelines pull in LangChain, FAISS, lxml and numpy and build the
+OpenAI clients when imported, which used to happen while uvicorn imported
+main.py, before it could accept a single connection. main.py now only
+imports light modules; its lifespan hook calls `services.start()`, which
+imports the heavy ones once, in a thread, then runs their warm-up hooks
+(e.g. preloading hot FAISS indexes). Endpoints `await services.get("qa")`:
+instant once loaded, otherwise they wait for the load in progress.
+
+`/health` answers as soon as the process is up; `/ready` returns 503 until
+`services.ready`, so a load balancer only routes to warmed replicas.
+"""
+import asyncio
+import importlib
+import os
+import time
+
+from concurrency import io_pool, run_in_pool
+
+# Set WARM_START=0 to load on the first request that needs a module instead of at startup
+WARM_START = os.getenv("WARM_START", "1") != "0"
+
+
+class Services:
+    def __init__(self, modules: tuple, warmups: dict = None):
+        self.names = modules
+        self.warmups = warmups or {}  # module name -> name of a blocking function to call after import
+        self.modules = {}
+        self.timings = {}  # name -> seconds spent importing / warming
+        self.error = None
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._task is not None and self._task.done() and self.error is None
+
+    def loaded(self, name: str) -> bool:
+        return name in self.modules
+
+    def start(self):
+        """Begin loading in the background (idempotent)."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(run_in_pool(io_pool, self._load))
+        return self._task
+
+    async def get(self, name: str):
+        if name not in self.modules:
+            await asyncio.shield(self.start())
+        return self.modules[name]
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "loading": self._task is not None and not self._task.done(),
+            "loaded": sorted(self.modules),
+            "seconds": {k: round(v, 3) for k, v in self.timings.items()},
+            "error": self.error,
+        }
+
+    def _load(self):
+        try:
+            for name in self.names:
+                t0 = time.perf_counter()
+                self.modules[name] = importlib.import_module(name)
+                self.timings[name] = time.perf_counter() - t0
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            raise
+        for name, fn in self.warmups.items():
+            # A failed warm-up only costs speed: the same work happens again on first use
+            t0 = time.perf_counter()
+            try:
+                result = getattr(self.modules[name], fn)()
+                print(f"[🔥] {name}.{fn}: {result}")
+            except Exception as e:
+                print(f"[⚠️] Warm-up {name}.{fn} failed: {e}")
+            self.timings[f"{name}.{fn}"] = time.perf_counter() - t0
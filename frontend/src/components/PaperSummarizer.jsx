@@ -1,6 +1,16 @@
 import { useState, useEffect } from "react";
 import ReactMarkdown from "react-markdown";
 
+// One QA session id per browser, so users don't share chat history
+function getSessionId() {
+  let id = localStorage.getItem("qaSessionId");
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem("qaSessionId", id);
+  }
+  return id;
+}
+
 export default function PaperSummarizer({ 
   setFileUrl, 
   setFilename: setFilenameProp, 
@@ -14,7 +24,7 @@ export default function PaperSummarizer({
   const [paperId, setPaperId] = useState(null);
   const [filename, setFilename] = useState("");
   const [loading, setLoading] = useState(false);
-  const [progress, setProgress] = useState(""); // new progress log text
+  const [progress, setProgress] = useState(""); // live job progress from the backend
 
   const [conversation, setConversation] = useState([]);
   const [currentQuestion, setCurrentQuestion] = useState("");
@@ -75,12 +85,70 @@ export default function PaperSummarizer({
     if (onUpdateChatHistory) onUpdateChatHistory(all);
   }, [paperId, conversation, filename]); // any of these change, the hook will be triggered
   
+  // Human-readable line for a job progress event from the backend
+  const describeProgress = (event) => {
+    if (event.type === "snapshot") {
+      const job = event.job;
+      if (job.status === "queued") {
+        return job.queue_position != null
+          ? `Queued (position ${job.queue_position + 1})...`
+          : "Queued...";
+      }
+      return `Job ${job.status}${job.stage ? ` (${job.stage})` : ""}...`;
+    }
+    if (event.type === "running") return "Worker picked up the job...";
+    if (event.type === "progress") {
+      const labels = {
+        extract: "Extracting text from PDF",
+        chunk: "Splitting paper into sections",
+        summarize: "Summarizing",
+        aggregate: "Combining section summaries",
+      };
+      const label = labels[event.stage] || event.stage;
+      if (event.total) return `${label} (${event.done}/${event.total})...`;
+      return event.status === "done" ? `${label} ✅` : `${label}...`;
+    }
+    return "";
+  };
+
+  // Subscribe to a job's SSE stream; resolves with the final result
+  const waitForJob = (jobId) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(`http://localhost:5000/jobs/${jobId}/events`);
+      const handle = (e) => {
+        const event = JSON.parse(e.data);
+        const text = describeProgress(event);
+        if (text) setProgress(text);
+        if (event.type === "snapshot" && event.job.status === "done") {
+          source.close();
+          resolve(event.job.result);
+        } else if (event.type === "snapshot" && event.job.status === "failed") {
+          source.close();
+          reject(new Error(event.job.error));
+        }
+      };
+      ["snapshot", "running", "progress"].forEach((t) => source.addEventListener(t, handle));
+      source.addEventListener("done", (e) => {
+        source.close();
+        resolve(JSON.parse(e.data).result);
+      });
+      source.addEventListener("failed", (e) => {
+        source.close();
+        reject(new Error(JSON.parse(e.data).error));
+      });
+      source.onerror = () => {
+        source.close();
+        reject(new Error("Lost connection to job progress stream"));
+      };
+    });
+
   const handleSubmit = async () => {
     if (!file) return alert("Please upload a PDF");
   
     const formData = new FormData();
     formData.append("pdf", file);
     formData.append("summary_type", summaryType);
+    formData.append("mode", "summary");
   
     console.log("[1] Uploading PDF:", file.name);
     setProgress("Uploading PDF...");
@@ -88,18 +156,16 @@ export default function PaperSummarizer({
     setSummary(""); // clear old summary
   
     try {
-      console.log("[2] Sending request to backend...");
-      setProgress("Sending request to summarizer backend...");
-  
-      const res = await fetch("http://localhost:5000/summarize", {
+      console.log("[2] Submitting summarization job...");
+      const res = await fetch("http://localhost:5000/jobs", {
         method: "POST",
         body: formData,
       });
+      const job = await res.json();
+      if (!res.ok) throw new Error(job.error || `HTTP ${res.status}`);
+      console.log("[3] Job queued:", job.job_id);
   
-      console.log("[3] Response received, parsing JSON...");
-      setProgress("Processing response...");
-  
-      const data = await res.json();
+      const data = await waitForJob(job.job_id);
       console.log("[4] Summary received from backend:", data);
   
       setSummary(data.summary || "⚠️ Error: No summary returned.");
@@ -158,24 +224,51 @@ export default function PaperSummarizer({
     setConversation(prev => [...prev, { role: "assistant", content: "Thinking..." }]);
   
     const form = new FormData()
-    form.append("session_id", "user123");
+    form.append("session_id", getSessionId());
     form.append("paper_id", filename);
     form.append("question", questionToSend);
   
-    try {
-      const res = await fetch("http://localhost:5000/ask", {
-        method: "POST",
-        body: form
-      });
-  
-      const data = await res.json();
-  
-      // Replace "Thinking..." with actual answer
+    // Replace the last (assistant) message with `content`
+    const setLastAnswer = (content) =>
       setConversation(prev => {
         const updated = [...prev];
-        updated[updated.length - 1] = { role: "assistant", content: data.answer || "Error generating answer" };
+        updated[updated.length - 1] = { role: "assistant", content };
         return updated;
       });
+
+    try {
+      const res = await fetch("http://localhost:5000/ask/stream", {
+        method: "POST",
+        body: form
+      });
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+
+      // Read the SSE stream and append tokens as they arrive
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let answerSoFar = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split("\n\n");
+        buffer = messages.pop();
+        for (const message of messages) {
+          const event = message.match(/^event: (.*)$/m)?.[1];
+          const data = message.match(/^data: (.*)$/m)?.[1];
+          if (!data) continue;
+          const payload = JSON.parse(data);
+          if (event === "token") {
+            answerSoFar += payload.text;
+            setLastAnswer(answerSoFar);
+          } else if (event === "done") {
+            setLastAnswer(payload.answer || "Error generating answer");
+          } else if (event === "error") {
+            throw new Error(payload.error);
+          }
+        }
+      }
   
     } catch (error) {
       console.error("❌ Failed to get answer:", error);